@@ -1,22 +1,66 @@
 # app_stockinfo.py
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, g
 from elasticsearch import Elasticsearch
-import math
+import os
+import time
+import logging
+import metrics
+from metrics import Timings, log_sampled, record_request
+from search_backends import CursorExpiredError, create_backend
+from search_cache import create_search_cache, normalize_search_key
+from search_service import (ES_HOSTS, EXPORT_FORMATS, INDEX_NAME, build_search_request,
+                            export_chunk, export_header, is_admin, msearch_error, msearch_response_body,
+                            parse_export_args, parse_msearch_specs, parse_search_args, search_cache_key,
+                            search_response, summarize_profile, tags_response)
+from suggest_index import SuggestIndex
+from tag_dictionary import TagDictionary
+
+# 日志级别可用环境变量 LOG_LEVEL 调整；设为 DEBUG 时采样日志会带上命中的文档 id
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'), format='%(asctime)s - %(levelname)s - %(message)s')
+# ES 客户端默认每个请求记录一条 INFO 日志，只保留警告和错误
+logging.getLogger('elastic_transport').setLevel(logging.WARNING)
 
 # 初始化Flask应用
 app = Flask(__name__)
 
-# Elasticsearch连接配置
-es = Elasticsearch(
-    hosts=[{
-        'host': '10.0.0.215',
-        'port': 9200,
-        'scheme': 'http'
-    }]
-)
+# Elasticsearch连接配置（可用环境变量 ES_URL 覆盖，见 search_service.ES_HOSTS）
+es = Elasticsearch(hosts=ES_HOSTS)
+
+# /search、/question、/tags 的查询后端：ES 不可用时自动改查本地全文库（见 search_backends）
+backend = create_backend(es)
+
+# 查询结果缓存：导入工具发布新数据后自动失效
+search_cache = create_search_cache()
+
+# 导入工具预先生成的标签词典，/tags 优先从内存返回
+tag_dictionary = TagDictionary(dumps=app.json.dumps)
+
+# 导入工具预先生成的输入提示词典，/suggest 在内存中做前缀匹配
+suggest_index = SuggestIndex()
+
+# /tags 响应允许浏览器缓存的时间（秒），配合 ETag 做协商缓存
+TAGS_MAX_AGE = 60
+
+# /suggest 响应允许浏览器缓存的时间（秒）
+SUGGEST_MAX_AGE = 60
 
-# 索引名称
-INDEX_NAME = 'stockinfo'
+metrics.registry.add_collector(metrics.cache_collector(search_cache))
+
+
+@app.before_request
+def start_timer():
+    g.timings = Timings()
+
+
+@app.after_request
+def record_metrics(response):
+    """记录每个请求的耗时、响应大小和状态码，并输出 Server-Timing 响应头"""
+    timings = g.get('timings')
+    if timings is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        response.headers['Server-Timing'] = record_request(route, request.method, response.status_code,
+                                                           response.content_length, timings)
+    return response
 
 
 @app.route('/')
@@ -25,194 +69,192 @@ def index():
     return render_template('index.html')
 
 
-@app.route('/search', methods=['GET'])
-def search():
-    """处理搜索请求"""
-    # 获取查询参数
-    query = request.args.get('q', '').strip()
-    page = int(request.args.get('page', 1))
-    size = int(request.args.get('size', 10))
-    search_type = request.args.get('type', 'fulltext')  # 查询类型: fulltext(全文) 或 precise(精准)
-    field_filter = request.args.get('field', 'all')  # 字段过滤
-
-    # 构建Elasticsearch查询
-    if query:
-        if search_type == 'precise':
-            # 精准查询 - 使用term查询
-            if field_filter != 'all':
-                # 指定字段精准查询
-                search_body = {
-                    "query": {
-                        "term": {f"{field_filter}.keyword": query}
-                    }
-                }
-            else:
-                # 多字段精准查询
-                search_body = {
-                    "query": {
-                        "bool": {
-                            "should": [
-                                {"term": {"题干.keyword": query}},
-                                {"term": {"选项A.keyword": query}},
-                                {"term": {"选项B.keyword": query}},
-                                {"term": {"选项C.keyword": query}},
-                                {"term": {"选项D.keyword": query}},
-                                {"term": {"选项E.keyword": query}},
-                                {"term": {"选项F.keyword": query}},
-                                {"term": {"选项G.keyword": query}},
-                                {"term": {"选项H.keyword": query}},
-                                {"term": {"答案.keyword": query}},
-                                {"wildcard": {"标签.keyword": f"*{query}*"}},  # 修改为wildcard查询支持模糊匹配
-                                {"term": {"解析.keyword": query}}
-                            ],
-                            "minimum_should_match": 1
-                        }
-                    }
-                }
-        else:
-            # 全文搜索 - 使用multi_match查询
-            if field_filter != 'all':
-                # 指定字段搜索
-                search_body = {
-                    "query": {
-                        "match": {
-                            field_filter: {
-                                "query": query,
-                                "operator": "or"
-                            }
-                        }
-                    },
-                    "highlight": {
-                        "pre_tags": ["<span class='highlight'>"],
-                        "post_tags": ["</span>"],
-                        "fields": {
-                            field_filter: {}
-                        }
-                    }
-                }
-            else:
-                # 全字段搜索 - 优化版本，支持短语匹配和分词匹配
-                search_body = {
-                    "query": {
-                        "bool": {
-                            "should": [
-                                {
-                                    "multi_match": {
-                                        "query": query,
-                                        "fields": ["题干^3", "选项A^2", "选项B^2", "选项C^2", "选项D^2",
-                                                   "选项E^2", "选项F^2", "选项G^2", "选项H^2", "解析", "标签^2"],
-                                        "type": "phrase",
-                                        "boost": 3
-                                    }
-                                },
-                                {
-                                    "multi_match": {
-                                        "query": query,
-                                        "fields": ["题干^2", "选项A", "选项B", "选项C", "选项D",
-                                                   "选项E", "选项F", "选项G", "选项H", "解析", "标签"],
-                                        "operator": "or",
-                                        "boost": 1
-                                    }
-                                }
-                            ],
-                            "minimum_should_match": 1
-                        }
-                    },
-                    "highlight": {
-                        "pre_tags": ["<span class='highlight'>"],
-                        "post_tags": ["</span>"],
-                        "fields": {
-                            "题干": {},
-                            "选项A": {},
-                            "选项B": {},
-                            "选项C": {},
-                            "选项D": {},
-                            "选项E": {},
-                            "选项F": {},
-                            "选项G": {},
-                            "选项H": {},
-                            "解析": {},
-                            "标签": {}
-                        }
-                    }
-                }
-    else:
-        # 如果没有查询词，返回所有文档
-        search_body = {
-            "query": {
-                "match_all": {}
-            }
-        }
+def profile_search(params):
+    """
+    查询分析（?profile=1，仅管理员）：返回实际发送的查询体、ES profile 原始输出及按子句汇总的耗时，
+    以及网站侧测得的耗时；不读写缓存
+    """
+    if not is_admin(request.headers):
+        return jsonify({'error': '查询分析仅限管理员（请求头 X-Admin-Token）'}), 403
+    if params['search_after'] is not None:
+        return jsonify({'error': '查询分析不支持游标翻页'}), 400
 
-    try:
-        # 执行搜索
+    search_body = build_search_request(params)
+    with g.timings.measure('es'):
         result = es.search(
             index=INDEX_NAME,
-            body=search_body,
-            from_=(page - 1) * size,
-            size=size
+            body=dict(search_body, profile=True),
+            from_=(params['page'] - 1) * params['size'],
+            size=params['size']
         )
+    g.timings.add('es_took', result['took'] / 1000)
+    return jsonify({
+        'search_body': search_body,
+        'total': result['hits']['total']['value'],
+        'took_ms': result['took'],
+        'timings_ms': {phase: round(seconds * 1000, 3) for phase, seconds in g.timings.phases.items()},
+        'profile_summary': summarize_profile(result.get('profile', {})),
+        'profile': result.get('profile')
+    })
+
+
+@app.route('/search', methods=['GET'])
+def search():
+    """
+    处理搜索请求
+    普通翻页使用 page/size；传入上一页返回的 next_cursor 时，改用 point-in-time + search_after 翻页，
+    深翻页的代价与第一页相同；tag（可重复）按标签过滤，facets=1 时结果中的 tag_facets 为当前查询命中文档的标签分布
+    """
+    try:
+        params = parse_search_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if request.args.get('profile') == '1':
+        return profile_search(params)
+
+    use_cursor = params['search_after'] is not None
+    if not use_cursor:
+        # 命中缓存时直接返回序列化好的结果，不访问 ES
+        cache_key = normalize_search_key(*search_cache_key(params))
+        cached = search_cache.get(cache_key)
+        g.timings.cache = 'hit' if cached is not None else 'miss'
+        if cached is not None:
+            return app.response_class(cached, mimetype='application/json')
+
+    try:
+        # 执行搜索；计时阶段以实际使用的后端命名（es / local）
+        start = time.perf_counter()
+        (result, pit_id), backend_name = backend.search(params)
+        g.timings.add(backend_name, time.perf_counter() - start)
+        g.timings.add(f'{backend_name}_took', result['took'] / 1000)
 
-        # 处理搜索结果
-        hits = result['hits']['hits']
-
-        total = result['hits']['total']['value']
-        print("---hist---")
-        print(hits)
-        # 格式化结果
-        formatted_results = []
-        for hit in hits:
-            source = hit['_source']
-
-            doc = {
-                'id': hit['_id'],
-                '序号': source.get('序号', '') or '',
-                '题干': source.get('题干', '') or '',
-                '选项': {
-                    'A': source.get('选项A', '') or '',
-                    'B': source.get('选项B', '') or '',
-                    'C': source.get('选项C', '') or '',
-                    'D': source.get('选项D', '') or '',
-                    'E': source.get('选项E', '') or '',
-                    'F': source.get('选项F', '') or '',
-                    'G': source.get('选项G', '') or '',
-                    'H': source.get('选项H', '') or ''
-                },
-                '解析': source.get('解析', '') or '',
-                '分数': source.get('分数', '') or '',
-                '答案': source.get('答案', '') or '',
-                '标签': source.get('标签', '') or ''
-            }
-
-            # 添加高亮内容（如果有）
-            if 'highlight' in hit:
-                doc['highlight'] = hit['highlight']
-
-            formatted_results.append(doc)
-
-        print('Results-----:', formatted_results)
-        # 返回结果
-        return jsonify({
-            'results': formatted_results,
-            'total': total,
-            'page': page,
-            'total_pages': math.ceil(total / size),
-            'size': size,
-            'query': query,
-            'search_type': search_type,
-            'field_filter': field_filter
-        })
+        # 格式化结果；只缓存主后端的结果，备用后端的结果不会在 ES 恢复后继续返回
+        with g.timings.measure('format'):
+            payload = search_response(result, params, pit_id)
+            body = app.json.dumps(payload)
+        if not use_cursor and backend_name == backend.preferred:
+            search_cache.set(cache_key, body)
 
+        if payload['next_cursor'] is None and pit_id:
+            # 已经到最后一页，提前释放 point-in-time
+            with g.timings.measure(backend_name):
+                backend.close_pit(backend_name, pit_id)
+
+        if log_sampled():
+            app.logger.info('search q=%r type=%s field=%s mode=%s tags=%s page=%s total=%s took=%sms backend=%s',
+                            params['query'], params['search_type'], params['field_filter'], params['mode'],
+                            params['tags'], params['page'], payload['total'], result['took'], backend_name)
+            app.logger.debug('search hits: %s', [hit['_id'] for hit in result['hits']['hits']])
+        response = app.response_class(body, mimetype='application/json')
+        response.headers['X-Search-Backend'] = backend_name
+        return response
+
+    except CursorExpiredError as e:
+        return jsonify({'error': str(e)}), 410
+    except Exception as e:
+        app.logger.warning('search failed q=%r: %s', params['query'], e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/msearch', methods=['POST'])
+def msearch():
+    """
+    批量搜索：请求体为查询列表，每个查询的参数与 /search 相同（q、type、field、tag、page、size、mode），
+    未命中缓存的查询合并成一次 _msearch 请求（ES 不可用时由本地库逐个查询），按原顺序返回 {"responses": [...]}
+    """
+    try:
+        specs = parse_msearch_specs(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    bodies = [None] * len(specs)
+    pending = []
+    for position, params in enumerate(specs):
+        if isinstance(params, ValueError):
+            bodies[position] = app.json.dumps({'error': str(params)})
+            continue
+        cache_key = normalize_search_key(*search_cache_key(params))
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            bodies[position] = cached.decode('utf-8') if isinstance(cached, bytes) else cached
+        else:
+            pending.append((position, params, cache_key))
+
+    if pending:
+        try:
+            # 与 /search 一样经过后端切换：ES 不可用时改由本地库逐个查询
+            start = time.perf_counter()
+            result, backend_name = backend.msearch([params for _, params, _ in pending])
+            g.timings.add(backend_name, time.perf_counter() - start)
+        except Exception as e:
+            app.logger.warning('msearch failed (%s queries): %s', len(pending), e)
+            return jsonify({'error': str(e)}), 500
+        g.timings.add(f'{backend_name}_took', result['took'] / 1000)
+        with g.timings.measure('format'):
+            for (position, params, cache_key), response in zip(pending, result['responses']):
+                if 'error' in response:
+                    bodies[position] = app.json.dumps({'error': msearch_error(response)})
+                    continue
+                body = app.json.dumps(search_response(response, params))
+                # 只缓存主后端的结果（同 /search）
+                if backend_name == backend.preferred:
+                    search_cache.set(cache_key, body)
+                bodies[position] = body
+
+    return app.response_class(msearch_response_body(bodies), mimetype='application/json')
+
+
+@app.route('/export', methods=['GET'])
+def export():
+    """
+    导出查询的全部结果：参数与 /search 相同（q、type、field、tag、mode，不分页），format=ndjson（默认）或 csv
+    响应由生成器逐批输出，ES 上按 point-in-time + search_after 逐批读取，导出多少条都只占用一批的内存
+    """
+    try:
+        params = parse_export_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        batches, backend_name = backend.export(params)
     except Exception as e:
+        app.logger.warning('export failed q=%r: %s', params['query'], e)
         return jsonify({'error': str(e)}), 500
 
+    def generate():
+        rows = 0
+        start = time.perf_counter()
+        try:
+            yield export_header(params['format'])
+            for hits in batches:
+                rows += len(hits)
+                yield export_chunk(hits, params['format'])
+        except Exception as e:
+            # 响应已经开始发送，无法再返回错误状态，只能提前结束
+            app.logger.warning('export interrupted q=%r after %s rows: %s', params['query'], rows, e)
+        finally:
+            # 客户端中途断开时同样会执行，释放 point-in-time
+            batches.close()
+        app.logger.info('export q=%r type=%s field=%s tags=%s format=%s rows=%s seconds=%.1f backend=%s',
+                        params['query'], params['search_type'], params['field_filter'], params['tags'],
+                        params['format'], rows, time.perf_counter() - start, backend_name)
+
+    response = app.response_class(generate(), content_type=EXPORT_FORMATS[params['format']])
+    response.headers['Content-Disposition'] = f"attachment; filename=export.{params['format']}"
+    response.headers['X-Search-Backend'] = backend_name
+    return response
+
 
 @app.route('/question/<question_id>')
 def question_detail(question_id):
     """题目详情页面"""
     try:
-        result = es.get(index=INDEX_NAME, id=question_id)
-        question = result['_source']
+        start = time.perf_counter()
+        question, backend_name = backend.get(question_id)
+        g.timings.add(backend_name, time.perf_counter() - start)
+        if question is None:
+            return f"Error: 题目 {question_id} 不存在", 404
         question['id'] = question_id
         return render_template('detail.html', question=question)
     except Exception as e:
@@ -221,29 +263,51 @@ def question_detail(question_id):
 
 @app.route('/tags')
 def get_tags():
-    """获取所有标签"""
+    """获取所有标签：优先使用导入时生成的标签词典，词典不存在时才做聚合查询"""
+    entry = tag_dictionary.get()
+    if entry is not None:
+        body, etag = entry
+        response = app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = TAGS_MAX_AGE
+        # If-None-Match 与 ETag 一致时返回 304
+        return response.make_conditional(request)
+
     try:
-        # 使用聚合查询获取标签
-        search_body = {
-            "size": 0,
-            "aggs": {
-                "tags": {
-                    "terms": {
-                        "field": "标签.keyword",
-                        "size": 1000
-                    }
-                }
-            }
-        }
-
-        result = es.search(index=INDEX_NAME, body=search_body)
-        tags = [bucket['key'] for bucket in result['aggregations']['tags']['buckets']]
-        return jsonify({'tags': tags})
+        # 使用聚合查询获取标签（ES 不可用时由本地库统计）
+        start = time.perf_counter()
+        result, backend_name = backend.tags()
+        g.timings.add(backend_name, time.perf_counter() - start)
+        return jsonify(tags_response(result))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/suggest')
+def suggest():
+    """输入提示：返回以 q 开头的短语（按包含它的文档数排序），数据来自导入工具生成的词典，不访问 ES"""
+    query = request.args.get('q', '').strip()
+    try:
+        k = max(1, int(request.args.get('k', 10)))
+    except ValueError:
+        return jsonify({'error': 'k 必须是整数'}), 400
+    response = jsonify({'query': query, 'suggestions': suggest_index.complete(query, k)})
+    response.cache_control.public = True
+    response.cache_control.max_age = SUGGEST_MAX_AGE
+    return response
+
+
+@app.route('/cache/stats')
+def cache_stats():
+    """查询结果缓存的命中率等统计"""
+    return jsonify(search_cache.stats())
+
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus 文本格式的运行指标"""
+    return app.response_class(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,333 @@
+# app_async.py
+"""
+网站的异步版本：Quart + AsyncElasticsearch，运行在 ASGI 服务器上
+
+路由和返回的 JSON 与 app.py 完全相同（查询逻辑都在 search_service.py 中，/search、/question、/tags、/export
+与 app.py 一样经过 search_backends 的查询后端，ES 不可用时改查本地全文库），区别在于
+等待 ES 返回时不占用工作线程，单个进程即可同时处理大量并发请求。
+
+依赖：pip install quart "elasticsearch[async]" uvicorn
+启动：uvicorn app_async:app --host 0.0.0.0 --port 5030 --workers 4
+连接池和超时可用环境变量调整：ES_CONNECTIONS_PER_NODE、ES_REQUEST_TIMEOUT、ES_MAX_RETRIES
+"""
+import os
+import time
+import logging
+from quart import Quart, render_template, request, jsonify, g
+from elasticsearch import AsyncElasticsearch
+import metrics
+from metrics import Timings, log_sampled, record_request
+from search_backends import CursorExpiredError, create_async_backend
+from search_cache import create_search_cache, normalize_search_key
+from search_service import (ES_HOSTS, EXPORT_FORMATS, INDEX_NAME, build_search_request,
+                            export_chunk, export_header, is_admin, msearch_error, msearch_response_body,
+                            parse_export_args, parse_msearch_specs, parse_search_args, search_cache_key,
+                            search_response, summarize_profile, tags_response)
+from suggest_index import SuggestIndex
+from tag_dictionary import TagDictionary
+
+# 每个 ES 节点的最大连接数：与单进程的最大并发请求数相当，连接不够时请求会排队等待空闲连接
+ES_CONNECTIONS_PER_NODE = int(os.getenv('ES_CONNECTIONS_PER_NODE', '64'))
+# 单次 ES 请求的超时时间（秒），超时后按 ES_MAX_RETRIES 重试，避免慢请求长时间占住连接
+ES_REQUEST_TIMEOUT = float(os.getenv('ES_REQUEST_TIMEOUT', '5'))
+ES_MAX_RETRIES = int(os.getenv('ES_MAX_RETRIES', '2'))
+
+# /tags 响应允许浏览器缓存的时间（秒），配合 ETag 做协商缓存
+TAGS_MAX_AGE = 60
+
+# /suggest 响应允许浏览器缓存的时间（秒）
+SUGGEST_MAX_AGE = 60
+
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'), format='%(asctime)s - %(levelname)s - %(message)s')
+# ES 客户端默认每个请求记录一条 INFO 日志，只保留警告和错误
+logging.getLogger('elastic_transport').setLevel(logging.WARNING)
+
+app = Quart(__name__)
+
+# ES 客户端和查询后端在服务启动后创建，绑定到 ASGI 服务器的事件循环
+es = None
+backend = None
+
+# 查询结果缓存和标签词典与同步版相同（内存缓存的读写只有字典操作，不会阻塞事件循环）
+search_cache = create_search_cache()
+tag_dictionary = TagDictionary(dumps=app.json.dumps)
+suggest_index = SuggestIndex()
+
+metrics.registry.add_collector(metrics.cache_collector(search_cache))
+
+
+@app.before_serving
+async def open_es():
+    global es, backend
+    es = AsyncElasticsearch(
+        hosts=ES_HOSTS,
+        connections_per_node=ES_CONNECTIONS_PER_NODE,
+        request_timeout=ES_REQUEST_TIMEOUT,
+        max_retries=ES_MAX_RETRIES,
+        retry_on_timeout=True
+    )
+    # /search、/question、/tags、/export 的查询后端：ES 不可用时自动改查本地全文库（见 search_backends）
+    backend = create_async_backend(es)
+
+
+@app.after_serving
+async def close_es():
+    await es.close()
+
+
+@app.before_request
+async def start_timer():
+    g.timings = Timings()
+
+
+@app.after_request
+async def record_metrics(response):
+    """记录每个请求的耗时、响应大小和状态码，并输出 Server-Timing 响应头"""
+    timings = g.get('timings')
+    if timings is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        response.headers['Server-Timing'] = record_request(route, request.method, response.status_code,
+                                                           response.content_length, timings)
+    return response
+
+
+@app.route('/')
+async def index():
+    """主页路由，显示搜索界面"""
+    return await render_template('index.html')
+
+
+async def profile_search(params):
+    """
+    查询分析（?profile=1，仅管理员）：返回实际发送的查询体、ES profile 原始输出及按子句汇总的耗时，
+    以及网站侧测得的耗时；不读写缓存
+    """
+    if not is_admin(request.headers):
+        return jsonify({'error': '查询分析仅限管理员（请求头 X-Admin-Token）'}), 403
+    if params['search_after'] is not None:
+        return jsonify({'error': '查询分析不支持游标翻页'}), 400
+
+    search_body = build_search_request(params)
+    with g.timings.measure('es'):
+        result = await es.search(
+            index=INDEX_NAME,
+            body=dict(search_body, profile=True),
+            from_=(params['page'] - 1) * params['size'],
+            size=params['size']
+        )
+    g.timings.add('es_took', result['took'] / 1000)
+    return jsonify({
+        'search_body': search_body,
+        'total': result['hits']['total']['value'],
+        'took_ms': result['took'],
+        'timings_ms': {phase: round(seconds * 1000, 3) for phase, seconds in g.timings.phases.items()},
+        'profile_summary': summarize_profile(result.get('profile', {})),
+        'profile': result.get('profile')
+    })
+
+
+@app.route('/search', methods=['GET'])
+async def search():
+    """处理搜索请求，参数和返回结构与 app.py 的 /search 相同"""
+    try:
+        params = parse_search_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if request.args.get('profile') == '1':
+        return await profile_search(params)
+
+    use_cursor = params['search_after'] is not None
+    if not use_cursor:
+        cache_key = normalize_search_key(*search_cache_key(params))
+        cached = search_cache.get(cache_key)
+        g.timings.cache = 'hit' if cached is not None else 'miss'
+        if cached is not None:
+            return app.response_class(cached, mimetype='application/json')
+
+    try:
+        # 执行搜索；计时阶段以实际使用的后端命名（es / local）
+        start = time.perf_counter()
+        (result, pit_id), backend_name = await backend.search(params)
+        g.timings.add(backend_name, time.perf_counter() - start)
+        g.timings.add(f'{backend_name}_took', result['took'] / 1000)
+
+        # 格式化结果；只缓存主后端的结果，备用后端的结果不会在 ES 恢复后继续返回
+        with g.timings.measure('format'):
+            payload = search_response(result, params, pit_id)
+            body = app.json.dumps(payload)
+        if not use_cursor and backend_name == backend.preferred:
+            search_cache.set(cache_key, body)
+
+        if payload['next_cursor'] is None and pit_id:
+            # 已经到最后一页，提前释放 point-in-time
+            with g.timings.measure(backend_name):
+                await backend.close_pit(backend_name, pit_id)
+
+        if log_sampled():
+            app.logger.info('search q=%r type=%s field=%s mode=%s tags=%s page=%s total=%s took=%sms backend=%s',
+                            params['query'], params['search_type'], params['field_filter'], params['mode'],
+                            params['tags'], params['page'], payload['total'], result['took'], backend_name)
+            app.logger.debug('search hits: %s', [hit['_id'] for hit in result['hits']['hits']])
+        response = app.response_class(body, mimetype='application/json')
+        response.headers['X-Search-Backend'] = backend_name
+        return response
+
+    except CursorExpiredError as e:
+        return jsonify({'error': str(e)}), 410
+    except Exception as e:
+        app.logger.warning('search failed q=%r: %s', params['query'], e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/msearch', methods=['POST'])
+async def msearch():
+    """
+    批量搜索：请求体为查询列表，每个查询的参数与 /search 相同（q、type、field、tag、page、size、mode），
+    未命中缓存的查询合并成一次 _msearch 请求（ES 不可用时由本地库逐个查询），按原顺序返回 {"responses": [...]}
+    """
+    try:
+        specs = parse_msearch_specs(await request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    bodies = [None] * len(specs)
+    pending = []
+    for position, params in enumerate(specs):
+        if isinstance(params, ValueError):
+            bodies[position] = app.json.dumps({'error': str(params)})
+            continue
+        cache_key = normalize_search_key(*search_cache_key(params))
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            bodies[position] = cached.decode('utf-8') if isinstance(cached, bytes) else cached
+        else:
+            pending.append((position, params, cache_key))
+
+    if pending:
+        try:
+            # 与 /search 一样经过后端切换：ES 不可用时改由本地库逐个查询
+            start = time.perf_counter()
+            result, backend_name = await backend.msearch([params for _, params, _ in pending])
+            g.timings.add(backend_name, time.perf_counter() - start)
+        except Exception as e:
+            app.logger.warning('msearch failed (%s queries): %s', len(pending), e)
+            return jsonify({'error': str(e)}), 500
+        g.timings.add(f'{backend_name}_took', result['took'] / 1000)
+        with g.timings.measure('format'):
+            for (position, params, cache_key), response in zip(pending, result['responses']):
+                if 'error' in response:
+                    bodies[position] = app.json.dumps({'error': msearch_error(response)})
+                    continue
+                body = app.json.dumps(search_response(response, params))
+                # 只缓存主后端的结果（同 /search）
+                if backend_name == backend.preferred:
+                    search_cache.set(cache_key, body)
+                bodies[position] = body
+
+    return app.response_class(msearch_response_body(bodies), mimetype='application/json')
+
+
+@app.route('/export', methods=['GET'])
+async def export():
+    """流式导出查询的全部结果，参数和输出格式与 app.py 的 /export 相同；异步生成器逐批输出，不占用工作线程"""
+    try:
+        params = parse_export_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        batches, backend_name = await backend.export(params)
+    except Exception as e:
+        app.logger.warning('export failed q=%r: %s', params['query'], e)
+        return jsonify({'error': str(e)}), 500
+
+    async def generate():
+        rows = 0
+        start = time.perf_counter()
+        try:
+            yield export_header(params['format']).encode('utf-8')
+            async for hits in batches:
+                rows += len(hits)
+                yield export_chunk(hits, params['format']).encode('utf-8')
+        except Exception as e:
+            # 响应已经开始发送，无法再返回错误状态，只能提前结束
+            app.logger.warning('export interrupted q=%r after %s rows: %s', params['query'], rows, e)
+        finally:
+            # 客户端中途断开时同样会执行，释放 point-in-time
+            await batches.aclose()
+        app.logger.info('export q=%r type=%s field=%s tags=%s format=%s rows=%s seconds=%.1f backend=%s',
+                        params['query'], params['search_type'], params['field_filter'], params['tags'],
+                        params['format'], rows, time.perf_counter() - start, backend_name)
+
+    return generate(), 200, {'Content-Type': EXPORT_FORMATS[params['format']],
+                             'Content-Disposition': f"attachment; filename=export.{params['format']}",
+                             'X-Search-Backend': backend_name}
+
+
+@app.route('/question/<question_id>')
+async def question_detail(question_id):
+    """题目详情页面"""
+    try:
+        start = time.perf_counter()
+        question, backend_name = await backend.get(question_id)
+        g.timings.add(backend_name, time.perf_counter() - start)
+        if question is None:
+            return f"Error: 题目 {question_id} 不存在", 404
+        question['id'] = question_id
+        return await render_template('detail.html', question=question)
+    except Exception as e:
+        return f"Error: {str(e)}", 404
+
+
+@app.route('/tags')
+async def get_tags():
+    """获取所有标签：优先使用导入时生成的标签词典，词典不存在时才做聚合查询"""
+    entry = tag_dictionary.get()
+    if entry is not None:
+        body, etag = entry
+        response = app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = TAGS_MAX_AGE
+        return await response.make_conditional(request)
+
+    try:
+        # 使用聚合查询获取标签（ES 不可用时由本地库统计）
+        start = time.perf_counter()
+        result, backend_name = await backend.tags()
+        g.timings.add(backend_name, time.perf_counter() - start)
+        return jsonify(tags_response(result))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/suggest')
+async def suggest():
+    """输入提示：返回以 q 开头的短语（按包含它的文档数排序），数据来自导入工具生成的词典，不访问 ES"""
+    query = request.args.get('q', '').strip()
+    try:
+        k = max(1, int(request.args.get('k', 10)))
+    except ValueError:
+        return jsonify({'error': 'k 必须是整数'}), 400
+    response = jsonify({'query': query, 'suggestions': suggest_index.complete(query, k)})
+    response.cache_control.public = True
+    response.cache_control.max_age = SUGGEST_MAX_AGE
+    return response
+
+
+@app.route('/cache/stats')
+async def cache_stats():
+    """查询结果缓存的命中率等统计"""
+    return jsonify(search_cache.stats())
+
+
+@app.route('/metrics')
+async def metrics_endpoint():
+    """Prometheus 文本格式的运行指标"""
+    return app.response_class(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+
+if __name__ == '__main__':
+    # 开发调试用；生产环境请用 uvicorn / hypercorn 启动（见文件开头）
+    app.run(host='0.0.0.0', port=5030)
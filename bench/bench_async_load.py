@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+网站并发压测：对比同步版 app.py（Flask 多线程开发服务器）与异步版 app_async.py（uvicorn 单进程）
+
+在本机启动 ES 替身（bench/fake_es.py，每个请求模拟 --latency 毫秒的 ES 耗时），
+分别以子进程启动两个版本的网站并指向替身，然后按不同并发数压测 /search，输出吞吐和延迟。
+压测期间关闭查询结果缓存（SEARCH_CACHE_MAX_ENTRIES=0），每个请求都会访问 ES。
+未安装 quart / uvicorn / aiohttp 时只压测同步版。
+
+用法：python bench/bench_async_load.py [--concurrency 1,8,32,128] [--duration 10] [--latency 20]
+"""
+import os
+import sys
+import time
+import json
+import random
+import socket
+import argparse
+import importlib.util
+import statistics
+import subprocess
+import threading
+import http.client
+from urllib.parse import quote
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+from fake_es import FakeES, TAGS  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_command(target, port):
+    """启动网站子进程的命令"""
+    if target == 'sync':
+        return [sys.executable, '-c',
+                f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    return [sys.executable, '-m', 'uvicorn', 'app_async:app', '--host', '127.0.0.1', '--port', str(port),
+            '--workers', '1', '--log-level', 'warning', '--no-access-log']
+
+
+def async_available():
+    return all(importlib.util.find_spec(name) for name in ('quart', 'uvicorn', 'aiohttp'))
+
+
+def start_server(target, es_url, cache=False):
+    """启动网站子进程，等到可以响应请求为止；cache=False 时关闭查询结果缓存"""
+    port = free_port()
+    env = dict(os.environ, ES_URL=es_url)
+    if not cache:
+        env['SEARCH_CACHE_MAX_ENTRIES'] = '0'
+        env.pop('SEARCH_CACHE_REDIS_URL', None)
+    process = subprocess.Popen(server_command(target, port), cwd=PROJECT_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/cache/stats')
+            conn.getresponse().read()
+            conn.close()
+            return process, port
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{target} 网站启动失败")
+
+
+def run_load(port, concurrency, duration):
+    """concurrency 个客户端线程在 duration 秒内不断请求 /search（长连接），返回延迟列表和错误数"""
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(seed):
+        rng = random.Random(seed)
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        local = []
+        failed = 0
+        while time.perf_counter() < deadline:
+            path = f"/search?q={quote(rng.choice(TAGS))}&page={rng.randint(1, 50)}&size=10"
+            start = time.perf_counter()
+            try:
+                conn.request('GET', path)
+                response = conn.getresponse()
+                data = response.read()
+                if response.status != 200 or 'results' not in json.loads(data):
+                    failed += 1
+                    continue
+            except (OSError, http.client.HTTPException, ValueError):
+                failed += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                continue
+            local.append(time.perf_counter() - start)
+        conn.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+
+def describe(target, concurrency, duration, latencies, errors):
+    if not latencies:
+        print(f"{target:<6} 并发 {concurrency:>4}：没有成功的请求（错误 {errors}）")
+        return
+    latencies = sorted(latencies)
+    p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+    print(f"{target:<6} 并发 {concurrency:>4}：{len(latencies) / duration:8.1f} 请求/秒   "
+          f"中位数 {statistics.median(latencies) * 1000:7.1f} ms   p95 {p95 * 1000:7.1f} ms   错误 {errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='网站并发压测（同步 vs 异步）')
+    parser.add_argument('--concurrency', default='1,8,32,128', help='并发客户端数，逗号分隔')
+    parser.add_argument('--duration', type=float, default=10, help='每个并发级别的压测时长（秒）')
+    parser.add_argument('--latency', type=float, default=20, help='ES 替身的模拟处理时间（毫秒）')
+    parser.add_argument('--targets', default='sync,async', help='要压测的版本：sync、async')
+    args = parser.parse_args()
+
+    levels = [int(value) for value in args.concurrency.split(',')]
+    targets = args.targets.split(',')
+    if 'async' in targets and not async_available():
+        print("未安装 quart / uvicorn / aiohttp，跳过异步版")
+        targets.remove('async')
+
+    fake_es = FakeES(port=0, latency=args.latency / 1000)
+    fake_es.start()
+    print(f"ES 替身：{fake_es.url}，模拟延迟 {args.latency} ms")
+
+    try:
+        for target in targets:
+            process, port = start_server(target, fake_es.url)
+            try:
+                run_load(port, 1, 1)  # 预热
+                for concurrency in levels:
+                    latencies, errors = run_load(port, concurrency, args.duration)
+                    describe(target, concurrency, args.duration, latencies, errors)
+            finally:
+                process.terminate()
+                process.wait()
+    finally:
+        fake_es.shutdown()
+        fake_es.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+全字段全文搜索基准测试：对比逐字段 multi_match（mode=fields）与合并字段 全文（mode=combined）
+
+查询词默认从随机文档的 题干 中截取，也可以用 --queries 指定文件（每行一个查询词）。
+两种查询体都直接取自 search_service.build_search_body（含高亮），分别执行若干轮，输出：
+  - ES took 和客户端往返耗时（平均、中位数、p95）
+  - 相关度差异：前 10 条结果的重合率、第一条结果是否相同、命中总数是否一致
+索引需要由新版 tool_csv_to_es2.py 全量导入（包含 全文 字段）。
+
+用法：python bench/bench_combined_query.py --host http://10.0.0.215:9200 [--rounds 10]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+from elasticsearch import Elasticsearch
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+from search_service import build_search_body  # noqa: E402
+
+TOP_N = 10
+
+
+def sample_queries(es, index, count, seed):
+    """从随机文档的 题干 中截取 2~6 个字的片段作为查询词"""
+    result = es.search(index=index, size=count, _source=["题干"],
+                       query={"function_score": {"random_score": {"seed": seed, "field": "_seq_no"}}})
+    rng = random.Random(seed)
+    queries = []
+    for hit in result['hits']['hits']:
+        text = (hit['_source'].get('题干') or '').strip()
+        if len(text) < 2:
+            continue
+        length = rng.randint(2, min(6, len(text)))
+        start = rng.randint(0, len(text) - length)
+        queries.append(text[start:start + length])
+    if not queries:
+        raise SystemExit("索引中没有可用的题干，请先导入数据")
+    return queries
+
+
+def measure(es, index, queries, mode, rounds):
+    """返回 (took 列表, 往返耗时列表, {查询词: (命中总数, 前 N 条 id)})"""
+    took, latency, results = [], [], {}
+    for _ in range(rounds):
+        for query in queries:
+            body = build_search_body(query, 'fulltext', 'all', mode)
+            start = time.perf_counter()
+            result = es.search(index=index, body=body, size=TOP_N, request_cache=False)
+            latency.append((time.perf_counter() - start) * 1000)
+            took.append(result['took'])
+            results[query] = (result['hits']['total']['value'], [hit['_id'] for hit in result['hits']['hits']])
+    return took, latency, results
+
+
+def describe(name, took, latency):
+    latency = sorted(latency)
+    p95 = latency[max(0, int(len(latency) * 0.95) - 1)]
+    print(f"{name:<10} took 平均 {statistics.mean(took):6.2f} ms  中位数 {statistics.median(took):6.2f} ms   "
+          f"往返 中位数 {statistics.median(latency):6.2f} ms  p95 {p95:6.2f} ms")
+
+
+def compare_relevance(queries, fields_results, combined_results):
+    """比较两种查询的结果排序"""
+    overlaps, same_first, same_total = [], 0, 0
+    for query in queries:
+        fields_total, fields_ids = fields_results[query]
+        combined_total, combined_ids = combined_results[query]
+        if fields_ids:
+            overlaps.append(len(set(fields_ids) & set(combined_ids)) / len(fields_ids))
+        if fields_ids[:1] == combined_ids[:1]:
+            same_first += 1
+        if fields_total == combined_total:
+            same_total += 1
+    print(f"前 {TOP_N} 条平均重合率：{statistics.mean(overlaps) * 100 if overlaps else 0:.1f}%")
+    print(f"第一条结果相同：{same_first}/{len(queries)}   命中总数相同：{same_total}/{len(queries)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='全字段全文搜索基准测试（fields vs combined）')
+    parser.add_argument('--host', default='http://10.0.0.215:9200')
+    parser.add_argument('--index', default='stockinfo')
+    parser.add_argument('--queries', help='查询词文件，每行一个；不指定时从题干中随机截取')
+    parser.add_argument('--count', type=int, default=50, help='随机查询词数量')
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    es = Elasticsearch(args.host)
+    if args.queries:
+        with open(args.queries, 'r', encoding='utf-8') as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        queries = sample_queries(es, args.index, args.count, args.seed)
+    print(f"{len(queries)} 个查询词 × {args.rounds} 轮，例如：{queries[:8]}")
+
+    # 预热
+    measure(es, args.index, queries, 'fields', 1)
+    measure(es, args.index, queries, 'combined', 1)
+
+    fields_took, fields_latency, fields_results = measure(es, args.index, queries, 'fields', args.rounds)
+    combined_took, combined_latency, combined_results = measure(es, args.index, queries, 'combined', args.rounds)
+
+    describe('fields', fields_took, fields_latency)
+    describe('combined', combined_took, combined_latency)
+    print(f"took 加速比：{statistics.mean(fields_took) / max(statistics.mean(combined_took), 0.01):.1f}x")
+    compare_relevance(queries, fields_results, combined_results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+导入流程基准测试：分别测量 xlsx 转 csv、csv 转文档（transform）、bulk 写入三个阶段的吞吐，
+以及没有文件变化时再次转换（全部命中转换缓存）的耗时
+
+默认读取 data/6-卷王-题材细分 及其子目录 1-0-100 中的工作簿（与生产环境的两个监控目录结构相同），
+CSV 写到临时目录，bulk 写入本机的 ES 替身（bench/fake_es.py），不需要网络。
+指定 --es-url 时写入真实 ES 的临时索引 stockinfo_bench（测试结束后删除）。
+--output 把结果写成 JSON，便于不同版本之间对比。
+
+用法：python bench/bench_ingest.py [--bulk-doc-us 20] [--chunk-mb 10] [--bulk-threads 4] [--output ingest.json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+from elasticsearch import Elasticsearch
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_DIR, 'tool'))
+
+from fake_es import FakeES  # noqa: E402
+from tool_xlsx_to_csv2 import collect_xlsx_files, convert_xlsx_to_csv_parallel  # noqa: E402
+from tool_csv_to_es2 import CSVToElasticsearchImporter  # noqa: E402
+from staging import is_staged_file  # noqa: E402
+
+DATA_DIR = os.path.join(PROJECT_DIR, 'data', '6-卷王-题材细分')
+SOURCE_DIRS = [DATA_DIR, os.path.join(DATA_DIR, '1-0-100')]
+BENCH_INDEX = 'stockinfo_bench'
+
+
+def stage_result(name, seconds, files, rows, **extra):
+    result = {'stage': name, 'seconds': round(seconds, 3), 'files': files, 'rows': rows,
+              'rows_per_second': round(rows / seconds, 1) if seconds else None}
+    result.update(extra)
+    return result
+
+
+def run_convert(source_dirs, target_dir):
+    """阶段 1：xlsx 转 csv（进程池并行，与 tool_xlsx_to_csv2 相同）"""
+    start = time.perf_counter()
+    results = convert_xlsx_to_csv_parallel(source_dirs, target_dir)
+    seconds = time.perf_counter() - start
+    ok = [item for item in results if item['ok']]
+    return stage_result('convert', seconds, len(ok), sum(item['rows'] for item in ok),
+                        failed_files=len(results) - len(ok))
+
+
+def run_convert_cached(source_dirs, target_dir):
+    """阶段 1'：文件都没有变化时再次转换，应全部命中转换缓存"""
+    start = time.perf_counter()
+    results = convert_xlsx_to_csv_parallel(source_dirs, target_dir)
+    seconds = time.perf_counter() - start
+    return stage_result('convert_cached', seconds, len(results), sum(item['rows'] for item in results),
+                        cached_files=sum(1 for item in results if item.get('cached')))
+
+
+def run_transform(importer, csv_dir, index):
+    """阶段 2：读取 csv 并生成 bulk 动作"""
+    csv_files = sorted(os.path.join(csv_dir, name) for name in os.listdir(csv_dir) if is_staged_file(name))
+    start = time.perf_counter()
+    actions = []
+    for path in csv_files:
+        actions.extend(importer.process_csv_to_bulk(path, index=index))
+    seconds = time.perf_counter() - start
+    return stage_result('transform', seconds, len(csv_files), len(actions)), actions
+
+
+def run_bulk(importer, actions):
+    """阶段 3：bulk 写入（与导入工具相同，经 BulkSender 按字节分块、并发发送）"""
+    start = time.perf_counter()
+    counts = importer.create_bulk_sender().send(actions).get(None, {})
+    seconds = time.perf_counter() - start
+    payload_bytes = sum(len(json.dumps(action['_source'], ensure_ascii=False).encode('utf-8'))
+                        for action in actions)
+    return stage_result('bulk', seconds, None, counts.get('success', 0), failed=counts.get('failed', 0),
+                        retried=counts.get('retried', 0), chunk_bytes=importer.bulk_chunk_bytes,
+                        threads=importer.bulk_threads,
+                        megabytes_per_second=round(payload_bytes / 1e6 / seconds, 2) if seconds else None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='导入流程基准测试（转换 / transform / bulk）')
+    parser.add_argument('--source', action='append', help='xlsx 目录，可重复指定；默认 data/6-卷王-题材细分')
+    parser.add_argument('--es-url', help='写入真实 ES；不指定时使用本机 ES 替身')
+    parser.add_argument('--latency', type=float, default=5, help='ES 替身每个请求的模拟延迟（毫秒）')
+    parser.add_argument('--bulk-doc-us', type=float, default=20, help='ES 替身每条文档的模拟写入时间（微秒）')
+    parser.add_argument('--chunk-mb', type=float, default=10, help='每个 bulk 请求的最大字节数（MB）')
+    parser.add_argument('--bulk-threads', type=int, default=4, help='最大并发 bulk 请求数')
+    parser.add_argument('--output', help='把结果写入 JSON 文件')
+    args = parser.parse_args()
+
+    source_dirs = args.source or SOURCE_DIRS
+    print(f"工作簿：{len(collect_xlsx_files(source_dirs))} 个，来自 {source_dirs}")
+
+    fake_es = None
+    if args.es_url:
+        es_url = args.es_url
+    else:
+        fake_es = FakeES(port=0, latency=args.latency / 1000, bulk_doc_latency=args.bulk_doc_us / 1e6)
+        fake_es.start()
+        es_url = fake_es.url
+        print(f"ES 替身：{es_url}（请求延迟 {args.latency} ms，每条文档 {args.bulk_doc_us} µs）")
+
+    importer = CSVToElasticsearchImporter()
+    importer.es = Elasticsearch(es_url, request_timeout=120)
+    importer.bulk_chunk_bytes = int(args.chunk_mb * 1024 * 1024)
+    importer.bulk_threads = args.bulk_threads
+    if args.es_url:
+        importer.create_index_if_not_exists(BENCH_INDEX)
+
+    stages = []
+    try:
+        with tempfile.TemporaryDirectory() as csv_dir:
+            # 最终写入失败的文档记到临时目录，不影响正式的死信文件
+            importer.dead_letter_path = os.path.join(csv_dir, 'dead_letter.ndjson')
+            stages.append(run_convert(source_dirs, csv_dir))
+            stages.append(run_convert_cached(source_dirs, csv_dir))
+            transform, actions = run_transform(importer, csv_dir, BENCH_INDEX)
+            stages.append(transform)
+            stages.append(run_bulk(importer, actions))
+    finally:
+        if args.es_url:
+            importer.es.indices.delete(index=BENCH_INDEX, ignore_unavailable=True)
+        if fake_es is not None:
+            fake_es.shutdown()
+            fake_es.server_close()
+
+    print("=" * 60)
+    for stage in stages:
+        files = f"{stage['files']} 个文件，" if stage['files'] is not None else ''
+        print(f"{stage['stage']:<14} {stage['seconds']:8.3f} 秒   {files}{stage['rows']} 行   "
+              f"{stage['rows_per_second']} 行/秒")
+
+    if args.output:
+        report = {
+            'python': platform.python_version(), 'platform': platform.platform(),
+            'target': 'es' if args.es_url else 'fake-es', 'source_dirs': source_dirs, 'stages': stages
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+网站负载测试：按比例混合请求 /search（全文 / 精准 × 全字段 / 单字段）、/tags、/question/<id>，
+分别统计每类请求的吞吐和延迟
+
+默认在本机启动 ES 替身（bench/fake_es.py）和网站子进程（--target sync 为 app.py，async 为 app_async.py），
+不需要网络；也可以用 --url 压测已经在运行的网站。
+默认关闭查询结果缓存，每个请求都会访问 ES；加 --cache 则保留缓存，观察命中后的表现。
+随机数种子固定，同样的参数每次发出的请求序列相同。--output 把结果写成 JSON，便于不同版本之间对比。
+
+用法：python bench/bench_search_load.py [--target sync] [--concurrency 16] [--duration 20] [--output load.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import threading
+import http.client
+from urllib.parse import quote, urlsplit
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+from fake_es import FakeES, TAGS, TOTAL_DOCS  # noqa: E402
+from bench_async_load import async_available, start_server  # noqa: E402
+
+KEYWORDS = TAGS + ['公司', '板块', '解析', '以下哪家']
+
+# (名称, 权重, 生成请求路径的函数)
+SCENARIOS = [
+    ('search_fulltext_all', 30, lambda rng: f"/search?q={quote(rng.choice(KEYWORDS))}&page={rng.randint(1, 5)}"),
+    ('search_fulltext_field', 15, lambda rng: f"/search?q={quote(rng.choice(KEYWORDS))}&field={quote('题干')}"),
+    ('search_precise_all', 15, lambda rng: f"/search?q={quote(rng.choice(TAGS))}&type=precise"),
+    ('search_precise_field', 10,
+     lambda rng: f"/search?q={quote(rng.choice(TAGS))}&type=precise&field={quote('标签')}"),
+    ('tags', 10, lambda rng: '/tags'),
+    ('question', 20, lambda rng: f"/question/doc{rng.randint(1, TOTAL_DOCS):06d}"),
+]
+
+
+def run_load(host, port, concurrency, duration, seed):
+    """concurrency 个客户端线程按权重随机发出请求，返回 {场景: {'latencies': [...], 'errors': n}}"""
+    names = [name for name, _, _ in SCENARIOS]
+    weights = [weight for _, weight, _ in SCENARIOS]
+    builders = {name: build for name, _, build in SCENARIOS}
+    results = {name: {'latencies': [], 'errors': 0} for name in names}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(worker_seed):
+        rng = random.Random(worker_seed)
+        conn = http.client.HTTPConnection(host, port, timeout=30)
+        local = {name: {'latencies': [], 'errors': 0} for name in names}
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            path = builders[name](rng)
+            start = time.perf_counter()
+            try:
+                conn.request('GET', path)
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    local[name]['errors'] += 1
+                    continue
+            except (OSError, http.client.HTTPException):
+                local[name]['errors'] += 1
+                conn.close()
+                conn = http.client.HTTPConnection(host, port, timeout=30)
+                continue
+            local[name]['latencies'].append(time.perf_counter() - start)
+        conn.close()
+        with lock:
+            for name, item in local.items():
+                results[name]['latencies'].extend(item['latencies'])
+                results[name]['errors'] += item['errors']
+
+    threads = [threading.Thread(target=worker, args=(seed + offset,)) for offset in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def percentile(sorted_values, ratio):
+    return sorted_values[max(0, int(len(sorted_values) * ratio + 0.5) - 1)]
+
+
+def summarize(results, duration):
+    summary = []
+    for name, item in results.items():
+        latencies = sorted(item['latencies'])
+        row = {'scenario': name, 'requests': len(latencies), 'errors': item['errors'],
+               'requests_per_second': round(len(latencies) / duration, 1)}
+        if latencies:
+            row.update(p50_ms=round(statistics.median(latencies) * 1000, 2),
+                       p95_ms=round(percentile(latencies, 0.95) * 1000, 2),
+                       p99_ms=round(percentile(latencies, 0.99) * 1000, 2))
+        summary.append(row)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='网站负载测试（/search、/tags、/question）')
+    parser.add_argument('--url', help='压测已经在运行的网站，如 http://127.0.0.1:5030；不指定时自动启动')
+    parser.add_argument('--target', choices=['sync', 'async'], default='sync', help='自动启动的网站版本')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20, help='压测时长（秒）')
+    parser.add_argument('--latency', type=float, default=10, help='ES 替身每个请求的模拟延迟（毫秒）')
+    parser.add_argument('--cache', action='store_true', help='保留查询结果缓存')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='把结果写入 JSON 文件')
+    args = parser.parse_args()
+
+    fake_es = process = None
+    try:
+        if args.url:
+            parts = urlsplit(args.url)
+            host, port = parts.hostname, parts.port or 80
+        else:
+            if args.target == 'async' and not async_available():
+                raise SystemExit("未安装 quart / uvicorn / aiohttp，无法启动异步版")
+            fake_es = FakeES(port=0, latency=args.latency / 1000)
+            fake_es.start()
+            print(f"ES 替身：{fake_es.url}，模拟延迟 {args.latency} ms")
+            process, port = start_server(args.target, fake_es.url, cache=args.cache)
+            host = '127.0.0.1'
+
+        run_load(host, port, 1, 1, args.seed)  # 预热
+        results = run_load(host, port, args.concurrency, args.duration, args.seed)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if fake_es is not None:
+            fake_es.shutdown()
+            fake_es.server_close()
+
+    summary = summarize(results, args.duration)
+    print(f"并发 {args.concurrency}，时长 {args.duration} 秒")
+    print(f"{'场景':<24}{'请求数':>8}{'请求/秒':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'错误':>6}")
+    for row in summary:
+        print(f"{row['scenario']:<24}{row['requests']:>8}{row['requests_per_second']:>10}"
+              f"{row.get('p50_ms', '-'):>10}{row.get('p95_ms', '-'):>10}{row.get('p99_ms', '-'):>10}"
+              f"{row['errors']:>6}")
+
+    if args.output:
+        report = {
+            'python': platform.python_version(), 'platform': platform.platform(),
+            'target': args.url or args.target, 'concurrency': args.concurrency, 'duration': args.duration,
+            'es_latency_ms': None if args.url else args.latency, 'cache': args.cache, 'seed': args.seed,
+            'scenarios': summary
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+中间文件读取基准测试：对比 CSV（pd.read_csv）与 Arrow IPC（内存映射，见 tool/staging.py）
+
+读取 data/csv 下的全部 CSV，按 staging.STAGING_SCHEMA 另存为 Arrow 文件（临时目录），
+然后分别测量两种格式读回整个语料库的耗时，以及读回后生成 ES 文档的耗时
+（CSV 为 dataframe_to_docs，Arrow 为 table_to_docs，与导入工具相同）。
+需要安装 pyarrow；不需要连接 Elasticsearch。
+
+用法：python bench/bench_staging.py [--csv-dir data/csv] [--repeat 5]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import pandas as pd
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_DIR, 'tool'))
+
+import staging  # noqa: E402
+from tool_csv_to_es2 import CSVToElasticsearchImporter  # noqa: E402
+
+
+def timed(func, paths, repeat):
+    """重复 repeat 次读取全部文件，返回耗时中位数（秒）和最后一次的结果"""
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        frames = [func(path) for path in paths]
+        seconds.append(time.perf_counter() - start)
+    return statistics.median(seconds), frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description='中间文件读取基准测试（CSV vs Arrow）')
+    parser.add_argument('--csv-dir', default=os.path.join(PROJECT_DIR, 'data', 'csv'))
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if staging.pa is None:
+        raise SystemExit("未安装 pyarrow，无法测试 Arrow 格式")
+
+    csv_paths = sorted(os.path.join(args.csv_dir, name) for name in os.listdir(args.csv_dir)
+                       if name.endswith('.csv'))
+    importer = CSVToElasticsearchImporter()
+
+    with tempfile.TemporaryDirectory() as arrow_dir:
+        arrow_paths = []
+        for path in csv_paths:
+            df = pd.read_csv(path, encoding='utf-8')
+            df.columns = [col.replace(' ', '') for col in df.columns]
+            arrow_path = os.path.join(arrow_dir, os.path.basename(path)[:-4] + '.arrow')
+            staging.write_arrow(df, arrow_path)
+            arrow_paths.append(arrow_path)
+
+        csv_seconds, csv_frames = timed(lambda path: pd.read_csv(path, encoding='utf-8'), csv_paths, args.repeat)
+        arrow_seconds, arrow_frames = timed(staging.read_arrow, arrow_paths, args.repeat)
+        csv_bytes = sum(os.path.getsize(path) for path in csv_paths)
+        arrow_bytes = sum(os.path.getsize(path) for path in arrow_paths)
+
+    rows = sum(len(df) for df in csv_frames)
+    start = time.perf_counter()
+    for df in csv_frames:
+        df.columns = [col.replace(' ', '') for col in df.columns]
+        importer.dataframe_to_docs(df, 'bench')
+    csv_docs_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for table in arrow_frames:
+        importer.table_to_docs(table, 'bench')
+    arrow_docs_seconds = time.perf_counter() - start
+
+    print(f"{len(csv_paths)} 个文件，{rows} 行；重复 {args.repeat} 次取中位数")
+    print(f"{'格式':<8}{'大小 MB':>10}{'读取 秒':>10}{'生成文档 秒':>14}")
+    print(f"{'csv':<8}{csv_bytes / 1e6:>10.2f}{csv_seconds:>10.3f}{csv_docs_seconds:>14.3f}")
+    print(f"{'arrow':<8}{arrow_bytes / 1e6:>10.2f}{arrow_seconds:>10.3f}{arrow_docs_seconds:>14.3f}")
+    print(f"读取耗时为 CSV 的 {arrow_seconds / csv_seconds:.0%}，"
+          f"读取加生成文档为 CSV 的 {(arrow_seconds + arrow_docs_seconds) / (csv_seconds + csv_docs_seconds):.0%}")
+
+
+if __name__ == '__main__':
+    main()
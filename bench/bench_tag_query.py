@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+标签子串查询基准测试：对比前导通配符 wildcard(标签.keyword) 与 n-gram 子字段 term(标签.ngram)
+
+从索引中取出全部标签，截取其中的子串作为查询词，两种查询各执行若干轮，
+比较 ES 返回的 took 和客户端往返耗时，并校验两种查询命中的文档数一致。
+索引需要由新版 tool_csv_to_es2.py 全量导入（包含 标签.ngram 子字段）。
+
+用法：python bench/bench_tag_query.py --host http://10.0.0.215:9200 [--rounds 20]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+from elasticsearch import Elasticsearch
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+from search_service import TAG_NGRAM_MAX_GRAM  # noqa: E402
+
+
+def wildcard_query(term):
+    return {"wildcard": {"标签.keyword": f"*{term}*"}}
+
+
+def ngram_query(term):
+    return {"constant_score": {"filter": {"term": {"标签.ngram": term}}}}
+
+
+def sample_terms(es, index, count, seed):
+    """从现有标签中随机截取子串作为查询词"""
+    result = es.search(index=index, size=0, aggs={"tags": {"terms": {"field": "标签.keyword", "size": 10000}}})
+    tags = [bucket['key'] for bucket in result['aggregations']['tags']['buckets']]
+    if not tags:
+        raise SystemExit("索引中没有标签，请先导入数据")
+    rng = random.Random(seed)
+    terms = []
+    for _ in range(count):
+        tag = rng.choice(tags)
+        length = rng.randint(1, min(4, len(tag), TAG_NGRAM_MAX_GRAM))
+        start = rng.randint(0, len(tag) - length)
+        terms.append(tag[start:start + length])
+    return terms
+
+
+def measure(es, index, terms, build, rounds):
+    """返回 (took 列表, 往返耗时列表, 每个查询词的命中数)"""
+    took, latency, totals = [], [], {}
+    for _ in range(rounds):
+        for term in terms:
+            start = time.perf_counter()
+            result = es.search(index=index, query=build(term), size=10, track_total_hits=True,
+                               request_cache=False)
+            latency.append((time.perf_counter() - start) * 1000)
+            took.append(result['took'])
+            totals[term] = result['hits']['total']['value']
+    return took, latency, totals
+
+
+def describe(name, took, latency):
+    latency = sorted(latency)
+    p95 = latency[int(len(latency) * 0.95) - 1]
+    print(f"{name:<28} took 平均 {statistics.mean(took):6.2f} ms   "
+          f"往返 中位数 {statistics.median(latency):6.2f} ms  p95 {p95:6.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='标签子串查询基准测试')
+    parser.add_argument('--host', default='http://10.0.0.215:9200')
+    parser.add_argument('--index', default='stockinfo')
+    parser.add_argument('--terms', type=int, default=50, help='查询词数量')
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    es = Elasticsearch(args.host)
+    terms = sample_terms(es, args.index, args.terms, args.seed)
+    print(f"{len(terms)} 个查询词 × {args.rounds} 轮，例如：{terms[:8]}")
+
+    # 预热
+    measure(es, args.index, terms, wildcard_query, 1)
+    measure(es, args.index, terms, ngram_query, 1)
+
+    wildcard_took, wildcard_latency, wildcard_totals = measure(es, args.index, terms, wildcard_query, args.rounds)
+    ngram_took, ngram_latency, ngram_totals = measure(es, args.index, terms, ngram_query, args.rounds)
+
+    mismatched = [term for term in terms if wildcard_totals[term] != ngram_totals[term]]
+    if mismatched:
+        print(f"✗ {len(mismatched)} 个查询词的命中数不一致：{mismatched[:10]}")
+    else:
+        print("✓ 两种查询的命中数完全一致")
+
+    describe("wildcard 标签.keyword *q*", wildcard_took, wildcard_latency)
+    describe("term 标签.ngram", ngram_took, ngram_latency)
+    print(f"took 加速比：{statistics.mean(wildcard_took) / max(statistics.mean(ngram_took), 0.01):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+本地 Elasticsearch 替身：用于压测网站本身，不依赖真实的 ES 集群
+
+多线程 HTTP 服务器，实现网站用到的几个接口（_search、_msearch、_pit、_doc）和导入用的 _bulk、建索引和修改索引设置，
+每个请求先等待 --latency 毫秒模拟 ES 的处理时间，再返回固定生成的文档；
+_bulk 请求另外按每条文档 --bulk-doc-us 微秒模拟写入耗时，并统计收到的文档数和字节数；
+--bulk-reject-rate 按比例把文档以 429 拒绝，模拟 ES 写入队列已满。
+响应带 X-Elastic-Product 头，官方 elasticsearch 客户端（同步和异步）会把它当作真实的 ES。
+
+用法：python bench/fake_es.py [--port 9299] [--latency 20]
+然后以 ES_URL=http://127.0.0.1:9299 启动 app.py 或 app_async.py
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+TOTAL_DOCS = 1000
+TAGS = ['人工智能', '半导体', '新能源汽车', '光伏', '医药', '军工', '消费电子', '储能']
+
+
+def make_doc(number):
+    """生成第 number 条文档"""
+    return {
+        '序号': number,
+        '题干': f'第 {number} 题：以下哪家公司属于{TAGS[number % len(TAGS)]}板块？',
+        '选项A': f'公司{number}A', '选项B': f'公司{number}B', '选项C': f'公司{number}C', '选项D': f'公司{number}D',
+        '解析': f'第 {number} 题的解析。',
+        '分数': '1',
+        '答案': 'A',
+        '标签': TAGS[number % len(TAGS)],
+        'unique_id': f'doc{number:06d}'
+    }
+
+
+DOCS = [make_doc(number) for number in range(1, TOTAL_DOCS + 1)]
+
+
+class FakeESHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # 响应头和响应体分两次写出，不关闭 Nagle 时长连接上每个请求会多等一个延迟确认（约 40 ms）
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        return raw
+
+    def handle_request(self):
+        raw = self.read_body()
+        time.sleep(self.server.latency)
+        path = urlsplit(self.path).path
+        self.server.count_request()
+
+        if path == '/':
+            return self.send_json({'name': 'fake-es', 'cluster_name': 'fake', 'version': {'number': '8.14.1'},
+                                   'tagline': 'You Know, for Search'})
+        if path.endswith('/_pit'):
+            if self.command == 'DELETE':
+                freed = self.server.pits.discard_pit(json.loads(raw or b'{}').get('id'))
+                return self.send_json({'succeeded': True, 'num_freed': freed})
+            return self.send_json({'id': self.server.pits.open_pit()})
+        if path.endswith('/_bulk'):
+            return self.send_json(self.bulk(raw))
+        if path.endswith('/_msearch'):
+            lines = [json.loads(line) for line in raw.splitlines() if line.strip()]
+            responses = [dict(self.search(body), status=200) for body in lines[1::2]]
+            return self.send_json({'took': int(self.server.latency * 1000), 'responses': responses})
+        if path.endswith('/_search'):
+            body = json.loads(raw or b'{}')
+            if 'pit' in body and body['pit'].get('id') not in self.server.pits:
+                # 与 ES 相同：已释放或不存在的 point-in-time 返回 404
+                return self.send_json({'error': {'type': 'search_context_missing_exception',
+                                                 'reason': 'No search context found for id'}, 'status': 404},
+                                      status=404)
+            return self.send_json(self.search(body))
+        match = re.fullmatch(r'/[^/]+/_doc/([^/]+)', path)
+        if match:
+            return self.get_doc(match.group(1))
+        if self.command in ('PUT', 'DELETE') and re.fullmatch(r'/[^/_][^/]*', path):
+            # 创建或删除索引
+            return self.send_json({'acknowledged': True, 'index': path[1:]})
+        if path.endswith('/_refresh') or path.endswith('/_forcemerge'):
+            return self.send_json({'_shards': {'total': 1, 'successful': 1, 'failed': 0}})
+        if self.command == 'PUT' and path.endswith('/_settings'):
+            return self.send_json({'acknowledged': True})
+        return self.send_json({'error': f'fake-es 不支持 {self.command} {path}'}, status=404)
+
+    def search(self, body):
+        """返回固定排序的文档；支持 from/size、search_after 和 size=0 的聚合"""
+        size = body.get('size', 10)
+        start = body.get('from', 0)
+        if body.get('search_after'):
+            start = body['search_after'][1]
+        hits = []
+        for doc in DOCS[start:start + size]:
+            hits.append({'_index': 'stockinfo_v1', '_id': doc['unique_id'], '_score': 1.0, '_source': doc,
+                         'sort': [1.0, doc['序号'], doc['unique_id']]})
+        result = {
+            'took': int(self.server.latency * 1000), 'timed_out': False,
+            '_shards': {'total': 1, 'successful': 1, 'skipped': 0, 'failed': 0},
+            'hits': {'total': {'value': TOTAL_DOCS, 'relation': 'eq'}, 'max_score': 1.0, 'hits': hits}
+        }
+        if 'pit' in body:
+            result['pit_id'] = body['pit']['id']
+        if 'aggs' in body:
+            # /tags 的 tags 聚合与 /search 的 tag_facets 聚合都返回同样的标签分布
+            result['aggregations'] = {name: {'buckets': [
+                {'key': tag, 'doc_count': TOTAL_DOCS // len(TAGS)} for tag in TAGS]} for name in body['aggs']}
+        return result
+
+    def bulk(self, raw):
+        """_bulk：只支持 index 动作（每条文档一行动作、一行文档），按 bulk_reject_rate 随机以 429 拒绝"""
+        lines = [line for line in raw.splitlines() if line.strip()]
+        items = []
+        for action_line in lines[0::2]:
+            meta = json.loads(action_line).get('index', {})
+            if random.random() < self.server.bulk_reject_rate:
+                items.append({'index': {'_index': meta.get('_index'), '_id': meta.get('_id'), 'status': 429,
+                                        'error': {'type': 'es_rejected_execution_exception',
+                                                  'reason': 'fake-es 写入队列已满'}}})
+                continue
+            items.append({'index': {'_index': meta.get('_index'), '_id': meta.get('_id'), 'status': 201,
+                                    'result': 'created'}})
+        time.sleep(len(items) * self.server.bulk_doc_latency)
+        self.server.count_bulk(len(items), len(raw))
+        errors = any(item['index']['status'] >= 300 for item in items)
+        return {'took': int(self.server.latency * 1000), 'errors': errors, 'items': items}
+
+    def get_doc(self, doc_id):
+        number = int(doc_id[3:]) if doc_id.startswith('doc') and doc_id[3:].isdigit() else 0
+        if not 1 <= number <= TOTAL_DOCS:
+            return self.send_json({'_index': 'stockinfo_v1', '_id': doc_id, 'found': False}, status=404)
+        return self.send_json({'_index': 'stockinfo_v1', '_id': doc_id, 'found': True,
+                               '_source': DOCS[number - 1]})
+
+    do_GET = do_POST = do_PUT = do_DELETE = handle_request
+
+    def do_HEAD(self):
+        self.server.count_request()
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.end_headers()
+
+
+class PitRegistry:
+    """记录打开的 point-in-time，用来模拟已释放的 point-in-time 再被使用时的 404"""
+
+    def __init__(self):
+        self.ids = set()
+        self.lock = threading.Lock()
+
+    def __contains__(self, pit_id):
+        with self.lock:
+            return pit_id in self.ids
+
+    def __len__(self):
+        with self.lock:
+            return len(self.ids)
+
+    def open_pit(self):
+        pit_id = f'fake-pit-{time.time_ns()}'
+        with self.lock:
+            self.ids.add(pit_id)
+        return pit_id
+
+    def discard_pit(self, pit_id):
+        with self.lock:
+            if pit_id in self.ids:
+                self.ids.remove(pit_id)
+                return 1
+            return 0
+
+
+class FakeES(ThreadingHTTPServer):
+    """ES 替身服务器，latency 为每个请求的模拟处理时间（秒）"""
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, port=9299, latency=0.02, bulk_doc_latency=0.0, bulk_reject_rate=0.0):
+        super().__init__(('127.0.0.1', port), FakeESHandler)
+        self.latency = latency
+        # _bulk 中每条文档额外的模拟写入耗时（秒），以及以 429 拒绝的比例
+        self.bulk_doc_latency = bulk_doc_latency
+        self.bulk_reject_rate = bulk_reject_rate
+        self.requests = 0
+        self.bulk_docs = 0
+        self.bulk_bytes = 0
+        self.lock = threading.Lock()
+        self.pits = PitRegistry()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def count_bulk(self, docs, size):
+        with self.lock:
+            self.bulk_docs += docs
+            self.bulk_bytes += size
+
+    def start(self):
+        """在后台线程中运行"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地 Elasticsearch 替身')
+    parser.add_argument('--port', type=int, default=9299)
+    parser.add_argument('--latency', type=float, default=20, help='每个请求的模拟处理时间（毫秒）')
+    parser.add_argument('--bulk-doc-us', type=float, default=0, help='_bulk 中每条文档的模拟写入时间（微秒）')
+    parser.add_argument('--bulk-reject-rate', type=float, default=0, help='_bulk 中以 429 拒绝的文档比例')
+    args = parser.parse_args()
+
+    server = FakeES(args.port, args.latency / 1000, args.bulk_doc_us / 1e6, args.bulk_reject_rate)
+    print(f"fake-es 已启动：{server.url}（模拟延迟 {args.latency} ms）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
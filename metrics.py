@@ -0,0 +1,216 @@
+# metrics.py
+"""
+网站的运行指标，以 Prometheus 文本格式从 /metrics 输出
+
+  - http_requests_total / http_request_errors_total：按路由、状态码计数
+  - http_request_duration_seconds：每个路由的总耗时直方图
+  - http_response_size_bytes：每个路由的响应体大小直方图
+  - request_phase_seconds：请求内部各阶段耗时，phase 为 es（ES 往返）、es_took（ES 自身处理时间）、
+    format（整理结果并序列化），用来区分时间花在 ES 还是网站本身；改查本地全文库时为 local / local_took
+  - search_cache_*：查询结果缓存的命中数和命中率
+
+每个请求的阶段耗时同时写入 Server-Timing 响应头，可在浏览器开发者工具中直接查看。
+不依赖 prometheus_client，同步版和异步版网站共用。
+"""
+import os
+import time
+import random
+import threading
+from contextlib import contextmanager
+
+# 耗时直方图的分桶（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# 响应大小直方图的分桶（字节）
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# 请求日志的采样比例：每个请求都打印完整结果会拖慢响应，只按比例抽样记录
+LOG_SAMPLE_RATE = float(os.getenv('SEARCH_LOG_SAMPLE_RATE', '0.01'))
+
+
+def log_sampled():
+    """本次请求是否需要记录采样日志"""
+    return random.random() < LOG_SAMPLE_RATE
+
+
+def format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{name}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """按标签累加的计数器"""
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        return [f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}" for key, value in items]
+
+
+class Histogram:
+    """按标签分组的直方图，输出 _bucket / _sum / _count"""
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        # 标签 -> [每个分桶的计数（不累计）, 总和, 总数]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][position] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self.lock:
+            items = sorted((key, (list(entry[0]), entry[1], entry[2])) for key, entry in self.values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = format_labels(self.labelnames, key, [('le', format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """指标集合；collectors 为在输出时才读取数值的回调（如缓存统计），返回 [(名称, 类型, 说明, 值)]"""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        for collector in self.collectors:
+            for name, kind, help, value in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name} {format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUESTS = registry.register(Counter(
+    'http_requests_total', '按路由和状态码统计的请求数', ('route', 'method', 'status')))
+ERRORS = registry.register(Counter(
+    'http_request_errors_total', '状态码为 4xx/5xx 的请求数', ('route', 'status')))
+REQUEST_DURATION = registry.register(Histogram(
+    'http_request_duration_seconds', '请求总耗时（秒）', ('route',)))
+RESPONSE_SIZE = registry.register(Histogram(
+    'http_response_size_bytes', '响应体大小（字节）', ('route',), SIZE_BUCKETS))
+PHASE_DURATION = registry.register(Histogram(
+    'request_phase_seconds', '请求内部各阶段耗时（秒）：es 为 ES 往返，es_took 为 ES 自身处理时间，format 为整理和序列化结果',
+    ('route', 'phase')))
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def cache_collector(search_cache):
+    """把查询结果缓存的统计转换为指标"""
+    def collect():
+        stats = search_cache.stats()
+        return [
+            ('search_cache_hits_total', 'counter', '查询结果缓存命中次数', stats['hits']),
+            ('search_cache_misses_total', 'counter', '查询结果缓存未命中次数', stats['misses']),
+            ('search_cache_hit_ratio', 'gauge', '查询结果缓存命中率', stats['hit_ratio']),
+        ]
+    return collect
+
+
+class Timings:
+    """一次请求内各阶段的耗时（秒），以及缓存是否命中等标记"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.cache = None
+
+    @contextmanager
+    def measure(self, phase):
+        """累计 with 块内的耗时，同一阶段多次进入时相加（如打开 PIT 再查询）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start)
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def server_timing(self, total):
+        """Server-Timing 响应头，单位为毫秒"""
+        parts = [f"{phase};dur={seconds * 1000:.2f}" for phase, seconds in self.phases.items()]
+        if self.cache is not None:
+            parts.append(f'cache;desc="{self.cache}"')
+        parts.append(f"total;dur={total * 1000:.2f}")
+        return ', '.join(parts)
+
+
+def record_request(route, method, status, size, timings):
+    """请求结束时记录指标，返回 Server-Timing 响应头的值"""
+    total = timings.elapsed()
+    REQUESTS.inc(route=route, method=method, status=status)
+    if status >= 400:
+        ERRORS.inc(route=route, status=status)
+    REQUEST_DURATION.observe(total, route=route)
+    if size is not None:
+        RESPONSE_SIZE.observe(size, route=route)
+    for phase, seconds in timings.phases.items():
+        PHASE_DURATION.observe(seconds, route=route, phase=phase)
+    return timings.server_timing(total)
@@ -0,0 +1,400 @@
+# search_backends.py
+"""
+/search、/msearch、/question、/tags、/export 使用的查询后端
+
+  - ESBackend：Elasticsearch
+  - LocalBackend：导入工具与 ES 同步生成的本地 SQLite 全文库（tool/local_search.py），不需要 ES
+  - FailoverBackend：先查主后端，主后端不可用（连接失败、超时、5xx / 429、本地库缺失）时自动改查备用后端，
+    之后 FAILOVER_RETRY_AFTER 秒内直接使用备用后端，到期后再试探主后端是否恢复
+
+默认 ES 为主后端、本地库为备用；设置 SEARCH_PREFER_LOCAL=1 时反过来，热点读取在进程内完成，
+本地库不可用时再查 ES。两个后端返回的结果结构相同（与 ES search 的返回值一致），
+由 search_service 整理为接口的 JSON。
+
+app_async.py 使用 create_async_backend 组装的异步版本（AsyncESBackend，在线程池中查询本地库的 ThreadedBackend，
+AsyncFailoverBackend），查询体、point-in-time 和切换规则与同步版相同。
+"""
+import os
+import time
+import asyncio
+import sqlite3
+import logging
+
+from elastic_transport import TransportError
+from elasticsearch import ApiError, NotFoundError
+
+import metrics
+from search_service import (EXPORT_BATCH_SIZE, INDEX_NAME, PIT_KEEP_ALIVE, TAG_FACET_SIZE, TAGS_AGGREGATION,
+                            build_export_request, build_msearch_body, build_search_request)
+from tool.local_search import LocalSearchIndex
+
+logger = logging.getLogger(__name__)
+
+# 主后端失败后，多长时间内不再尝试它（秒）
+FAILOVER_RETRY_AFTER = float(os.getenv('SEARCH_FAILOVER_RETRY_AFTER', '30'))
+
+# 为 1 时优先使用本地库
+PREFER_LOCAL = os.getenv('SEARCH_PREFER_LOCAL', '0') == '1'
+
+BACKEND_REQUESTS = metrics.registry.register(metrics.Counter(
+    'search_backend_requests_total', '各查询后端处理的请求数', ('backend', 'operation')))
+BACKEND_FAILOVERS = metrics.registry.register(metrics.Counter(
+    'search_backend_failovers_total', '主后端不可用、改用备用后端的次数', ('backend',)))
+
+
+CURSOR_EXPIRED_MESSAGE = '分页游标已过期或无效，请重新搜索'
+
+
+def paged_search_body(params, pit_id=None):
+    """
+    /search 的请求体：游标翻页在 point-in-time 上用 search_after，否则用 from
+    游标中的排序值来自不带 point-in-time 的第一页，只有显式的排序字段，ES 不会再追加 _shard_doc
+    """
+    search_body = build_search_request(params)
+    # size / from 放在查询体中（同时传 body 和 size 参数时客户端会改写 body）
+    search_body['size'] = params['size']
+    if params['search_after'] is not None:
+        search_body['pit'] = {'id': pit_id, 'keep_alive': PIT_KEEP_ALIVE}
+        search_body['search_after'] = params['search_after']
+    else:
+        search_body['from'] = (params['page'] - 1) * params['size']
+    return search_body
+
+
+class CursorExpiredError(Exception):
+    """游标中的 point-in-time 已过期（超过 keep_alive）、不存在（如 ES 重启）或游标被篡改，需要从第一页重新搜索"""
+
+
+class ESBackend:
+    """Elasticsearch 后端"""
+    name = 'es'
+
+    def __init__(self, es):
+        self.es = es
+
+    def unavailable(self, error):
+        """是否属于后端不可用（应改用备用后端），而不是查询本身的问题"""
+        if isinstance(error, ApiError):
+            return error.meta.status >= 500 or error.meta.status == 429
+        return isinstance(error, TransportError)
+
+    def cursor_expired(self, error):
+        """游标翻页的查询失败是否因为游标失效：404 为 point-in-time 已过期或不存在，400 为游标中的值不合法"""
+        return isinstance(error, ApiError) and error.meta.status in (400, 404)
+
+    def search(self, params):
+        """
+        执行 /search 的查询，返回 (结果, pit_id)
+        普通请求（包括本地库生成的、不带排序值的游标）用 from/size 查询，不打开 point-in-time，结果可以缓存；
+        第一次跟随游标时才打开 point-in-time，之后的游标翻页都在同一个快照上查询，没有下一页时由调用方释放。
+        游标中的 point-in-time 已过期或游标无效时抛出 CursorExpiredError
+        """
+        if params['search_after'] is None:
+            return self.es.search(index=INDEX_NAME, body=paged_search_body(params)), None
+
+        pit_id = params['pit_id']
+        opened = pit_id is None
+        if opened:
+            pit_id = self.es.open_point_in_time(index=INDEX_NAME, keep_alive=PIT_KEEP_ALIVE)['id']
+        try:
+            result = self.es.search(body=paged_search_body(params, pit_id))
+        except Exception as e:
+            if opened:
+                self.release_pit(pit_id)
+            if self.cursor_expired(e):
+                raise CursorExpiredError(CURSOR_EXPIRED_MESSAGE) from e
+            raise
+        return result, result.get('pit_id', pit_id)
+
+    def msearch(self, params_list):
+        """/msearch 中未命中缓存的查询合并成一次 _msearch 请求，返回值与 ES msearch 相同"""
+        return self.es.msearch(searches=build_msearch_body(params_list))
+
+    def release_pit(self, pit_id):
+        """释放 point-in-time，失败时只记录日志（未释放的到期后由 ES 自动清理）"""
+        try:
+            self.es.close_point_in_time(id=pit_id)
+        except Exception as e:
+            logger.warning('close point-in-time failed: %s', e)
+
+    def get(self, doc_id):
+        """按 _id 取文档，不存在时返回 None"""
+        try:
+            return self.es.get(index=INDEX_NAME, id=doc_id)['_source']
+        except NotFoundError:
+            return None
+
+    def tags(self):
+        return self.es.search(index=INDEX_NAME, body=TAGS_AGGREGATION)
+
+    def export(self, params):
+        """
+        导出查询的全部结果，返回逐批产出命中结果的生成器
+        point-in-time 在这里打开（ES 不可用时立即抛出），生成器结束或被关闭（客户端断开）时释放
+        """
+        pit_id = self.es.open_point_in_time(index=INDEX_NAME, keep_alive=PIT_KEEP_ALIVE)['id']
+        return self.iter_export(params, pit_id)
+
+    def iter_export(self, params, pit_id):
+        search_body = dict(build_export_request(params), size=EXPORT_BATCH_SIZE)
+        try:
+            while True:
+                search_body['pit'] = {'id': pit_id, 'keep_alive': PIT_KEEP_ALIVE}
+                result = self.es.search(body=search_body)
+                pit_id = result.get('pit_id', pit_id)
+                hits = result['hits']['hits']
+                if hits:
+                    yield hits
+                if len(hits) < EXPORT_BATCH_SIZE:
+                    return
+                search_body['search_after'] = hits[-1]['sort']
+        finally:
+            self.release_pit(pit_id)
+
+
+class AsyncESBackend(ESBackend):
+    """ESBackend 的异步版本（AsyncElasticsearch，app_async.py 使用），查询体、point-in-time 和错误处理与同步版相同"""
+
+    async def search(self, params):
+        if params['search_after'] is None:
+            return await self.es.search(index=INDEX_NAME, body=paged_search_body(params)), None
+
+        pit_id = params['pit_id']
+        opened = pit_id is None
+        if opened:
+            pit_id = (await self.es.open_point_in_time(index=INDEX_NAME, keep_alive=PIT_KEEP_ALIVE))['id']
+        try:
+            result = await self.es.search(body=paged_search_body(params, pit_id))
+        except Exception as e:
+            if opened:
+                await self.release_pit(pit_id)
+            if self.cursor_expired(e):
+                raise CursorExpiredError(CURSOR_EXPIRED_MESSAGE) from e
+            raise
+        return result, result.get('pit_id', pit_id)
+
+    async def msearch(self, params_list):
+        return await self.es.msearch(searches=build_msearch_body(params_list))
+
+    async def release_pit(self, pit_id):
+        try:
+            await self.es.close_point_in_time(id=pit_id)
+        except Exception as e:
+            logger.warning('close point-in-time failed: %s', e)
+
+    async def get(self, doc_id):
+        try:
+            return (await self.es.get(index=INDEX_NAME, id=doc_id))['_source']
+        except NotFoundError:
+            return None
+
+    async def tags(self):
+        return await self.es.search(index=INDEX_NAME, body=TAGS_AGGREGATION)
+
+    async def export(self, params):
+        """返回逐批产出命中结果的异步生成器，point-in-time 的打开和释放与同步版相同"""
+        pit_id = (await self.es.open_point_in_time(index=INDEX_NAME, keep_alive=PIT_KEEP_ALIVE))['id']
+        return self.iter_export(params, pit_id)
+
+    async def iter_export(self, params, pit_id):
+        search_body = dict(build_export_request(params), size=EXPORT_BATCH_SIZE)
+        try:
+            while True:
+                search_body['pit'] = {'id': pit_id, 'keep_alive': PIT_KEEP_ALIVE}
+                result = await self.es.search(body=search_body)
+                pit_id = result.get('pit_id', pit_id)
+                hits = result['hits']['hits']
+                if hits:
+                    yield hits
+                if len(hits) < EXPORT_BATCH_SIZE:
+                    return
+                search_body['search_after'] = hits[-1]['sort']
+        finally:
+            await self.release_pit(pit_id)
+
+
+class LocalBackend:
+    """本地 SQLite 全文库后端；不支持 point-in-time，游标请求按游标中的页码查询，生成的游标不带排序值"""
+    name = 'local'
+
+    def __init__(self, index=None):
+        self.index = index or LocalSearchIndex()
+
+    def unavailable(self, error):
+        return isinstance(error, (sqlite3.Error, OSError))
+
+    def search(self, params):
+        result = self.index.search(params['query'], params['search_type'], params['field_filter'],
+                                   params['page'], params['size'], params['tags'],
+                                   TAG_FACET_SIZE if params['facets'] else 0)
+        return result, None
+
+    def msearch(self, params_list):
+        """逐个查询，结果整理成与 ES msearch 相同的结构"""
+        responses = [self.search(params)[0] for params in params_list]
+        return {'took': sum(response['took'] for response in responses), 'responses': responses}
+
+    def release_pit(self, pit_id):
+        pass
+
+    def get(self, doc_id):
+        return self.index.get(doc_id)
+
+    def tags(self):
+        return self.index.tags()
+
+    def export(self, params):
+        """按页读取全部结果；库文件不存在时在这里抛出，由 FailoverBackend 改用 ES"""
+        self.index.connection()
+        return self.iter_export(params)
+
+    def iter_export(self, params):
+        page = 1
+        while True:
+            hits = self.index.search(params['query'], params['search_type'], params['field_filter'],
+                                     page, EXPORT_BATCH_SIZE, params['tags'])['hits']['hits']
+            if hits:
+                yield hits
+            if len(hits) < EXPORT_BATCH_SIZE:
+                return
+            page += 1
+
+
+class ThreadedBackend:
+    """
+    在线程池中调用同步后端，供 app_async.py 使用（SQLite 查询会阻塞事件循环）
+    本地库的连接按线程创建，在哪个工作线程中执行都可以
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.name = backend.name
+
+    def unavailable(self, error):
+        return self.backend.unavailable(error)
+
+    async def search(self, params):
+        return await asyncio.to_thread(self.backend.search, params)
+
+    async def msearch(self, params_list):
+        return await asyncio.to_thread(self.backend.msearch, params_list)
+
+    async def release_pit(self, pit_id):
+        await asyncio.to_thread(self.backend.release_pit, pit_id)
+
+    async def get(self, doc_id):
+        return await asyncio.to_thread(self.backend.get, doc_id)
+
+    async def tags(self):
+        return await asyncio.to_thread(self.backend.tags)
+
+    async def export(self, params):
+        batches = await asyncio.to_thread(self.backend.export, params)
+        return self.iter_batches(batches)
+
+    async def iter_batches(self, batches):
+        """逐批在线程池中读取同步生成器，异步生成器被关闭时同时关闭它"""
+        try:
+            while True:
+                hits = await asyncio.to_thread(next, batches, None)
+                if hits is None:
+                    return
+                yield hits
+        finally:
+            batches.close()
+
+
+class FailoverBackend:
+    """
+    主后端加备用后端，方法返回 (结果, 实际使用的后端名)
+    主后端不可用时记下时间，FAILOVER_RETRY_AFTER 秒内直接使用备用后端；其他异常照常抛出
+    """
+
+    def __init__(self, primary, fallback, retry_after=FAILOVER_RETRY_AFTER):
+        self.primary = primary
+        self.fallback = fallback
+        self.retry_after = retry_after
+        self.primary_down_until = 0.0
+
+    @property
+    def preferred(self):
+        return self.primary.name
+
+    def primary_ready(self):
+        return time.monotonic() >= self.primary_down_until
+
+    def primary_failed(self, error):
+        """主后端出错：不可用时记下时间、改用备用后端，其他异常重新抛出"""
+        if not self.primary.unavailable(error):
+            raise error
+        logger.warning('%s backend unavailable, using %s for %ss: %s',
+                       self.primary.name, self.fallback.name, self.retry_after, error)
+        self.primary_down_until = time.monotonic() + self.retry_after
+        BACKEND_FAILOVERS.inc(backend=self.primary.name)
+
+    def served(self, backend, operation, result):
+        BACKEND_REQUESTS.inc(backend=backend.name, operation=operation)
+        return result, backend.name
+
+    def call(self, operation, *args):
+        if self.primary_ready():
+            try:
+                return self.served(self.primary, operation, getattr(self.primary, operation)(*args))
+            except Exception as e:
+                self.primary_failed(e)
+        return self.served(self.fallback, operation, getattr(self.fallback, operation)(*args))
+
+    def search(self, params):
+        """返回 ((结果, pit_id), 后端名)"""
+        return self.call('search', params)
+
+    def msearch(self, params_list):
+        """返回 (与 ES msearch 结构相同的结果, 后端名)"""
+        return self.call('msearch', params_list)
+
+    def get(self, doc_id):
+        return self.call('get', doc_id)
+
+    def tags(self):
+        return self.call('tags')
+
+    def export(self, params):
+        """返回 (逐批产出命中结果的生成器, 后端名)；导出开始后主后端出错不再切换"""
+        return self.call('export', params)
+
+    def close_pit(self, backend_name, pit_id):
+        """在打开 point-in-time 的那个后端上释放它；失败只记录日志，不影响已经查到的最后一页"""
+        backend = self.primary if backend_name == self.primary.name else self.fallback
+        backend.release_pit(pit_id)
+
+
+class AsyncFailoverBackend(FailoverBackend):
+    """FailoverBackend 的异步版本：主、备后端的方法都是协程，search / msearch / get / tags / export 需要 await"""
+
+    async def call(self, operation, *args):
+        if self.primary_ready():
+            try:
+                return self.served(self.primary, operation, await getattr(self.primary, operation)(*args))
+            except Exception as e:
+                self.primary_failed(e)
+        return self.served(self.fallback, operation, await getattr(self.fallback, operation)(*args))
+
+    async def close_pit(self, backend_name, pit_id):
+        backend = self.primary if backend_name == self.primary.name else self.fallback
+        await backend.release_pit(pit_id)
+
+
+def create_backend(es):
+    """按 SEARCH_PREFER_LOCAL 组装主后端和备用后端"""
+    es_backend, local_backend = ESBackend(es), LocalBackend()
+    if PREFER_LOCAL:
+        return FailoverBackend(local_backend, es_backend)
+    return FailoverBackend(es_backend, local_backend)
+
+
+def create_async_backend(es):
+    """create_backend 的异步版本，es 为 AsyncElasticsearch；本地库在线程池中查询"""
+    es_backend, local_backend = AsyncESBackend(es), ThreadedBackend(LocalBackend())
+    if PREFER_LOCAL:
+        return AsyncFailoverBackend(local_backend, es_backend)
+    return AsyncFailoverBackend(es_backend, local_backend)
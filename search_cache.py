@@ -0,0 +1,187 @@
+# search_cache.py
+"""
+/search 查询结果缓存
+
+缓存键为规范化后的 (q, type, field, page, size)，缓存值为序列化好的 JSON 响应体。
+导入工具每次发布新数据都会改写 data/es_artifacts/generation.json，
+缓存发现该文件变化后立即整体失效，不必等 TTL 过期。
+
+默认使用进程内 LRU + TTL 缓存；设置环境变量 SEARCH_CACHE_REDIS_URL 且安装了 redis 时，
+改用 Redis 在多个 worker 进程之间共享缓存。
+"""
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # redis 为可选依赖
+    redis = None
+
+ARTIFACT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'es_artifacts')
+GENERATION_FILE = os.path.join(ARTIFACT_DIR, 'generation.json')
+
+# 检查 generation.json 的最小间隔（秒），避免每个请求都 stat 一次文件
+GENERATION_CHECK_INTERVAL = 1.0
+
+
+def normalize_search_key(query, search_type, field_filter, page, size, *extra):
+    """规范化查询参数作为缓存键；除 precise 以外的查询类型都按全文搜索处理"""
+    search_type = 'precise' if search_type == 'precise' else 'fulltext'
+    return json.dumps([query.strip(), search_type, field_filter or 'all', int(page), int(size), *extra],
+                      ensure_ascii=False)
+
+
+class GenerationWatcher:
+    """读取导入工具发布的数据版本号（generation.json 的内容）"""
+
+    def __init__(self, path=GENERATION_FILE):
+        self.path = path
+        self.generation = None
+        self.mtime = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def current(self):
+        """返回当前数据版本号，文件不存在时为 '0'"""
+        now = time.monotonic()
+        if now - self.checked_at < GENERATION_CHECK_INTERVAL and self.generation is not None:
+            return self.generation
+        with self.lock:
+            self.checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                self.generation, self.mtime = '0', None
+                return self.generation
+            if mtime != self.mtime:
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        self.generation = str(json.load(f).get('generation', mtime))
+                except (OSError, ValueError):
+                    self.generation = str(mtime)
+                self.mtime = mtime
+        return self.generation
+
+
+class SearchCache:
+    """进程内 LRU + TTL 缓存，数据版本变化时整体清空"""
+
+    def __init__(self, max_entries=2000, ttl=300, generation_watcher=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generation_watcher = generation_watcher or GenerationWatcher()
+        self.generation = None
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _check_generation(self):
+        generation = self.generation_watcher.current()
+        if generation != self.generation:
+            if self.generation is not None:
+                self.invalidations += 1
+            self.entries.clear()
+            self.generation = generation
+
+    def get(self, key):
+        with self.lock:
+            self._check_generation()
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self.lock:
+            self._check_generation()
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'backend': 'memory',
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'generation': self.generation,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0,
+                'invalidations': self.invalidations
+            }
+
+
+class RedisSearchCache:
+    """
+    基于 Redis 的共享缓存：数据版本号作为键的一部分，版本变化后旧键自然不再命中，由 TTL 回收
+    命中统计为当前进程内的统计
+    """
+
+    def __init__(self, url, ttl=300, generation_watcher=None, prefix='stockinfo:search:'):
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.generation_watcher = generation_watcher or GenerationWatcher()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _key(self, key):
+        return f"{self.prefix}{self.generation_watcher.current()}:{key}"
+
+    def _count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get(self, key):
+        try:
+            value = self.client.get(self._key(key))
+        except redis.RedisError:
+            # Redis 不可用时当作未命中，直接查询 ES
+            self._count('errors')
+            value = None
+        self._count('hits' if value is not None else 'misses')
+        return value
+
+    def set(self, key, value):
+        try:
+            self.client.setex(self._key(key), self.ttl, value)
+        except redis.RedisError:
+            self._count('errors')
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'backend': 'redis',
+                'ttl': self.ttl,
+                'generation': self.generation_watcher.current(),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0,
+                'errors': self.errors
+            }
+
+
+def create_search_cache():
+    """按环境变量创建缓存：SEARCH_CACHE_REDIS_URL、SEARCH_CACHE_TTL、SEARCH_CACHE_MAX_ENTRIES"""
+    ttl = int(os.getenv('SEARCH_CACHE_TTL', '300'))
+    redis_url = os.getenv('SEARCH_CACHE_REDIS_URL')
+    if redis_url and redis is not None:
+        return RedisSearchCache(redis_url, ttl=ttl)
+    return SearchCache(max_entries=int(os.getenv('SEARCH_CACHE_MAX_ENTRIES', '2000')), ttl=ttl)
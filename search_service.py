@@ -0,0 +1,560 @@
+# search_service.py
+"""
+同步版 app.py 与异步版 app_async.py 共用的查询逻辑
+
+这里只负责：解析请求参数、构建 ES 查询体、把 ES 返回结果整理成接口的 JSON 结构，
+不做任何网络请求，因此两个版本返回的 JSON 完全一致。
+"""
+import io
+import os
+import csv
+import hmac
+import json
+import math
+import base64
+
+# Elasticsearch 地址：设置环境变量 ES_URL（如 http://127.0.0.1:9200）时使用该地址
+ES_URL = os.getenv('ES_URL')
+ES_HOSTS = [ES_URL] if ES_URL else [{
+    'host': '10.0.0.215',
+    'port': 9200,
+    'scheme': 'http'
+}]
+
+# 索引名称
+INDEX_NAME = 'stockinfo'
+
+# 管理员令牌：请求头 X-Admin-Token 与之一致时才允许 ?profile=1 等调试功能；未设置时调试功能关闭
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+# 标签 n-gram 子字段的最大长度，与导入工具 tool_csv_to_es2.TAG_NGRAM_MAX_GRAM 一致
+TAG_NGRAM_MAX_GRAM = 15
+
+# 合并检索字段，与导入工具 tool_csv_to_es2.COMBINED_FIELD 一致
+COMBINED_FIELD = '全文'
+
+# 全字段全文搜索的方式：fields 逐字段 multi_match（原有方式），combined 主要查询合并字段
+SEARCH_MODES = ('fields', 'combined')
+DEFAULT_SEARCH_MODE = os.getenv('SEARCH_MODE', 'fields')
+
+# 全字段搜索时高亮的字段
+HIGHLIGHT_FIELDS = ["题干", "选项A", "选项B", "选项C", "选项D", "选项E", "选项F", "选项G", "选项H", "解析", "标签"]
+
+# 单页最多返回的条数
+MAX_PAGE_SIZE = 100
+
+# /msearch 一次最多接受的查询数
+MAX_MSEARCH_QUERIES = 100
+
+# /search 一次最多按多少个标签过滤
+MAX_TAG_FILTERS = 20
+
+# /search 结果中返回的标签分面（各标签的命中文档数）数量上限
+TAG_FACET_SIZE = int(os.getenv('TAG_FACET_SIZE', '50'))
+
+# /export 每批读取的条数：point-in-time + search_after 逐批读取、逐批输出，内存占用与导出总数无关
+EXPORT_BATCH_SIZE = 1000
+
+# /export 支持的格式及响应类型
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv; charset=utf-8'}
+
+# CSV 导出的列（除 id 外都取自文档），多个标签以分号连接
+EXPORT_COLUMNS = ['id', '序号', '题干', '选项A', '选项B', '选项C', '选项D', '选项E', '选项F', '选项G', '选项H',
+                  '答案', '分数', '解析', '标签']
+
+# 导出不需要相关度：按 _shard_doc（point-in-time 上分片内的文档顺序）排序，不计算评分，翻页最快
+EXPORT_SORT = [{"_shard_doc": "asc"}]
+
+# 游标翻页时 point-in-time 的保持时间
+PIT_KEEP_ALIVE = '5m'
+
+# 搜索结果排序：相关度优先，相同时按序号、unique_id 排序，保证 search_after 翻页稳定不重复
+SEARCH_SORT = [
+    {"_score": {"order": "desc"}},
+    {"序号": {"order": "asc", "missing": "_last", "unmapped_type": "integer"}},
+    {"unique_id": {"order": "asc", "unmapped_type": "keyword"}}
+]
+
+# /tags 在标签词典不存在时使用的聚合查询
+TAGS_AGGREGATION = {
+    "size": 0,
+    "aggs": {
+        "tags": {
+            "terms": {
+                "field": "标签.keyword",
+                "size": 1000
+            }
+        }
+    }
+}
+
+
+def tag_substring_clause(query):
+    """
+    标签子串匹配：查询词不超过 n-gram 长度时，对 标签.ngram 做 term 查询（一次索引查找），
+    否则退回到 wildcard；外层 constant_score 保持与 wildcard 相同的评分
+    """
+    if len(query) <= TAG_NGRAM_MAX_GRAM:
+        return {"constant_score": {"filter": {"term": {"标签.ngram": query}}}}
+    return {"wildcard": {"标签.keyword": f"*{query}*"}}
+
+
+def combined_search_body(query):
+    """
+    全字段搜索的合并字段版本：短语匹配和分词匹配都只查 全文 一个字段，
+    另外对 题干、标签 单独加权，保持它们比选项、解析更高的权重
+    """
+    return {
+        "query": {
+            "bool": {
+                "should": [
+                    {"match_phrase": {COMBINED_FIELD: {"query": query, "boost": 6}}},
+                    {"match": {COMBINED_FIELD: {"query": query, "operator": "or"}}},
+                    {"match_phrase": {"题干": {"query": query, "boost": 3}}},
+                    {"match": {"标签": {"query": query, "boost": 2}}}
+                ],
+                "minimum_should_match": 1
+            }
+        },
+        "highlight": {
+            "pre_tags": ["<span class='highlight'>"],
+            "post_tags": ["</span>"],
+            # 查询条件大多落在 全文 上，高亮原字段时不要求字段与查询条件一致
+            "require_field_match": False,
+            "fields": {field: {} for field in HIGHLIGHT_FIELDS}
+        }
+    }
+
+
+def build_search_body(query, search_type, field_filter, mode='fields'):
+    """根据查询词、查询类型和字段过滤构建 Elasticsearch 查询体；mode 只影响全字段全文搜索"""
+    # 构建Elasticsearch查询
+    if query:
+        if search_type == 'precise':
+            # 精准查询 - 使用term查询
+            if field_filter != 'all':
+                # 指定字段精准查询
+                search_body = {
+                    "query": {
+                        "term": {f"{field_filter}.keyword": query}
+                    }
+                }
+            else:
+                # 多字段精准查询
+                search_body = {
+                    "query": {
+                        "bool": {
+                            "should": [
+                                {"term": {"题干.keyword": query}},
+                                {"term": {"选项A.keyword": query}},
+                                {"term": {"选项B.keyword": query}},
+                                {"term": {"选项C.keyword": query}},
+                                {"term": {"选项D.keyword": query}},
+                                {"term": {"选项E.keyword": query}},
+                                {"term": {"选项F.keyword": query}},
+                                {"term": {"选项G.keyword": query}},
+                                {"term": {"选项H.keyword": query}},
+                                {"term": {"答案.keyword": query}},
+                                tag_substring_clause(query),  # 标签支持子串匹配
+                                {"term": {"解析.keyword": query}}
+                            ],
+                            "minimum_should_match": 1
+                        }
+                    }
+                }
+        else:
+            # 全文搜索 - 使用multi_match查询
+            if field_filter != 'all':
+                # 指定字段搜索
+                search_body = {
+                    "query": {
+                        "match": {
+                            field_filter: {
+                                "query": query,
+                                "operator": "or"
+                            }
+                        }
+                    },
+                    "highlight": {
+                        "pre_tags": ["<span class='highlight'>"],
+                        "post_tags": ["</span>"],
+                        "fields": {
+                            field_filter: {}
+                        }
+                    }
+                }
+            elif mode == 'combined':
+                search_body = combined_search_body(query)
+            else:
+                # 全字段搜索 - 优化版本，支持短语匹配和分词匹配
+                search_body = {
+                    "query": {
+                        "bool": {
+                            "should": [
+                                {
+                                    "multi_match": {
+                                        "query": query,
+                                        "fields": ["题干^3", "选项A^2", "选项B^2", "选项C^2", "选项D^2",
+                                                   "选项E^2", "选项F^2", "选项G^2", "选项H^2", "解析", "标签^2"],
+                                        "type": "phrase",
+                                        "boost": 3
+                                    }
+                                },
+                                {
+                                    "multi_match": {
+                                        "query": query,
+                                        "fields": ["题干^2", "选项A", "选项B", "选项C", "选项D",
+                                                   "选项E", "选项F", "选项G", "选项H", "解析", "标签"],
+                                        "operator": "or",
+                                        "boost": 1
+                                    }
+                                }
+                            ],
+                            "minimum_should_match": 1
+                        }
+                    },
+                    "highlight": {
+                        "pre_tags": ["<span class='highlight'>"],
+                        "post_tags": ["</span>"],
+                        "fields": {field: {} for field in HIGHLIGHT_FIELDS}
+                    }
+                }
+    else:
+        # 如果没有查询词，返回所有文档
+        search_body = {
+            "query": {
+                "match_all": {}
+            }
+        }
+
+    return search_body
+
+
+def format_hit(hit):
+    """把一条 ES 命中结果格式化为前端使用的结构"""
+    source = hit['_source']
+
+    doc = {
+        'id': hit['_id'],
+        '序号': source.get('序号', '') or '',
+        '题干': source.get('题干', '') or '',
+        '选项': {
+            'A': source.get('选项A', '') or '',
+            'B': source.get('选项B', '') or '',
+            'C': source.get('选项C', '') or '',
+            'D': source.get('选项D', '') or '',
+            'E': source.get('选项E', '') or '',
+            'F': source.get('选项F', '') or '',
+            'G': source.get('选项G', '') or '',
+            'H': source.get('选项H', '') or ''
+        },
+        '解析': source.get('解析', '') or '',
+        '分数': source.get('分数', '') or '',
+        '答案': source.get('答案', '') or '',
+        '标签': source.get('标签', '') or ''
+    }
+
+    # 添加高亮内容（如果有）
+    if 'highlight' in hit:
+        doc['highlight'] = hit['highlight']
+    return doc
+
+
+def encode_cursor(state):
+    """把分页状态编码为不透明的游标字符串"""
+    raw = json.dumps(state, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析游标字符串，格式不正确时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        state = json.loads(raw.decode('utf-8'))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError('无效的分页游标') from e
+    if not isinstance(state, dict) or not all(key in state for key in ('q', 't', 'f', 's', 'p', 'a')):
+        raise ValueError('无效的分页游标')
+    return state
+
+
+def parse_tag_filters(args):
+    """
+    解析标签过滤参数 ?tag=x&tag=y（/msearch 中为字符串或字符串列表），返回去重排序后的标签列表
+    多个标签之间为“或”：结果带有其中任意一个标签即可
+    """
+    values = args.getlist('tag') if hasattr(args, 'getlist') else args.get('tag', [])
+    if isinstance(values, str):
+        values = [values]
+    tags = sorted({value.strip() for value in values if isinstance(value, str) and value.strip()})
+    if len(tags) > MAX_TAG_FILTERS:
+        raise ValueError(f'一次最多按 {MAX_TAG_FILTERS} 个标签过滤')
+    return tags
+
+
+def parse_page_args(args):
+    """解析并限制 page / size 参数，避免超大分页拖垮 ES"""
+    try:
+        page = max(1, int(args.get('page', 1)))
+        size = min(MAX_PAGE_SIZE, max(1, int(args.get('size', 10))))
+    except (TypeError, ValueError):
+        raise ValueError('page 和 size 必须是整数')
+    return page, size
+
+
+def parse_search_args(args):
+    """
+    解析 /search 的请求参数，参数不合法时抛出 ValueError
+    传入 cursor 时分页状态全部来自游标，并按普通请求的规则校验；返回的 search_after 不为 None 表示使用游标翻页。
+    facets=1 时同时返回标签分面（游标翻页的后续页不返回）
+    """
+    cursor = args.get('cursor')
+    if cursor:
+        state = decode_cursor(cursor)
+        page, size = parse_page_args({'page': state['p'], 'size': state['s']})
+        mode = state.get('m', 'fields')
+        pit_id = state.get('pit')
+        # 本地库生成的游标没有排序值（也没有 point-in-time），按游标中的页码翻页
+        search_after = state['a']
+        if (mode not in SEARCH_MODES or not isinstance(state.get('g', []), list)
+                or not all(isinstance(state[key], str) for key in ('q', 't', 'f'))
+                or not (isinstance(search_after, list) and (pit_id is None or isinstance(pit_id, str))
+                        or search_after is None and pit_id is None)):
+            raise ValueError('无效的分页游标')
+        return {
+            'query': state['q'], 'search_type': state['t'], 'field_filter': state['f'],
+            'mode': mode, 'tags': parse_tag_filters({'tag': state.get('g', [])}), 'page': page, 'size': size,
+            'facets': False, 'search_after': search_after, 'pit_id': pit_id
+        }
+
+    page, size = parse_page_args(args)
+    mode = args.get('mode', DEFAULT_SEARCH_MODE)  # 全字段搜索方式: fields 或 combined
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"mode 只能是 {' / '.join(SEARCH_MODES)}")
+    return {
+        'query': args.get('q', '').strip(),
+        'search_type': args.get('type', 'fulltext'),  # 查询类型: fulltext(全文) 或 precise(精准)
+        'field_filter': args.get('field', 'all'),  # 字段过滤
+        'tags': parse_tag_filters(args),  # 标签过滤
+        'mode': mode, 'page': page, 'size': size,
+        'facets': str(args.get('facets', '')).lower() in ('1', 'true'),  # 是否返回标签分面
+        'search_after': None, 'pit_id': None
+    }
+
+
+def search_cache_key(params):
+    """普通翻页请求的缓存键"""
+    return (params['query'], params['search_type'], params['field_filter'], params['page'], params['size'],
+            params['mode'], params['tags'], params['facets'])
+
+
+def apply_tag_filter(search_body, tags):
+    """有标签过滤时把查询条件包进 bool，标签放在 filter 中（多个标签之间为“或”）"""
+    if tags:
+        search_body['query'] = {
+            "bool": {
+                "must": [search_body['query']],
+                "filter": [{"terms": {"标签.keyword": tags}}]
+            }
+        }
+
+
+def build_search_request(params):
+    """
+    构建完整的查询体：查询条件加固定排序（相关度、序号、unique_id），保证 search_after 翻页稳定
+    有标签过滤时放在 bool 的 filter 中：不参与评分，过滤结果可被 ES 缓存复用；
+    请求了 facets=1 时同时聚合当前结果的标签分布（聚合要遍历全部命中文档，默认不计算）
+    """
+    search_body = build_search_body(params['query'], params['search_type'], params['field_filter'],
+                                    params['mode'])
+    apply_tag_filter(search_body, params['tags'])
+    if params['facets']:
+        search_body['aggs'] = {"tag_facets": {"terms": {"field": "标签.keyword", "size": TAG_FACET_SIZE}}}
+    search_body['sort'] = SEARCH_SORT
+    return search_body
+
+
+def search_response(result, params, pit_id=None):
+    """
+    把 ES 返回结果整理为 /search 的响应结构
+    还有下一页时生成 next_cursor（记录最后一条结果的排序值）
+    """
+    hits = result['hits']['hits']
+    total = result['hits']['total']['value']
+    page, size = params['page'], params['size']
+
+    next_cursor = None
+    if len(hits) == size and page * size < total:
+        next_cursor = encode_cursor({
+            'q': params['query'], 't': params['search_type'], 'f': params['field_filter'],
+            'm': params['mode'], 'g': params['tags'], 's': size, 'p': page + 1, 'a': hits[-1]['sort'],
+            'pit': pit_id
+        })
+
+    # 没有请求 facets=1 时（游标翻页的后续页也不请求）没有聚合结果，tag_facets 为 None
+    facets = result.get('aggregations', {}).get('tag_facets')
+
+    return {
+        'results': [format_hit(hit) for hit in hits],
+        'total': total,
+        'page': page,
+        'total_pages': math.ceil(total / size),
+        'size': size,
+        'query': params['query'],
+        'search_type': params['search_type'],
+        'field_filter': params['field_filter'],
+        'mode': params['mode'],
+        'tags': params['tags'],
+        'tag_facets': [{'tag': bucket['key'], 'count': bucket['doc_count']} for bucket in facets['buckets']]
+        if facets is not None else None,
+        'next_cursor': next_cursor
+    }
+
+
+def parse_export_args(args):
+    """解析 /export 的参数：查询参数与 /search 相同（不分页、不支持游标），format 为 ndjson 或 csv"""
+    if args.get('cursor'):
+        raise ValueError('/export 不支持游标，请直接传入查询参数')
+    params = parse_search_args(args)
+    params['format'] = args.get('format', 'ndjson')
+    if params['format'] not in EXPORT_FORMATS:
+        raise ValueError(f"format 只能是 {' / '.join(EXPORT_FORMATS)}")
+    return params
+
+
+def build_export_request(params):
+    """/export 的查询体：查询条件和标签过滤与 /search 相同，不高亮、不聚合、不统计总数"""
+    search_body = build_search_body(params['query'], params['search_type'], params['field_filter'],
+                                    params['mode'])
+    search_body.pop('highlight', None)
+    apply_tag_filter(search_body, params['tags'])
+    search_body['sort'] = EXPORT_SORT
+    search_body['track_total_hits'] = False
+    search_body['_source'] = EXPORT_COLUMNS[1:]
+    return search_body
+
+
+def export_header(export_format):
+    """导出内容的开头：CSV 为表头（带 BOM，Excel 才能正确识别 UTF-8），NDJSON 没有表头"""
+    if export_format == 'csv':
+        return '\ufeff' + export_chunk([], 'csv', header=True)
+    return ''
+
+
+def export_chunk(hits, export_format, header=False):
+    """把一批命中结果序列化为导出内容的一段：NDJSON 每行为 /search 结果中的一条，CSV 每行为 EXPORT_COLUMNS"""
+    if export_format != 'csv':
+        lines = []
+        for hit in hits:
+            doc = format_hit(hit)
+            doc.pop('highlight', None)
+            lines.append(json.dumps(doc, ensure_ascii=False) + '\n')
+        return ''.join(lines)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    for hit in hits:
+        source = hit['_source']
+        row = [hit['_id']]
+        for column in EXPORT_COLUMNS[1:]:
+            value = source.get(column)
+            row.append('；'.join(map(str, value)) if isinstance(value, list) else ('' if value is None else value))
+        writer.writerow(row)
+    return buffer.getvalue()
+
+
+def parse_msearch_specs(data):
+    """
+    解析 /msearch 的请求体：{"queries": [...]} 或直接是查询列表，每个查询的参数与 /search 相同
+    请求体本身不合法时抛出 ValueError；单个查询不合法时，该位置返回 ValueError 而不是参数字典
+    """
+    specs = data.get('queries') if isinstance(data, dict) else data
+    if not isinstance(specs, list) or not specs:
+        raise ValueError('请求体必须是非空的查询列表，或 {"queries": [...]}')
+    if len(specs) > MAX_MSEARCH_QUERIES:
+        raise ValueError(f'一次最多 {MAX_MSEARCH_QUERIES} 个查询')
+
+    parsed = []
+    for spec in specs:
+        if not isinstance(spec, dict):
+            parsed.append(ValueError('每个查询必须是对象'))
+        elif spec.get('cursor'):
+            parsed.append(ValueError('/msearch 不支持游标翻页，请用 /search'))
+        else:
+            try:
+                parsed.append(parse_search_args({key: value if key == 'tag' and isinstance(value, list) else str(value)
+                                                 for key, value in spec.items()}))
+            except ValueError as e:
+                parsed.append(e)
+    return parsed
+
+
+def build_msearch_body(params_list):
+    """把多个查询组装成 _msearch 的请求体（每个查询一行 header、一行查询体）"""
+    searches = []
+    for params in params_list:
+        search_body = build_search_request(params)
+        search_body['from'] = (params['page'] - 1) * params['size']
+        search_body['size'] = params['size']
+        searches.append({'index': INDEX_NAME})
+        searches.append(search_body)
+    return searches
+
+
+def msearch_error(response):
+    """_msearch 中单个查询失败时的错误信息"""
+    error = response['error']
+    return error.get('reason', str(error)) if isinstance(error, dict) else str(error)
+
+
+def msearch_response_body(bodies):
+    """把每个查询序列化好的结果（含缓存中取出的）拼成 /msearch 的响应体，不必重新序列化"""
+    return '{"responses":[' + ','.join(bodies) + ']}'
+
+
+def is_admin(headers):
+    """请求是否带有正确的管理员令牌"""
+    token = headers.get('X-Admin-Token')
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def summarize_profile(profile):
+    """
+    汇总 ES profile 输出：查询树中的每个子句按（层级、类型、描述）跨分片累加耗时，按耗时从高到低排列；
+    fetch 阶段单独列出，其中 HighlightPhase 即高亮的耗时
+    """
+    clauses = {}
+    fetch = {}
+    for shard in profile.get('shards', []):
+        for shard_search in shard.get('searches', []):
+            stack = [(node, 0) for node in reversed(shard_search.get('query', []))]
+            while stack:
+                node, depth = stack.pop()
+                key = (depth, node['type'], node['description'])
+                entry = clauses.setdefault(key, {'depth': depth, 'type': node['type'],
+                                                 'description': node['description'], 'time_ms': 0.0})
+                entry['time_ms'] += node['time_in_nanos'] / 1e6
+                stack.extend((child, depth + 1) for child in reversed(node.get('children', [])))
+
+        fetch_node = shard.get('fetch')
+        if fetch_node:
+            for node in [fetch_node] + fetch_node.get('children', []):
+                fetch[node['type']] = fetch.get(node['type'], 0.0) + node['time_in_nanos'] / 1e6
+
+    for entry in clauses.values():
+        entry['time_ms'] = round(entry['time_ms'], 3)
+    return {
+        'clauses': sorted(clauses.values(), key=lambda entry: -entry['time_ms']),
+        'fetch': [{'type': name, 'time_ms': round(time_ms, 3)} for name, time_ms in fetch.items()]
+    }
+
+
+def tags_response(result):
+    """把标签聚合结果整理为 /tags 的响应结构"""
+    buckets = result['aggregations']['tags']['buckets']
+    return {
+        'tags': [bucket['key'] for bucket in buckets],
+        'tag_counts': [{'tag': bucket['key'], 'count': bucket['doc_count']} for bucket in buckets]
+    }
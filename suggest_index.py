@@ -0,0 +1,99 @@
+# suggest_index.py
+"""
+/suggest 使用的输入提示索引
+
+导入工具发布新数据时会把 题干、标签 中的短语及文档数写入 data/es_artifacts/suggest.json，
+这里把它读入内存：短语按小写排序后用二分查找定位前缀区间，区间内按文档数取前 k 个；
+一两个字的前缀命中的短语太多，加载时就预先算好它们的前 MAX_SUGGESTIONS 个结果。
+文件变化后自动重新加载，文件不存在时没有提示结果。
+"""
+import os
+import json
+import time
+import heapq
+import threading
+from bisect import bisect_left
+
+from search_cache import ARTIFACT_DIR
+
+SUGGEST_FILE = os.path.join(ARTIFACT_DIR, 'suggest.json')
+
+# 单次最多返回的提示数
+MAX_SUGGESTIONS = 20
+
+# 不超过这个长度的前缀在加载时预先计算结果
+PRECOMPUTED_PREFIX_LENGTH = 2
+
+# 检查 suggest.json 是否变化的最小间隔（秒）
+RELOAD_CHECK_INTERVAL = 1.0
+
+
+class SuggestData:
+    """一份加载好的提示数据"""
+
+    def __init__(self, entries):
+        entries = sorted(entries, key=lambda entry: entry['text'].lower())
+        self.keys = [entry['text'].lower() for entry in entries]
+        self.texts = [entry['text'] for entry in entries]
+        self.weights = [entry['weight'] for entry in entries]
+
+        # 按文档数从高到低依次放入各自的短前缀，每个前缀最多保留 MAX_SUGGESTIONS 个
+        self.top = {}
+        for position in sorted(range(len(entries)), key=lambda position: -self.weights[position]):
+            key = self.keys[position]
+            for length in range(1, min(PRECOMPUTED_PREFIX_LENGTH, len(key)) + 1):
+                bucket = self.top.setdefault(key[:length], [])
+                if len(bucket) < MAX_SUGGESTIONS:
+                    bucket.append(position)
+
+    def complete(self, prefix, k):
+        if len(prefix) <= PRECOMPUTED_PREFIX_LENGTH:
+            positions = self.top.get(prefix, [])[:k]
+        else:
+            start = bisect_left(self.keys, prefix)
+            end = bisect_left(self.keys, prefix + '\uffff', start)
+            positions = heapq.nlargest(k, range(start, end), key=self.weights.__getitem__)
+        return [{'text': self.texts[position], 'weight': self.weights[position]} for position in positions]
+
+
+class SuggestIndex:
+    """内存中的输入提示索引"""
+
+    def __init__(self, path=SUGGEST_FILE):
+        self.path = path
+        self.mtime = None
+        self.checked_at = 0.0
+        self.data = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        """返回当前的提示数据，文件不存在或无法读取时返回 None"""
+        now = time.monotonic()
+        if now - self.checked_at < RELOAD_CHECK_INTERVAL:
+            return self.data
+        with self.lock:
+            self.checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                self.data, self.mtime = None, None
+                return None
+            if mtime != self.mtime:
+                self.data = self.load()
+                self.mtime = mtime
+        return self.data
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return SuggestData(json.load(f).get('entries', []))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def complete(self, prefix, k=10):
+        """返回以 prefix 开头（不区分大小写）的短语，按文档数从高到低最多 k 个"""
+        prefix = prefix.strip().lower()
+        data = self.get()
+        if not prefix or data is None:
+            return []
+        return data.complete(prefix, min(k, MAX_SUGGESTIONS))
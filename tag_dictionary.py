@@ -0,0 +1,65 @@
+# tag_dictionary.py
+"""
+/tags 使用的标签词典
+
+导入工具发布新数据时会把全部标签及文档数写入 data/es_artifacts/tags.json，
+这里把它读入内存并预先生成响应体和 ETag；文件变化后自动重新加载。
+文件不存在时返回 None，由调用方退回到 ES 聚合查询。
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+
+from search_cache import ARTIFACT_DIR
+
+TAGS_FILE = os.path.join(ARTIFACT_DIR, 'tags.json')
+
+# 检查 tags.json 是否变化的最小间隔（秒）
+RELOAD_CHECK_INTERVAL = 1.0
+
+
+class TagDictionary:
+    """内存中的标签词典"""
+
+    def __init__(self, path=TAGS_FILE, dumps=json.dumps):
+        self.path = path
+        # 序列化函数，传入 Flask 的 app.json.dumps 以保持与 jsonify 相同的输出格式
+        self.dumps = dumps
+        self.mtime = None
+        self.checked_at = 0.0
+        self.entry = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        """返回 (响应体, ETag)，词典文件不存在或无法读取时返回 None"""
+        now = time.monotonic()
+        if now - self.checked_at < RELOAD_CHECK_INTERVAL:
+            return self.entry
+        with self.lock:
+            self.checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                self.entry, self.mtime = None, None
+                return None
+            if mtime != self.mtime:
+                self.entry = self.load()
+                self.mtime = mtime
+        return self.entry
+
+    def load(self):
+        """读取词典文件，生成与 /tags 聚合查询相同结构的响应体"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        tags = data.get('tags', [])
+        body = self.dumps({
+            'tags': [item['tag'] for item in tags],
+            'tag_counts': tags
+        })
+        etag = hashlib.md5(body.encode('utf-8')).hexdigest()
+        return body, etag
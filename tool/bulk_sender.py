@@ -0,0 +1,216 @@
+"""
+带重试、自适应并发和死信文件的 bulk 写入
+
+elasticsearch.helpers.bulk(raise_on_error=False) 只统计失败条数，ES 繁忙时被 429 拒绝或超时的文档
+就此丢失，直到下一次全量重建。BulkSender 改为：
+  - 按字节分块，每个分块由线程池发送
+  - 整个请求超时、连接失败、返回 429 / 5xx，或单条文档返回 429 / 5xx 时，只重试这些文档，
+    等待时间按指数退避（带随机抖动）
+  - 同时在途的 bulk 请求数按 AIMD 调整：请求顺利时逐步加一，出现拒绝或超时时减半
+  - 重试用尽或不可重试（如映射错误）的文档写入死信文件（NDJSON，每行一个 bulk 动作及错误信息），
+    可以用 tool_csv_to_es2.py --replay-dead-letter 重新写入
+"""
+import os
+import json
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from elastic_transport import TransportError
+from elasticsearch import ApiError
+
+logger = logging.getLogger(__name__)
+
+# 可以重试的单条文档状态码
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+def json_default(value):
+    # pandas 读出的 numpy 数值
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+def action_lines(action):
+    """把 bulk 动作序列化为 NDJSON 的两行（动作行 + 文档行）"""
+    header = json.dumps({"index": {"_index": action['_index'], "_id": action['_id']}}, ensure_ascii=False)
+    source = json.dumps(action['_source'], ensure_ascii=False, default=json_default)
+    return f"{header}\n{source}\n".encode('utf-8')
+
+
+class AdaptiveLimit:
+    """在途请求数上限，按 AIMD 调整：成功时每轮加一，拥塞时减半"""
+
+    def __init__(self, initial, maximum):
+        self.limit = float(initial)
+        self.maximum = maximum
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, congested):
+        with self.condition:
+            self.in_flight -= 1
+            if congested:
+                self.limit = max(1.0, self.limit / 2)
+            else:
+                # 每完成约 limit 个请求加一
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+class BulkSender:
+    """
+    可被多个线程共享：在途请求数由同一个 AdaptiveLimit 控制
+    send() 返回按 key 汇总的 {'success', 'retried', 'failed'}
+    """
+
+    def __init__(self, es, dead_letter_path, max_chunk_bytes=10 * 1024 * 1024, chunk_size=10000,
+                 max_concurrency=4, max_retries=5, initial_backoff=0.5, max_backoff=30.0):
+        self.es = es
+        self.dead_letter_path = dead_letter_path
+        self.max_chunk_bytes = max_chunk_bytes
+        self.chunk_size = chunk_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.limit = AdaptiveLimit(max_concurrency, max_concurrency)
+        self.dead_letter_lock = threading.Lock()
+        self.dead_letters = 0
+
+    def chunks(self, actions, key):
+        """按条数和字节数分块，每项为 (key, 动作, 序列化后的两行)"""
+        chunk, size = [], 0
+        for action in actions:
+            lines = action_lines(action)
+            if chunk and (len(chunk) >= self.chunk_size or size + len(lines) > self.max_chunk_bytes):
+                yield chunk
+                chunk, size = [], 0
+            chunk.append((key(action) if key else None, action, lines))
+            size += len(lines)
+        if chunk:
+            yield chunk
+
+    def send(self, actions, key=None):
+        """写入全部动作，返回 {key: {'success': n, 'retried': n, 'failed': n}}"""
+        results = {}
+        lock = threading.Lock()
+        # 已提交但尚未完成的分块数上限，保证内存中只有有限个分块
+        pending = threading.BoundedSemaphore(self.max_concurrency * 2)
+
+        def run(chunk):
+            try:
+                counts = self.send_chunk(chunk)
+                with lock:
+                    for item_key, item_counts in counts.items():
+                        total = results.setdefault(item_key, {'success': 0, 'retried': 0, 'failed': 0})
+                        for name, value in item_counts.items():
+                            total[name] += value
+            finally:
+                pending.release()
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = []
+            for chunk in self.chunks(actions, key):
+                pending.acquire()
+                futures.append(executor.submit(run, chunk))
+            for future in futures:
+                future.result()
+        return results
+
+    def send_chunk(self, chunk):
+        """发送一个分块，可重试的文档按指数退避重试，最终失败的写入死信文件"""
+        counts = {}
+
+        def count(item_key, name):
+            entry = counts.setdefault(item_key, {'success': 0, 'retried': 0, 'failed': 0})
+            entry[name] += 1
+
+        pending = chunk
+        failures = []
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                for item_key, _, _ in pending:
+                    count(item_key, 'retried')
+                time.sleep(self.backoff(attempt))
+
+            retry, errors = self.post(pending, count)
+            failures.extend(errors)
+            if not retry:
+                break
+            pending = [item for item, _ in retry]
+        else:
+            failures.extend((item, status, error) for item, (status, error) in retry)
+
+        for (item_key, _, _), _, _ in failures:
+            count(item_key, 'failed')
+        if failures:
+            self.write_dead_letters(failures)
+        return counts
+
+    def post(self, items, count):
+        """
+        发送一次 bulk 请求，返回 (需要重试的项, 不可重试的失败项)
+        需要重试的项为 [(项, (状态码, 错误))]，失败项为 [(项, 状态码, 错误)]
+        """
+        self.limit.acquire()
+        congested = True
+        try:
+            response = self.es.bulk(operations=b''.join(lines for _, _, lines in items))
+            retry, failed = [], []
+            for item, result in zip(items, response['items']):
+                result = next(iter(result.values()))
+                status = result.get('status', 500)
+                if status < 300:
+                    count(item[0], 'success')
+                elif status in RETRYABLE_STATUSES:
+                    retry.append((item, (status, result.get('error'))))
+                else:
+                    failed.append((item, status, result.get('error')))
+            # 单条文档被拒绝同样说明集群繁忙，降低并发
+            congested = bool(retry)
+            return retry, failed
+        except ApiError as e:
+            if e.meta.status in RETRYABLE_STATUSES:
+                return [(item, (e.meta.status, str(e))) for item in items], []
+            congested = False
+            return [], [(item, e.meta.status, str(e)) for item in items]
+        except TransportError as e:
+            # 连接失败、超时：整个请求重试
+            return [(item, (None, str(e))) for item in items], []
+        finally:
+            self.limit.release(congested)
+
+    def backoff(self, attempt):
+        """第 attempt 次重试前的等待时间：指数增长，带随机抖动"""
+        delay = min(self.max_backoff, self.initial_backoff * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def write_dead_letters(self, failures):
+        """把最终失败的文档追加写入死信文件"""
+        with self.dead_letter_lock:
+            os.makedirs(os.path.dirname(self.dead_letter_path), exist_ok=True)
+            with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+                for (item_key, action, _), status, error in failures:
+                    f.write(json.dumps({'file': item_key, 'status': status, 'error': error, 'action': action},
+                                       ensure_ascii=False, default=json_default) + '\n')
+            self.dead_letters += len(failures)
+        logger.warning(f"{len(failures)} 条文档写入失败，已记录到死信文件 {self.dead_letter_path}")
+
+
+def read_dead_letters(path):
+    """读取死信文件，返回 [(文件名, bulk 动作)]"""
+    entries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                entries.append((entry.get('file'), entry['action']))
+    return entries
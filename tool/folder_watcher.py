@@ -1,55 +1,180 @@
 import os
 import time
-import subprocess
+import threading
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
+
+from run_all_tool import PipelineOrchestrator
 
 # ================= 配置区域 =================
 # 监控的目录
 SOURCE_DIRECTORY = r"E:\BaiduSyncdisk\7-花牛大叔\6-卷王-题材细分\1-0-100"
 SOURCE_DIRECTORY2 = r"E:\BaiduSyncdisk\7-花牛大叔\6-卷王-题材细分"
 
-# 要触发执行的动作脚本
-ACTION_SCRIPT = r"run_all_tool.py"
+# 防抖时间 (秒)：最后一个事件之后安静这么久才触发，网盘同步时的一连串事件会合并成一次
+QUIET_PERIOD = 5
 
-# 检查间隔 (秒)，根据需要调整，太短会占用CPU，太长会有延迟
-CHECK_INTERVAL = 2
+# 最长等待时间 (秒)：事件持续不断时，距第一个事件超过这个时间也会触发一次
+MAX_DELAY = 60
 
 
 # ==========================================
 
-def get_folder_mod_time(folder_path):
-    """获取文件夹的最后修改时间"""
-    try:
-        # os.path.getmtime 也可以获取，但 os.stat 更通用
-        return os.stat(folder_path).st_mtime
-    except Exception as e:
-        print(f"无法访问目录 {folder_path}: {e}")
-        return 0
-
+def is_workbook(path):
+    """只关心 xlsx 文件，忽略 Excel 打开文件时产生的 ~$ 锁文件"""
+    filename = os.path.basename(path)
+    return filename.endswith('.xlsx') and not filename.startswith('~$')
+
+
+def merge_change(pending, path, kind):
+    """把一次变化合并进尚未处理的变化 {文件路径: added/modified/deleted}"""
+    previous = pending.get(path)
+    if previous == 'added' and kind == 'deleted':
+        # 新建后又删除（如网盘的临时文件），相当于没有变化
+        pending.pop(path)
+    elif previous == 'added' and kind == 'modified':
+        pass
+    elif previous == 'deleted' and kind == 'added':
+        pending[path] = 'modified'
+    else:
+        pending[path] = kind
+
+
+def group_changes(pending):
+    """{文件路径: 变化类型} 转为流程使用的 {"added": [...], "modified": [...], "deleted": [...]}"""
+    changes = {'added': [], 'modified': [], 'deleted': []}
+    for path, kind in sorted(pending.items()):
+        changes[kind].append(path)
+    return changes
+
+
+class ChangeCollector(FileSystemEventHandler):
+    """
+    收集文件系统事件，合并为 {文件路径: added/modified/deleted}，
+    安静 QUIET_PERIOD 秒后把整批变化交给 on_flush 回调
+    """
+
+    def __init__(self, on_flush):
+        super().__init__()
+        self.on_flush = on_flush
+        self.pending = {}
+        self.first_event_time = None
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def record(self, path, kind):
+        """记录一次变化，并与之前尚未处理的变化合并"""
+        if not is_workbook(path):
+            return
+        path = os.path.abspath(path)
+        with self.lock:
+            merge_change(self.pending, path, kind)
+
+            now = time.time()
+            if self.first_event_time is None:
+                self.first_event_time = now
+            self.schedule(now)
+
+    def schedule(self, now):
+        """重新计时：安静 QUIET_PERIOD 秒后触发，但不晚于第一个事件之后 MAX_DELAY 秒"""
+        if self.timer is not None:
+            self.timer.cancel()
+        delay = min(QUIET_PERIOD, max(0, self.first_event_time + MAX_DELAY - now))
+        self.timer = threading.Timer(delay, self.flush)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def flush(self):
+        """取出当前积累的全部变化，交给回调处理"""
+        with self.lock:
+            pending = self.pending
+            first_event_time = self.first_event_time
+            self.pending = {}
+            self.first_event_time = None
+            self.timer = None
+        if not pending:
+            return
+        self.on_flush(group_changes(pending), first_event_time)
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.record(event.src_path, 'added')
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.record(event.src_path, 'modified')
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self.record(event.src_path, 'deleted')
+
+    def on_moved(self, event):
+        # 网盘和 Excel 保存时常先写临时文件再改名，改名的目标才是真正的工作簿
+        if not event.is_directory:
+            self.record(event.src_path, 'deleted')
+            self.record(event.dest_path, 'added')
+
+
+class PipelineRunner:
+    """
+    在监控进程内串行执行数据处理流程：同一时间只跑一次，执行期间到达的变化会合并到下一批
+    流程编排对象常驻内存，ES 连接和转换进程池在多次运行之间复用
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.first_event_time = None
+        self.running = False
+        self.orchestrator = PipelineOrchestrator()
+
+    def __call__(self, changes, first_event_time):
+        """
+        提交一批变化：已有流程在执行时只合并到待处理的变化中，由正在执行的线程在本次结束后一并处理；
+        否则由当前线程执行，直到没有待处理的变化为止
+        """
+        with self.lock:
+            for kind, paths in changes.items():
+                for path in paths:
+                    merge_change(self.pending, path, kind)
+            if self.first_event_time is None or first_event_time < self.first_event_time:
+                self.first_event_time = first_event_time
+            if self.running:
+                return
+            self.running = True
 
-def run_action_script():
-    """执行指定的 Python 脚本"""
+        while True:
+            with self.lock:
+                pending = self.pending
+                first_event_time = self.first_event_time
+                self.pending = {}
+                self.first_event_time = None
+                if not pending:
+                    self.running = False
+                    return
+            run_action(self.orchestrator, group_changes(pending), first_event_time)
+
+    def close(self):
+        self.orchestrator.close()
+
+
+def run_action(orchestrator, changes, first_event_time):
+    """只处理本批变化的文件"""
     try:
-        print(f"检测到文件夹修改，正在执行: {ACTION_SCRIPT} ...")
-
-        # 使用 subprocess.Popen 启动脚本，不阻塞主监控程序
-        # shell=True 允许在 shell 中执行，确保路径解析正确
-        process = subprocess.Popen(
-            ['python', ACTION_SCRIPT],
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-
-        # 等待脚本执行完成（可选，如果不希望等待，可以去掉 communicate）
-        stdout, stderr = process.communicate()
-
-        if process.returncode == 0:
+        summary = '，'.join(f"{kind} {len(paths)} 个" for kind, paths in changes.items() if paths)
+        print(f"[{time.ctime()}] 检测到文件变化（{summary}），开始处理...")
+        for kind, paths in changes.items():
+            for path in paths:
+                print(f"  {kind}: {os.path.basename(path)}")
+
+        report = orchestrator.run(changes=changes, trigger_time=first_event_time)
+        if report['success']:
             print("动作执行完成。")
         else:
-            print(f"动作执行出错: {stderr.decode().strip()}")
+            print("动作执行出错，详见上方日志。")
 
     except Exception as e:
-        print(f"执行脚本时发生错误: {e}")
+        print(f"执行数据处理流程时发生错误: {e}")
 
 
 def main():
@@ -57,32 +182,28 @@ def main():
     print(f"监控目录1: {SOURCE_DIRECTORY}")
     print(f"监控目录2: {SOURCE_DIRECTORY2}")
 
-    # 初始化时记录当前时间
-    last_time_1 = get_folder_mod_time(SOURCE_DIRECTORY)
-    last_time_2 = get_folder_mod_time(SOURCE_DIRECTORY2)
+    runner = PipelineRunner()
+    collector = ChangeCollector(runner)
+    observer = Observer()
+    for folder in (SOURCE_DIRECTORY, SOURCE_DIRECTORY2):
+        if os.path.exists(folder):
+            # 目录2 是目录1 的上级目录，不递归监控，避免同一个文件产生两份事件
+            observer.schedule(collector, folder, recursive=False)
+        else:
+            print(f"警告: 目录不存在，跳过监控 -> {folder}")
+    observer.start()
 
     try:
-        while True:
-            time.sleep(CHECK_INTERVAL)
-
-            current_time_1 = get_folder_mod_time(SOURCE_DIRECTORY)
-            current_time_2 = get_folder_mod_time(SOURCE_DIRECTORY2)
-
-            # 检查目录1是否有变化
-            if current_time_1 != last_time_1:
-                print(f"[{time.ctime()}] 目录1发生变化，触发动作。")
-                run_action_script()
-                last_time_1 = current_time_1  # 更新时间戳，防止重复触发
-
-            # 检查目录2是否有变化
-            if current_time_2 != last_time_2:
-                print(f"[{time.ctime()}] 目录2发生变化，触发动作。")
-                run_action_script()
-                last_time_2 = current_time_2  # 更新时间戳，防止重复触发
-
+        # 由系统通知文件变化（Windows 为 ReadDirectoryChangesW，Linux 为 inotify），空闲时不占用 CPU
+        while observer.is_alive():
+            observer.join(1)
     except KeyboardInterrupt:
         print("\n🛑 监控程序已停止。")
+    finally:
+        observer.stop()
+        observer.join()
+        runner.close()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,314 @@
+"""
+本地搜索库：SQLite FTS5 全文索引，作为 Elasticsearch 不可用时的备用查询后端
+
+导入工具把写入 ES 的同一批文档同时写入 data/es_artifacts/local_search.sqlite：
+  - 全量 / 流式导入：在临时文件中新建，ES 新版本发布时再原子替换
+  - 增量导入：直接在现有文件中删除旧文件的文档、写入新文档
+网站通过 LocalSearchIndex 读取，查询结果整理成与 ES 返回值相同的结构（hits / aggregations），
+上层的结果格式化代码不需要区分数据来自哪里。
+
+分词方式与 ES 默认的 standard 分词器一致：每个汉字单独成词，英文和数字按连续字母数字成词，
+全文搜索的短语匹配、任意词匹配因此与 ES 的行为接近；精准查询按整个字段值比较，标签按子串匹配。
+跨文件去重后的文档有多个标签（列表），每个标签另外记入 doc_tags 表，按标签精准查询和统计时与 ES 的
+标签.keyword 一样逐个标签计算。
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOCAL_SEARCH_FILE = os.path.join(PROJECT_DIR, 'data', 'es_artifacts', 'local_search.sqlite')
+
+# 参与全文搜索的字段及其在 SQLite 中的列名，以及短语匹配时的权重（与 ES 查询中的 boost 一致）
+TEXT_FIELDS = [
+    ('题干', 'title', 3), ('选项A', 'a', 2), ('选项B', 'b', 2), ('选项C', 'c', 2), ('选项D', 'd', 2),
+    ('选项E', 'e', 2), ('选项F', 'f', 2), ('选项G', 'g', 2), ('选项H', 'h', 2), ('解析', 'analysis', 1),
+    ('标签', 'tags', 2),
+]
+TEXT_COLUMNS = {field: column for field, column, _ in TEXT_FIELDS}
+# 精准查询可用的字段（全文字段加上 答案）
+EXACT_COLUMNS = dict(TEXT_COLUMNS, 答案='answer')
+BM25_WEIGHTS = ', '.join(str(weight) for _, _, weight in TEXT_FIELDS)
+
+# 同时命中整个短语的文档，得分乘以这个系数（对应 ES 查询中短语子句的 boost 3，加上分词子句本身）
+PHRASE_BOOST = 4
+
+# 库结构版本，结构变化后旧文件不再做增量修改，由导入工具重建
+SCHEMA_VERSION = '2'
+
+# 多个取值的字段（如合并后的标签）写入文本列时的分隔符
+VALUE_SEPARATOR = '\n'
+
+# 检查数据库文件是否被替换的最小间隔（秒）
+RELOAD_CHECK_INTERVAL = 1.0
+
+CJK_PATTERN = re.compile(r'([\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff])')
+TOKEN_PATTERN = re.compile(r'[^\W_]+')
+
+SCHEMA = f"""
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE docs (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    file_hash TEXT,
+    seq INTEGER,
+    {', '.join(f'{column} TEXT' for _, column, _ in TEXT_FIELDS)},
+    answer TEXT,
+    source TEXT NOT NULL
+);
+CREATE INDEX docs_file_hash ON docs (file_hash);
+CREATE TABLE doc_tags (rowid INTEGER NOT NULL, tag TEXT NOT NULL);
+CREATE INDEX doc_tags_tag ON doc_tags (tag, rowid);
+CREATE INDEX doc_tags_rowid ON doc_tags (rowid);
+CREATE VIRTUAL TABLE docs_fts USING fts5({', '.join(column for _, column, _ in TEXT_FIELDS)},
+                                         tokenize = 'unicode61');
+"""
+
+
+def analyze(text):
+    """在每个汉字两侧加空格，让 FTS5 的 unicode61 分词器像 ES standard 分词器一样逐字成词"""
+    return CJK_PATTERN.sub(r' \1 ', text) if isinstance(text, str) else ''
+
+
+def query_tokens(query):
+    """查询词分词，结果与索引时的分词方式一致"""
+    return TOKEN_PATTERN.findall(analyze(query).lower())
+
+
+def json_default(value):
+    # pandas 读出的 numpy 数值
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+def text_value(value):
+    if isinstance(value, list):
+        return VALUE_SEPARATOR.join(str(item) for item in value)
+    return value if isinstance(value, str) else (None if value is None else str(value))
+
+
+def tag_values(value):
+    """文档的标签列表：单个标签为字符串，合并后的标签为列表"""
+    values = value if isinstance(value, list) else [value]
+    return [text_value(item) for item in values if item is not None and item != '']
+
+
+class LocalSearchWriter:
+    """写入本地搜索库；create 新建（发布时替换正式文件），open 在现有文件上增量修改"""
+
+    def __init__(self, path, target_path, index):
+        self.path = path
+        self.target_path = target_path
+        self.index = index
+        # 全量导入时由各文件的工作线程加锁写入：连接会在创建它的线程之外使用，但同一时间只有一个线程写入
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA synchronous = OFF' if path != target_path else 'PRAGMA synchronous = NORMAL')
+
+    @classmethod
+    def create(cls, index, path=LOCAL_SEARCH_FILE):
+        """在临时文件中新建本地搜索库，publish 后替换 path"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        building_path = path + '.building'
+        if os.path.exists(building_path):
+            os.remove(building_path)
+        writer = cls(building_path, path, index)
+        writer.conn.executescript(SCHEMA)
+        writer.conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)",
+                                [('index', index), ('schema', SCHEMA_VERSION)])
+        return writer
+
+    @classmethod
+    def open(cls, index, path=LOCAL_SEARCH_FILE):
+        """打开现有的本地搜索库做增量修改；文件不存在、与 index 不对应或结构版本不同时返回 None"""
+        if not os.path.exists(path):
+            return None
+        writer = cls(path, path, index)
+        try:
+            meta = dict(writer.conn.execute("SELECT key, value FROM meta").fetchall())
+        except sqlite3.Error:
+            meta = {}
+        if meta.get('index') != index or meta.get('schema') != SCHEMA_VERSION:
+            writer.conn.close()
+            return None
+        return writer
+
+    def add_docs(self, docs):
+        """写入文档；_id 相同的文档内容也相同（_id 由文件 hash 和整行内容生成），已存在时跳过"""
+        cursor = self.conn.cursor()
+        for doc in docs:
+            values = [text_value(doc.get(field)) for field, _, _ in TEXT_FIELDS]
+            seq = doc.get('序号')
+            cursor.execute(
+                f"INSERT OR IGNORE INTO docs (id, file_hash, seq, {', '.join(c for _, c, _ in TEXT_FIELDS)}, "
+                f"answer, source) VALUES (?, ?, ?, {', '.join('?' * len(TEXT_FIELDS))}, ?, ?)",
+                [doc['unique_id'], text_value(doc.get('file_hash')), seq if isinstance(seq, int) else None, *values,
+                 text_value(doc.get('答案')), json.dumps(doc, ensure_ascii=False, default=json_default)])
+            if cursor.rowcount:
+                cursor.execute(
+                    f"INSERT INTO docs_fts (rowid, {', '.join(c for _, c, _ in TEXT_FIELDS)}) "
+                    f"VALUES (?, {', '.join('?' * len(TEXT_FIELDS))})",
+                    [cursor.lastrowid, *(analyze(value) for value in values)])
+                cursor.executemany("INSERT INTO doc_tags (rowid, tag) VALUES (?, ?)",
+                                   [(cursor.lastrowid, tag) for tag in tag_values(doc.get('标签'))])
+
+    def delete_file_hash(self, file_hash):
+        """删除某个文件版本的全部文档，返回删除的条数"""
+        self.conn.execute("DELETE FROM doc_tags WHERE rowid IN (SELECT rowid FROM docs WHERE file_hash = ?)",
+                          (file_hash,))
+        self.conn.execute("DELETE FROM docs_fts WHERE rowid IN (SELECT rowid FROM docs WHERE file_hash = ?)",
+                          (file_hash,))
+        return self.conn.execute("DELETE FROM docs WHERE file_hash = ?", (file_hash,)).rowcount
+
+    def publish(self):
+        """提交写入；新建的库替换正式文件"""
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built_at', ?)",
+                          (time.strftime('%Y-%m-%d %H:%M:%S'),))
+        self.conn.commit()
+        self.conn.close()
+        if self.path != self.target_path:
+            os.replace(self.path, self.target_path)
+
+    def discard(self):
+        """放弃本次写入"""
+        self.conn.rollback()
+        self.conn.close()
+        if self.path != self.target_path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class LocalSearchIndex:
+    """只读访问本地搜索库，每个线程一个连接；数据库文件被替换后自动重新打开"""
+
+    def __init__(self, path=LOCAL_SEARCH_FILE):
+        self.path = path
+        self.local = threading.local()
+
+    def available(self):
+        return os.path.exists(self.path)
+
+    def connection(self):
+        now = time.monotonic()
+        state = self.local.__dict__
+        if state.get('conn') is not None and now - state['checked_at'] < RELOAD_CHECK_INTERVAL:
+            return state['conn']
+        stat = os.stat(self.path)
+        identity = (stat.st_ino, stat.st_mtime_ns)
+        state['checked_at'] = now
+        if state.get('conn') is None or state['identity'] != identity:
+            if state.get('conn') is not None:
+                state['conn'].close()
+            state['conn'] = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+            state['identity'] = identity
+        return state['conn']
+
+    def search(self, query, search_type='fulltext', field_filter='all', page=1, size=10, tags=(), facet_size=0):
+        """
+        按 /search 的查询方式检索，返回与 ES search 相同结构的结果
+        tags 不为空时只保留带有其中任意一个标签的文档（对应 ES 查询中 filter 的 terms 条件）；
+        facet_size 大于 0 时在 aggregations.tag_facets 中返回命中文档的标签分布
+        """
+        start = time.perf_counter()
+        conn = self.connection()
+        offset = (page - 1) * size
+        order = "ORDER BY d.seq IS NULL, d.seq, d.id"
+        tokens = []
+        # 标签过滤附加在每种查询的条件之后；matched 为命中文档的 rowid 查询，用于统计总数和标签分布
+        tag_where = f" AND d.rowid IN (SELECT rowid FROM doc_tags WHERE tag IN ({', '.join('?' * len(tags))}))" \
+            if tags else ''
+        tag_args = list(tags)
+
+        if not query:
+            matched = (f"SELECT d.rowid FROM docs d WHERE 1{tag_where}", tag_args)
+            rows = conn.execute(f"SELECT d.id, 1.0, d.source FROM docs d WHERE 1{tag_where} {order} LIMIT ? OFFSET ?",
+                                tag_args + [size, offset]).fetchall()
+        elif search_type == 'precise':
+            if field_filter != 'all':
+                column = EXACT_COLUMNS.get(field_filter)
+                if column == 'tags':
+                    # 与 标签.keyword 的 term 查询一样，命中任意一个标签即可
+                    where, args = "d.rowid IN (SELECT rowid FROM doc_tags WHERE tag = ?)", [query]
+                else:
+                    where, args = (f"d.{column} = ?", [query]) if column else ("0", [])
+            else:
+                exact = [column for column in EXACT_COLUMNS.values() if column != 'tags']
+                where = ' OR '.join(f"d.{column} = ?" for column in exact) + " OR instr(d.tags, ?) > 0"
+                args = [query] * (len(exact) + 1)
+            matched = (f"SELECT d.rowid FROM docs d WHERE ({where}){tag_where}", args + tag_args)
+            rows = conn.execute(f"SELECT d.id, 1.0, d.source FROM docs d WHERE ({where}){tag_where} {order} "
+                                f"LIMIT ? OFFSET ?", args + tag_args + [size, offset]).fetchall()
+        else:
+            tokens = query_tokens(query)
+            terms = ' OR '.join(f'"{token}"' for token in tokens)
+            if field_filter != 'all':
+                column = TEXT_COLUMNS.get(field_filter)
+                match = f"{column} : ({terms})" if column and terms else None
+                score = "-bm25(docs_fts)"
+                args = [match]
+            else:
+                match = terms or None
+                score = (f"-bm25(docs_fts, {BM25_WEIGHTS}) * (CASE WHEN docs_fts.rowid IN "
+                         f"(SELECT rowid FROM docs_fts WHERE docs_fts MATCH ?) THEN {PHRASE_BOOST} ELSE 1 END)")
+                args = ['"' + ' '.join(tokens) + '"', match]
+            if match is None:
+                matched, rows = None, []
+            else:
+                source = f"FROM docs_fts JOIN docs d ON d.rowid = docs_fts.rowid WHERE docs_fts MATCH ?{tag_where}"
+                matched = (f"SELECT d.rowid {source}", [match] + tag_args)
+                rows = conn.execute(
+                    f"SELECT d.id, {score} AS score, d.source {source} "
+                    f"ORDER BY score DESC, d.seq IS NULL, d.seq, d.id LIMIT ? OFFSET ?",
+                    args + tag_args + [size, offset]).fetchall()
+
+        total = conn.execute(f"SELECT count(*) FROM ({matched[0]})", matched[1]).fetchone()[0] if matched else 0
+        buckets = []
+        if facet_size and matched:
+            buckets = conn.execute(
+                f"SELECT tag, count(*) AS doc_count FROM doc_tags WHERE rowid IN ({matched[0]}) "
+                f"GROUP BY tag ORDER BY doc_count DESC, tag LIMIT ?", matched[1] + [facet_size]).fetchall()
+        highlight_fields = [field_filter] if field_filter != 'all' else list(TEXT_COLUMNS)
+        hits = []
+        for doc_id, score, source in rows:
+            hit = {'_id': doc_id, '_score': score, '_source': json.loads(source),
+                   # 没有 ES 的排序值：下一页游标退化为按页码翻页，ES 恢复后也能继续使用
+                   'sort': None}
+            highlight = self.highlight(hit['_source'], tokens, highlight_fields)
+            if highlight:
+                hit['highlight'] = highlight
+            hits.append(hit)
+        result = {'hits': {'total': {'value': total, 'relation': 'eq'}, 'hits': hits}}
+        if facet_size:
+            result['aggregations'] = {'tag_facets': {'buckets': [{'key': key, 'doc_count': count}
+                                                                 for key, count in buckets]}}
+        result['took'] = int((time.perf_counter() - start) * 1000)
+        return result
+
+    def highlight(self, source, tokens, fields):
+        """与 ES 高亮相同的标签：逐个命中的词加 <span class='highlight'>"""
+        if not tokens:
+            return None
+        pattern = re.compile('|'.join(re.escape(token) for token in sorted(set(tokens), key=len, reverse=True)),
+                             re.IGNORECASE)
+        highlight = {}
+        for field in fields:
+            value = source.get(field)
+            # 与 ES 相同：多个取值的字段只返回命中的那些值
+            fragments = [pattern.sub(lambda m: f"<span class='highlight'>{m.group(0)}</span>", text)
+                         for text in (value if isinstance(value, list) else [value])
+                         if isinstance(text, str) and pattern.search(text)]
+            if fragments:
+                highlight[field] = fragments
+        return highlight
+
+    def get(self, doc_id):
+        """按 _id 取文档，不存在时返回 None"""
+        row = self.connection().execute("SELECT source FROM docs WHERE id = ?", (doc_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def tags(self, size=1000):
+        """与 ES 标签聚合相同结构的结果：按文档数从多到少，相同时按标签排序"""
+        rows = self.connection().execute(
+            "SELECT tag, count(*) AS doc_count FROM doc_tags "
+            "GROUP BY tag ORDER BY doc_count DESC, tag LIMIT ?", (size,)).fetchall()
+        return {'aggregations': {'tags': {'buckets': [{'key': key, 'doc_count': count} for key, count in rows]}}}
@@ -1,99 +1,171 @@
 # run_tools.py
-import subprocess
+import argparse
+import json
 import sys
 import os
 import time  # 引入 time 模块
+from concurrent.futures import ProcessPoolExecutor
 
+from tool_xlsx_to_csv2 import (SOURCE_DIRECTORIES, TARGET_DIRECTORY, apply_xlsx_changes,
+                               convert_xlsx_to_csv_parallel, load_changes)
+from tool_csv_to_es2 import ARTIFACT_DIR, CSVToElasticsearchImporter
 
-def run_script(script_path):
-    """
-    运行指定的Python脚本并记录耗时
-    """
-    try:
-        print(f"正在运行：{script_path}")
-        start_time = time.time()  # 记录开始时间
-
-        result = subprocess.run([sys.executable, script_path],
-                                capture_output=True,
-                                text=True,
-                                encoding='gbk',  # 修复中文输出乱码问题
-                                errors='replace')  # 增加容错
-
-        end_time = time.time()  # 记录结束时间
-        duration = end_time - start_time
-
-        if result.returncode == 0:
-            print(f"✓ {os.path.basename(script_path)} 运行成功")
-            print(f"⏱️  耗时：{duration:.2f} 秒")
-            if result.stdout:
-                # 可选：如果 stdout 内容太多，可以选择不打印或只打印最后几行
-                # print(f"输出:\n{result.stdout}")
-                pass
-        else:
-            print(f"✗ {os.path.basename(script_path)} 运行失败")
-            print(f"⏱️  耗时：{duration:.2f} 秒")
-            if result.stderr:
-                print(f"错误:\n{result.stderr}")
-        return result.returncode == 0
-
-    except Exception as e:
-        print(f"运行 {script_path} 时发生异常：{e}")
-        return False
+# 每次运行的结构化记录（每行一个 JSON），用于跟踪各阶段耗时和“文件变化 -> 可搜索”的延迟
+RUN_LOG_PATH = os.path.join(ARTIFACT_DIR, 'pipeline_runs.jsonl')
 
 
-def main():
+class PipelineOrchestrator:
     """
-    主函数：依次运行 xlsx 转 csv 工具和 csv 导入 ES 工具
+    常驻进程内的数据处理流程：直接以函数方式调用 xlsx 转 csv 和 csv 导入 ES，
+    ES 客户端和转换用的进程池在多次运行之间复用，不再每次启动子进程、重新导入 pandas/openpyxl
     """
-    # 定义脚本路径
-    xlsx_to_csv_script = r"D:\03-code\pycharm\stock\flaskJuanwang_es\tool\tool_xlsx_to_csv2.py"
-    csv_to_es_script = r"D:\03-code\pycharm\stock\flaskJuanwang_es\tool\tool_csv_to_es2.py"
-
-    # 检查脚本文件是否存在
-    if not os.path.exists(xlsx_to_csv_script):
-        print(f"错误：找不到文件 {xlsx_to_csv_script}")
-        return False
 
-    if not os.path.exists(csv_to_es_script):
-        print(f"错误：找不到文件 {csv_to_es_script}")
-        return False
+    def __init__(self, source_dirs=SOURCE_DIRECTORIES, target_dir=TARGET_DIRECTORY):
+        self.source_dirs = source_dirs
+        self.target_dir = target_dir
+        self.importer = CSVToElasticsearchImporter()
+        self.importer.csv_directory = target_dir
+        self.executor = None
+        # 当前阶段的逐文件明细（转换阶段填写）
+        self.stage_files = None
+
+    def get_executor(self):
+        """转换用的进程池，第一次使用时创建，之后一直复用"""
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor()
+        return self.executor
+
+    def close(self):
+        """释放进程池和 ES 连接"""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        self.importer.es.close()
+
+    def run(self, changes=None, stream=False, full=False, trigger_time=None):
+        """
+        执行一次完整流程，返回本次运行的结构化报告
+        changes：监控程序给出的变化清单，传入时只处理其中的文件
+        trigger_time：触发本次运行的第一个文件变化的时间戳，用于计算“变化 -> 可搜索”的延迟
+        """
+        start_time = time.time()
+        report = {
+            'started_at': start_time,
+            'trigger_time': trigger_time,
+            'mode': 'stream' if stream else ('full' if full else 'incremental'),
+            'changes': {kind: len(paths) for kind, paths in changes.items()} if changes else None,
+            'stages': {},
+            'success': False
+        }
+
+        try:
+            if stream:
+                report['success'] = self.run_stage(report, 'import', self.importer.import_xlsx_streaming,
+                                                   self.source_dirs)
+            else:
+                csv_names = self.run_stage(report, 'convert', self.convert, changes)
+                if csv_names is not False:
+                    if full:
+                        report['success'] = self.run_stage(report, 'import', self.importer.import_all_csv)
+                    else:
+                        report['success'] = self.run_stage(report, 'import', self.importer.import_incremental,
+                                                           csv_names)
+        finally:
+            end_time = time.time()
+            report['seconds'] = end_time - start_time
+            if trigger_time is not None:
+                report['trigger_to_searchable_seconds'] = end_time - trigger_time
+            self.save_report(report)
+            self.print_report(report)
+        return report
+
+    def convert(self, changes):
+        """转换阶段：返回受影响的 CSV 文件名（全量转换时为 None），以及每个文件的转换结果"""
+        if changes:
+            csv_names, results = apply_xlsx_changes(changes, self.source_dirs, self.target_dir,
+                                                    self.get_executor())
+        else:
+            csv_names = None
+            results = convert_xlsx_to_csv_parallel(self.source_dirs, self.target_dir, self.get_executor())
+        self.stage_files = results
+        return csv_names
+
+    def run_stage(self, report, name, func, *args):
+        """执行一个阶段并记录耗时、行数和每个文件的明细"""
+        self.stage_files = None
+        self.importer.last_run = None
+        stage_start = time.perf_counter()
+        try:
+            result = func(*args)
+        except Exception as e:
+            print(f"✗ 阶段 {name} 发生异常：{e}")
+            result = False
+            report['stages'][name] = {'error': str(e)}
+        stage = report['stages'].setdefault(name, {})
+        stage['seconds'] = time.perf_counter() - stage_start
+
+        if name == 'convert' and self.stage_files is not None:
+            stage['files'] = self.stage_files
+            stage['rows'] = sum(item['rows'] for item in self.stage_files)
+            stage['failed_files'] = sum(1 for item in self.stage_files if not item['ok'])
+        elif name == 'import' and self.importer.last_run:
+            stage.update(self.importer.last_run)
+            stage['rows'] = sum(item['rows'] for item in self.importer.last_run['file_stats'])
+        return result
+
+    def save_report(self, report):
+        """追加写入运行记录"""
+        try:
+            os.makedirs(os.path.dirname(RUN_LOG_PATH), exist_ok=True)
+            with open(RUN_LOG_PATH, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(report, ensure_ascii=False) + '\n')
+        except OSError as e:
+            print(f"写入运行记录失败：{e}")
+
+    def print_report(self, report):
+        """在控制台输出本次运行的摘要"""
+        print("=" * 50)
+        for name, stage in report['stages'].items():
+            rows = stage.get('rows')
+            rows_text = f"，{rows} 行" if rows is not None else ''
+            print(f"⏱️  阶段 {name}：{stage['seconds']:.2f} 秒{rows_text}")
+        status = "✓ 所有步骤已完成" if report['success'] else "✗ 流程执行失败"
+        print(status)
+        print(f"🚀 总耗时：{report['seconds']:.2f} 秒 ({report['seconds'] / 60:.2f} 分钟)")
+        if 'trigger_to_searchable_seconds' in report:
+            print(f"📡 从文件变化到可搜索：{report['trigger_to_searchable_seconds']:.2f} 秒")
+
+
+def main(stream=False, changes_path=None, full=False, dedup=False):
+    """
+    主函数：依次运行 xlsx 转 csv 和 csv 导入 ES
+    stream=True 时跳过 CSV 中转，直接从 xlsx 流式导入 ES
+    changes_path 为变化清单文件，传入时两个步骤都只处理清单中的文件
+    dedup=True 时全量重建跨文件合并重复的题目
+    """
+    changes = load_changes(changes_path) if changes_path else None
 
-    total_start_time = time.time()  # 记录总程序开始时间
     print("开始运行数据处理工具...")
     print("=" * 50)
 
-    # 第一步：运行 xlsx 转 csv 工具
-    print("步骤 1: 转换 xlsx 文件为 csv 文件")
-    step1_success = run_script(xlsx_to_csv_script)
-
-    if not step1_success:
-        print("xlsx 转 csv 步骤失败，终止执行")
-        return False
-
-    print("\n" + "=" * 50)
-
-    # 第二步：运行 csv 导入 ES 工具
-    print("步骤 2: 将 csv 数据导入 Elasticsearch")
-    step2_success = run_script(csv_to_es_script)
-
-    if not step2_success:
-        print("csv 导入 ES 步骤失败")
-        return False
-
-    print("\n" + "=" * 50)
-
-    total_end_time = time.time()  # 记录总程序结束时间
-    total_duration = total_end_time - total_start_time
-
-    print("✓ 所有步骤已完成")
-    print(f"🚀 总耗时：{total_duration:.2f} 秒 ({total_duration / 60:.2f} 分钟)")
-
-    return True
+    orchestrator = PipelineOrchestrator()
+    orchestrator.importer.dedup = dedup
+    try:
+        report = orchestrator.run(changes=changes, stream=stream, full=full)
+    finally:
+        orchestrator.close()
+    return report['success']
 
 
 if __name__ == "__main__":
     try:
-        success = main()
+        parser = argparse.ArgumentParser(description='xlsx 转 csv 并导入 Elasticsearch')
+        parser.add_argument('--stream', action='store_true', help='跳过 CSV，直接从 xlsx 流式全量导入')
+        parser.add_argument('--full', action='store_true', help='全量重建新版本索引')
+        parser.add_argument('--changes', help='变化清单（JSON），只处理其中的文件')
+        parser.add_argument('--dedup', action='store_true', help='全量重建时跨文件合并重复的题目')
+        args = parser.parse_args()
+        success = main(stream=args.stream, changes_path=args.changes, full=args.full, dedup=args.dedup)
         sys.exit(0 if success else 1)
     except KeyboardInterrupt:
         print("\n用户中断执行")
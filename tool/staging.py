@@ -0,0 +1,105 @@
+"""
+xlsx 转换后的中间文件（暂存格式）
+
+默认仍为 CSV。设置环境变量 STAGING_FORMAT=arrow 时改为 Arrow IPC 文件（需要安装 pyarrow）：
+  - 列和类型固定（STAGING_SCHEMA，与 ES 映射一致）：序号 为整数，其余字段都是字符串，
+    不会再出现 分数、答案 被推断成数字或 NaN 的情况；映射之外的列不写入
+  - 不压缩，导入时以内存映射方式打开，直接读取列数据，不需要再逐字符解析文本
+
+转换工具、导入工具和监控程序都通过 STAGING_FORMAT 决定中间文件的扩展名，切换格式后第一次全量转换
+会重新生成全部文件并删除旧格式的文件，增量导入会把它们当作新文件导入、并删除旧文件的文档。
+"""
+import os
+import math
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+STAGING_FORMAT = os.getenv('STAGING_FORMAT', 'csv')
+STAGING_EXTENSIONS = {'csv': '.csv', 'arrow': '.arrow'}
+STAGING_EXTENSION = STAGING_EXTENSIONS.get(STAGING_FORMAT, '.csv')
+
+# 暂存文件的字段（顺序即文件中的列顺序），除 序号 外都是字符串
+STAGING_COLUMNS = ["序号", "题干", "选项A", "选项B", "选项C", "选项D", "选项E", "选项F", "选项G", "选项H",
+                   "答案", "分数", "解析", "标签"]
+STAGING_SCHEMA = pa.schema([(name, pa.int64() if name == "序号" else pa.string()) for name in STAGING_COLUMNS]) \
+    if pa is not None else None
+
+
+def check_staging_format():
+    """检查 STAGING_FORMAT 是否可用，不可用时抛出 RuntimeError"""
+    if STAGING_FORMAT not in STAGING_EXTENSIONS:
+        raise RuntimeError(f"STAGING_FORMAT 只能是 {' / '.join(STAGING_EXTENSIONS)}")
+    if STAGING_FORMAT == 'arrow' and pa is None:
+        raise RuntimeError("STAGING_FORMAT=arrow 需要安装 pyarrow")
+
+
+def is_staged_file(filename):
+    """是否为当前格式的中间文件"""
+    return filename.endswith(STAGING_EXTENSION) and not filename.startswith('~$')
+
+
+def text_value(value):
+    """单元格转字符串：空值为 None，Excel 中的整数（读入后可能是 5.0）写成 "5" """
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def serial_value(value):
+    """序号转整数，无法转换时为 None（ES 映射中 序号 为 integer）"""
+    text = text_value(value)
+    try:
+        return int(text) if text is not None else None
+    except ValueError:
+        return None
+
+
+def arrow_table(df):
+    """按 STAGING_SCHEMA 把 DataFrame 转换为 pyarrow.Table"""
+    columns = []
+    for name in STAGING_COLUMNS:
+        if name in df.columns:
+            # 列名去空格后可能重名，与 CSV 一样取最后一列
+            values = df.loc[:, name]
+            values = values.iloc[:, -1] if values.ndim == 2 else values
+            convert = serial_value if name == "序号" else text_value
+            columns.append([convert(value) for value in values.tolist()])
+        else:
+            columns.append([None] * len(df))
+    return pa.Table.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, STAGING_SCHEMA)],
+                                schema=STAGING_SCHEMA)
+
+
+def arrow_bytes(df):
+    """DataFrame 转为 Arrow IPC 文件的内容（与 write_arrow 写出的文件逐字节相同）"""
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, STAGING_SCHEMA) as writer:
+        writer.write_table(arrow_table(df))
+    return sink.getvalue().to_pybytes()
+
+
+def write_arrow(df, path):
+    """按 STAGING_SCHEMA 把 DataFrame 写成 Arrow IPC 文件，返回写入的行数"""
+    table = arrow_table(df)
+    tmp_path = path + '.tmp'
+    with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, STAGING_SCHEMA) as writer:
+        writer.write_table(table)
+    os.replace(tmp_path, path)
+    return table.num_rows
+
+
+def read_arrow(path):
+    """以内存映射方式读取 Arrow IPC 文件，返回 pyarrow.Table（列数据直接引用映射的文件，不复制）"""
+    with pa.memory_map(path, 'r') as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def read_arrow_bytes(data):
+    """从内存中的 Arrow IPC 文件内容读取 pyarrow.Table（流式导入时使用，不落盘）"""
+    return pa.ipc.open_file(pa.py_buffer(data)).read_all()
@@ -1,16 +1,181 @@
 import os
+import json
+import argparse
+import numpy as np
 import pandas as pd
 from elasticsearch import Elasticsearch
-from elasticsearch.helpers import bulk, parallel_bulk
+from elasticsearch.helpers import scan
+from openpyxl import load_workbook
 import logging
 import hashlib
+import io
 import re  # 新增导入
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import time
+import threading
+import unicodedata
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from bulk_sender import BulkSender, read_dead_letters
+from local_search import LOCAL_SEARCH_FILE, LocalSearchWriter
+from staging import is_staged_file, read_arrow, read_arrow_bytes
+from tool_xlsx_to_csv2 import SOURCE_DIRECTORIES, collect_xlsx_files, csv_name_for, load_changes
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 标签 n-gram 子字段的最大长度：不超过这个长度的子串查询走 标签.ngram 的 term 查询，
+# 更长的查询词才退回到 wildcard（网站 search_service.py 中的 TAG_NGRAM_MAX_GRAM 必须与此一致）
+TAG_NGRAM_MAX_GRAM = 15
+
+# 合并检索字段：题干、选项、解析、标签通过 copy_to 写入该字段（网站 search_service.py 中的 COMBINED_FIELD 必须与此一致）
+COMBINED_FIELD = "全文"
+
+# 选项字段：原先映射里误写成 "选项 A"（带空格），实际字段由动态映射生成为 text + keyword，
+# 这里显式写出同样的结构，精准查询仍可使用 选项X.keyword
+OPTION_FIELDS = [f"选项{letter}" for letter in "ABCDEFGH"]
+OPTION_FIELD_MAPPING = {"type": "text", "copy_to": COMBINED_FIELD,
+                        "fields": {"keyword": {"type": "keyword", "ignore_above": 256}}}
+
+# 索引映射（create_index_if_not_exists 中的字段、分析器）的版本，修改映射时加 1。
+# 版本记录在导入清单中，增量导入发现线上索引的版本不同（含没有记录版本的旧索引）时改为全量重建，
+# 避免继续向缺少新字段（如 标签.ngram、全文）的旧索引写入
+MAPPING_VERSION = 1
+
+# 全量重建期间新索引的设置：新索引尚未对外提供查询，关闭定时 refresh 和副本，
+# 写入结束后（finish_bulk_load）再恢复，副本一次性从合并好的分段复制
+BULK_LOAD_SETTINGS = {"refresh_interval": "-1", "number_of_replicas": 0}
+
+# 恢复副本时没有线上版本可参照（第一次导入）的副本数
+DEFAULT_REPLICAS = 1
+
+# 流式导入时每攒够这么多条文档写入一次本地全文库
+LOCAL_BATCH_SIZE = 1000
+
+# 项目根目录，以及导入过程中产生的中间文件（清单等）的存放目录
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ARTIFACT_DIR = os.path.join(PROJECT_DIR, 'data', 'es_artifacts')
+
+
+# 保留范围：中文、英文、数字、常用标点符号、空格
+# 移除 Emoji、特殊符号等多字节字符（预编译，避免每个单元格都走一次 re 的缓存查找）
+CLEAN_TEXT_PATTERN = re.compile(r'[^\u4e00-\u9fa5a-zA-Z0-9\.\-\(\)\s，。？！、；：""''…—_/\[\]]')
+
+
+# 输入提示短语的分隔符：题干形如“永冠新材-胶带”（股票名-题材），标签形如“x0-其他-0”
+SUGGEST_SPLIT_PATTERN = re.compile(r'[\-—－_/、，,；;：:\s()（）]+')
+# 编号一类的片段（x0、12）不作为提示词
+SUGGEST_SKIP_PATTERN = re.compile(r'[xX]?\d+')
+# 完整题干超过这个长度时不作为提示词，只保留拆分出的片段
+SUGGEST_MAX_LENGTH = 30
+
+# 计算题目指纹时去除的空白字符
+FINGERPRINT_SPACE_PATTERN = re.compile(r'\s+')
+
+# 重复题目之间可能不一致的字段：一方为空时取不为空的一方；都不为空且不同时记为冲突并写入日志，
+# 解析 保留较长（通常更完整）的一条，答案 无法比较优劣，保留第一条
+CONFLICT_FIELDS = ('答案', '解析')
+
+
+def suggest_phrases(source):
+    """从一条文档的 题干、标签 中提取输入提示短语：完整文本及按分隔符拆出的片段"""
+    phrases = set()
+    for field in ('题干', '标签'):
+        # 跨文件去重后合并的文档，标签为列表
+        values = source.get(field)
+        for text in values if isinstance(values, list) else [values]:
+            if not isinstance(text, str):
+                continue
+            text = text.strip()
+            if 2 <= len(text) <= SUGGEST_MAX_LENGTH:
+                phrases.add(text)
+            for part in SUGGEST_SPLIT_PATTERN.split(text):
+                if len(part) >= 2 and not SUGGEST_SKIP_PATTERN.fullmatch(part):
+                    phrases.add(part)
+    return phrases
+
+
+def normalize_question_text(value):
+    """计算指纹用的规范化文本：全角转半角（NFKC）、去除全部空白、英文转小写"""
+    if value is None:
+        return ''
+    return FINGERPRINT_SPACE_PATTERN.sub('', unicodedata.normalize('NFKC', str(value))).lower()
+
+
+def question_fingerprint(doc):
+    """
+    题目指纹：规范化后的 题干 和 选项A~H 拼接求 md5，同一道题出现在不同题材文件中时指纹相同
+    题干为空的行无法判断是否为同一道题，返回 None
+    """
+    stem = normalize_question_text(doc.get('题干'))
+    if not stem:
+        return None
+    parts = [stem] + [normalize_question_text(doc.get(field)) for field in OPTION_FIELDS]
+    return hashlib.md5('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+def merge_field_value(doc, field, value):
+    """把 value 并入 doc[field]：只有一个取值时保持原样，出现不同的取值时改为去重后的列表"""
+    current = doc.get(field)
+    if value is None or value == current:
+        return
+    values = current if isinstance(current, list) else ([] if current is None else [current])
+    if value not in values:
+        doc[field] = values + [value]
+
+
+def merge_conflict_field(doc, field, value):
+    """按 CONFLICT_FIELDS 的规则把重复题目的 value 并入 doc[field]，两者都不为空且不同时返回 True"""
+    current = doc.get(field)
+    if value is None or value == current:
+        return False
+    if current is None:
+        doc[field] = value
+        return False
+    if field == '解析' and len(str(value)) > len(str(current)):
+        doc[field] = value
+    return True
+
+
+def merge_duplicate_docs(file_docs):
+    """
+    跨文件合并重复的题目，返回 (合并后的文档列表, 统计)
+    file_docs 为 [(文件名, 文档列表)]，按顺序处理：同一指纹的文档保留第一条的内容，
+    标签、file_hash 合并为去重后的列表，source_files 记录全部来源文件（第一个为该文档的归属文件），
+    答案、解析 按 CONFLICT_FIELDS 的规则取值，不一致时记录指纹和来源文件；
+    有指纹的文档以指纹作为 unique_id，与所在文件无关，没有指纹的文档按原 unique_id 去重
+    """
+    merged = {}
+    rows = 0
+    unique_ids = set()
+    conflicts = 0
+    for file_name, docs in file_docs:
+        for doc in docs:
+            rows += 1
+            unique_ids.add(doc['unique_id'])
+            fingerprint = question_fingerprint(doc)
+            key = fingerprint or doc['unique_id']
+            kept = merged.get(key)
+            if kept is None:
+                kept = dict(doc, source_files=[file_name])
+                if fingerprint:
+                    kept['unique_id'] = fingerprint
+                merged[key] = kept
+                continue
+            merge_field_value(kept, '标签', doc.get('标签'))
+            merge_field_value(kept, 'file_hash', doc['file_hash'])
+            if file_name not in kept['source_files']:
+                kept['source_files'].append(file_name)
+            fields = [field for field in CONFLICT_FIELDS if merge_conflict_field(kept, field, doc.get(field))]
+            if fields:
+                conflicts += 1
+                logger.warning(f"重复题目 {key} 的{'、'.join(fields)}不一致：{kept['source_files'][0]} 与 {file_name}")
+    docs = list(merged.values())
+    # docs_before：不去重时索引中的文档数（同一文件中完全相同的行本来就共用一个 _id）
+    stats = {'rows': rows, 'docs_before': len(unique_ids), 'docs': len(docs),
+             'merged_docs': sum(1 for doc in docs if len(doc['source_files']) > 1), 'conflicts': conflicts}
+    return docs, stats
+
 
 def clean_text(text):
     """
@@ -20,12 +185,45 @@ def clean_text(text):
     if not isinstance(text, str):
         return text
 
-    # 保留范围：中文、英文、数字、常用标点符号、空格
-    # 移除 Emoji、特殊符号等多字节字符
-    cleaned = re.sub(r'[^\u4e00-\u9fa5a-zA-Z0-9\.\-\(\)\s，。？！、；：""''…—_/\[\]]', '', text)
+    cleaned = CLEAN_TEXT_PATTERN.sub('', text)
     return cleaned.strip()
 
 
+def field_value(col, value):
+    """
+    单个字段值的转换规则：空值为 None，“序号”能转成整数的转成 int，否则保留字符串，其余字段清洗为文本
+    流式导入逐行使用；按列的批量版本见 coerce_serial_column 和 clean_text_column，结果与逐个调用相同
+    """
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if col == "序号":
+        try:
+            return int(value)
+        except (TypeError, ValueError, OverflowError):
+            return str(value)
+    return clean_text(str(value))
+
+
+def clean_text_column(values):
+    """按列批量清洗文本，values 为非空原始值，结果与逐个调用 clean_text(str(value)) 相同"""
+    sub = CLEAN_TEXT_PATTERN.sub
+    return [sub('', str(value)).strip() for value in values]
+
+
+def coerce_serial_column(values):
+    """
+    按列转换“序号”：能转成整数的转成 int，否则保留字符串，结果与逐个 int(value) 相同
+    整列都是整数或有限浮点数时一次性转换，只有混杂文本的列才逐个尝试
+    """
+    kind = pd.api.types.infer_dtype(values, skipna=False)
+    if kind == 'integer':
+        return [int(value) for value in values.tolist()]
+    if kind == 'floating':
+        floats = values.astype(np.float64)
+        if np.isfinite(floats).all() and (np.abs(floats) < 2 ** 63).all():
+            return floats.astype(np.int64).tolist()
+
+    return [field_value("序号", value) for value in values]
 
 
 class CSVToElasticsearchImporter:
@@ -38,8 +236,37 @@ class CSVToElasticsearchImporter:
                 'scheme': 'http'
             }]
         )
+        # 对外查询使用的别名，数据实际存放在带版本号的索引 stockinfo_vN 中
         self.index_name = "stockinfo"
+        # 保留的版本索引数量（含当前版本），用于出问题时快速回滚
+        self.keep_versions = 3
+        # 新版本文档数低于线上版本的这个比例时，认为导入异常，不切换别名
+        self.min_doc_ratio = 0.5
         self.csv_directory = r"D:\03-code\pycharm\stock\flaskJuanwang_es\data\csv"
+        # 增量导入清单：记录每个 CSV 文件的内容 hash 和文档数
+        self.manifest_path = os.path.join(ARTIFACT_DIR, 'import_manifest.json')
+        # 数据版本文件：每次发布新数据后改写，网站据此让查询缓存失效
+        self.generation_path = os.path.join(ARTIFACT_DIR, 'generation.json')
+        # 标签词典（标签及文档数），网站的 /tags 直接读取，不再每次聚合
+        self.tags_path = os.path.join(ARTIFACT_DIR, 'tags.json')
+        # 输入提示词典（题干、标签中的短语及文档数），网站的 /suggest 据此做前缀匹配
+        self.suggest_path = os.path.join(ARTIFACT_DIR, 'suggest.json')
+        # 本地全文库：与 ES 写入相同的文档，ES 不可用时网站改查这里（见 local_search.py）
+        self.local_search_path = LOCAL_SEARCH_FILE
+        # 批量写入：同时写入的文件数（线程数），以及每个 bulk 请求的最大字节数（按字节而不是条数分块，
+        # 题干和解析很长的文件也不会产生过大的请求）
+        self.bulk_threads = 4
+        self.bulk_chunk_bytes = 10 * 1024 * 1024
+        # 被拒绝（429 / 5xx）或超时的文档的最大重试次数；仍然失败的文档写入死信文件，可用 --replay-dead-letter 重放
+        self.max_retries = 5
+        self.dead_letter_path = os.path.join(ARTIFACT_DIR, 'dead_letter.ndjson')
+        # 全量重建结束后恢复的副本数（None 表示沿用线上版本索引的设置），以及发布前是否把新索引合并为一个分段
+        self.number_of_replicas = None
+        self.force_merge = False
+        # 全量重建时是否跨文件合并重复的题目（同一道题出现在多个题材文件中时只保留一条文档，标签合并）
+        self.dedup = False
+        # 最近一次导入的统计：模式、目标索引、总数以及每个文件的行数和耗时，供流程编排记录
+        self.last_run = None
 
     def delete_index_if_exists(self):
         """删除现有的索引（如果存在）"""
@@ -54,55 +281,276 @@ class CSVToElasticsearchImporter:
             logger.info(f"索引 {self.index_name} 不存在，无需删除")
         return True
 
-    def create_index_if_not_exists(self):
-        """创建索引（如果不存在）"""
-        if not self.es.indices.exists(index=self.index_name):
+    def create_index_if_not_exists(self, index=None, bulk_load=False):
+        """创建索引（如果不存在），默认创建别名同名的索引；bulk_load 为 True 时使用全量重建期间的设置"""
+        index = index or self.index_name
+        if not self.es.indices.exists(index=index):
             mapping = {
+                "settings": {
+                    "index": {"max_ngram_diff": TAG_NGRAM_MAX_GRAM - 1, **(BULK_LOAD_SETTINGS if bulk_load else {})},
+                    "analysis": {
+                        "tokenizer": {
+                            # 不限制字符类别，标签中的任意子串（含标点、空格）都会被索引
+                            "tag_ngram": {"type": "ngram", "min_gram": 1, "max_gram": TAG_NGRAM_MAX_GRAM,
+                                          "token_chars": []}
+                        },
+                        "analyzer": {
+                            "tag_ngram": {"type": "custom", "tokenizer": "tag_ngram"}
+                        }
+                    }
+                },
                 "mappings": {
                     "properties": {
                         "序号": {"type": "integer"},
-                        "题干": {"type": "text"},
-                        "选项 A": {"type": "text"},
-                        "选项 B": {"type": "text"},
-                        "选项 C": {"type": "text"},
-                        "选项 D": {"type": "text"},
-                        "选项 E": {"type": "text"},
-                        "选项 F": {"type": "text"},
-                        "选项 G": {"type": "text"},
-                        "选项 H": {"type": "text"},
-                        "解析": {"type": "text"},
+                        "题干": {"type": "text", "copy_to": COMBINED_FIELD},
+                        **{field: OPTION_FIELD_MAPPING for field in OPTION_FIELDS},
+                        "解析": {"type": "text", "copy_to": COMBINED_FIELD},
                         "分数": {"type": "keyword"},
                         "答案": {"type": "text"},
-                        "标签": {"type": "text"},
+                        # 网站的 /tags 聚合依赖 标签.keyword；标签.ngram 索引了标签的全部子串，
+                        # 精准查询的标签子串匹配用 term 查询它，代替扫描整个词典的前导通配符查询
+                        "标签": {"type": "text", "copy_to": COMBINED_FIELD, "fields": {
+                            "keyword": {"type": "keyword", "ignore_above": 256},
+                            "ngram": {"type": "text", "analyzer": "tag_ngram", "search_analyzer": "keyword",
+                                      "index_options": "docs", "norms": False}
+                        }},
+                        # 题干、选项、解析、标签合并后的检索字段，全字段搜索只需查询这一个字段；
+                        # index_phrases 额外索引相邻两个词，短语查询不必再逐个比对位置
+                        COMBINED_FIELD: {"type": "text", "index_phrases": True},
                         "file_hash": {"type": "keyword"},
+                        # 跨文件去重后文档的来源文件（见 merge_duplicate_docs）
+                        "source_files": {"type": "keyword"},
                         "unique_id": {"type": "keyword"}
                     }
                 }
             }
             try:
-                self.es.indices.create(index=self.index_name, body=mapping)
-                logger.info(f"索引 {self.index_name} 创建成功")
+                self.es.indices.create(index=index, body=mapping)
+                logger.info(f"索引 {index} 创建成功")
             except Exception as e:
                 logger.error(f"创建索引失败：{e}")
                 return False
         else:
-            logger.info(f"索引 {self.index_name} 已存在")
+            logger.info(f"索引 {index} 已存在")
+        return True
+
+    def list_versions(self):
+        """列出所有版本索引，按版本号从小到大排列"""
+        versions = []
+        for name in self.es.indices.get(index=f"{self.index_name}_v*"):
+            suffix = name[len(self.index_name) + 2:]
+            if suffix.isdigit():
+                versions.append((int(suffix), name))
+        return [name for _, name in sorted(versions)]
+
+    def get_live_index(self):
+        """返回别名当前指向的版本索引，别名不存在时返回 None"""
+        if not self.es.indices.exists_alias(name=self.index_name):
+            return None
+        aliases = self.es.indices.get_alias(name=self.index_name)
+        return next(iter(aliases), None)
+
+    def next_version_index(self):
+        """生成下一个版本索引的名称"""
+        versions = self.list_versions()
+        last = int(versions[-1].rsplit('_v', 1)[1]) if versions else 0
+        return f"{self.index_name}_v{last + 1}"
+
+    def live_replicas(self):
+        """线上版本索引的副本数；没有线上版本或读取失败时为 DEFAULT_REPLICAS"""
+        try:
+            live = self.get_live_index()
+            if live is None:
+                return DEFAULT_REPLICAS
+            settings = self.es.indices.get_settings(index=live, name='index.number_of_replicas')
+            return int(settings[live]['settings']['index']['number_of_replicas'])
+        except Exception as e:
+            logger.warning(f"读取线上索引的副本数失败，使用默认值 {DEFAULT_REPLICAS}：{e}")
+            return DEFAULT_REPLICAS
+
+    def finish_bulk_load(self, index):
+        """全量写入结束：恢复 refresh，按需合并分段，最后恢复副本（与线上版本一致，或 number_of_replicas 指定的值）"""
+        self.es.indices.put_settings(index=index, settings={"refresh_interval": None})
+        self.es.indices.refresh(index=index)
+        if self.force_merge:
+            start_time = time.perf_counter()
+            self.es.options(request_timeout=3600).indices.forcemerge(index=index, max_num_segments=1)
+            logger.info(f"索引 {index} 已合并为一个分段，耗时 {time.perf_counter() - start_time:.1f} 秒")
+        replicas = self.number_of_replicas if self.number_of_replicas is not None else self.live_replicas()
+        self.es.indices.put_settings(index=index, settings={"number_of_replicas": replicas})
+
+    def verify_index(self, index, expected_docs):
+        """切换别名前检查新索引的文档数"""
+        self.es.indices.refresh(index=index)
+        count = self.es.count(index=index)['count']
+        if count == 0 or count < expected_docs:
+            logger.error(f"索引 {index} 文档数异常：实际 {count} 条，预期至少 {expected_docs} 条")
+            return False
+
+        live = self.get_live_index()
+        if live:
+            live_count = self.es.count(index=live)['count']
+            if count < live_count * self.min_doc_ratio:
+                logger.error(f"索引 {index} 仅有 {count} 条文档，远少于线上版本 {live} 的 {live_count} 条")
+                return False
+        logger.info(f"索引 {index} 校验通过，共 {count} 条文档")
+        return True
+
+    def publish_index(self, index):
+        """把别名原子地切换到指定的版本索引"""
+        actions = [{"add": {"index": index, "alias": self.index_name}}]
+        live = self.get_live_index()
+        if live:
+            actions.insert(0, {"remove": {"index": live, "alias": self.index_name}})
+        elif self.es.indices.exists(index=self.index_name):
+            # 旧版本直接用 stockinfo 作为索引名，在同一个原子操作中删除它，别名才能接管这个名字
+            actions.insert(0, {"remove_index": {"index": self.index_name}})
+        self.es.indices.update_aliases(actions=actions)
+        logger.info(f"别名 {self.index_name} 已切换：{live or '无'} -> {index}")
+
+    def prune_versions(self):
+        """删除多余的旧版本索引，保留最近 keep_versions 个版本"""
+        live = self.get_live_index()
+        versions = self.list_versions()
+        for index in versions[:-self.keep_versions]:
+            if index == live:
+                continue
+            try:
+                self.es.indices.delete(index=index)
+                logger.info(f"已删除旧版本索引：{index}")
+            except Exception as e:
+                logger.error(f"删除旧版本索引 {index} 失败：{e}")
+
+    def rollback(self):
+        """把别名切回上一个版本索引"""
+        live = self.get_live_index()
+        versions = self.list_versions()
+        if live not in versions or versions.index(live) == 0:
+            logger.error("没有可以回滚的旧版本")
+            return False
+        previous = versions[versions.index(live) - 1]
+        self.publish_index(previous)
+        self.rebuild_local_search(previous)
+        self.write_artifacts(previous)
+        # 回滚后清单与线上数据不再对应，下次增量导入会自动执行全量重建
         return True
 
     def read_csv_files(self):
-        """读取目录中的所有 CSV 文件"""
+        """读取目录中的所有中间文件（CSV 或 Arrow，见 staging.STAGING_FORMAT）"""
         csv_files = []
         if not os.path.exists(self.csv_directory):
             logger.error(f"目录 {self.csv_directory} 不存在")
             return csv_files
 
         for file in os.listdir(self.csv_directory):
-            if file.endswith('.csv') and not file.startswith('~$'):
+            if is_staged_file(file):
                 csv_files.append(os.path.join(self.csv_directory, file))
 
         logger.info(f"找到 {len(csv_files)} 个 CSV 文件")
         return csv_files
 
+    def compute_file_hash(self, file_path):
+        """
+        计算文件的内容 hash（文件名 + 文件内容）
+        文件内容不变 hash 就不变；加入文件名是为了避免两个内容相同的文件共用一个 hash，
+        增量删除时误删另一个文件的数据
+        """
+        md5 = hashlib.md5(os.path.basename(file_path).encode('utf-8'))
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                md5.update(block)
+        return md5.hexdigest()[:10]
+
+    def load_manifest(self):
+        """读取增量导入清单，不存在或损坏时返回 None"""
+        if not os.path.exists(self.manifest_path):
+            return None
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取导入清单失败，将执行全量导入：{e}")
+            return None
+        return manifest
+
+    def save_manifest(self, index, files, dedup=False):
+        """
+        保存增量导入清单（先写临时文件再替换，避免中途中断留下半个文件）
+        dedup 记录索引是否经过跨文件去重，去重的索引不能按文件增量更新；
+        mapping_version 记录索引创建时的映射版本（MAPPING_VERSION）
+        """
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        manifest = {'index': index, 'files': files, 'dedup': dedup, 'mapping_version': MAPPING_VERSION}
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def write_artifacts(self, index):
+        """发布新数据后生成网站使用的文件：先写标签词典和输入提示词典，最后写数据版本号"""
+        self.write_tag_dictionary(index)
+        self.write_suggest_dictionary(index)
+        self.write_generation(index)
+
+    def write_tag_dictionary(self, index):
+        """聚合新索引中的全部标签及文档数，写入标签词典"""
+        try:
+            self.es.indices.refresh(index=index)
+            result = self.es.search(index=index, size=0, aggs={
+                "tags": {"terms": {"field": "标签.keyword", "size": 10000}}
+            })
+        except Exception as e:
+            logger.error(f"生成标签词典失败：{e}")
+            return
+        tags = [{'tag': bucket['key'], 'count': bucket['doc_count']}
+                for bucket in result['aggregations']['tags']['buckets']]
+        os.makedirs(os.path.dirname(self.tags_path), exist_ok=True)
+        tmp_path = self.tags_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'index': index, 'tags': tags}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.tags_path)
+        logger.info(f"标签词典已更新，共 {len(tags)} 个标签")
+
+    def write_suggest_dictionary(self, index):
+        """扫描新索引中全部文档的 题干、标签，统计每个提示短语出现在多少条文档中，写入输入提示词典"""
+        counts = Counter()
+        try:
+            for hit in scan(self.es, index=index, query={"match_all": {}}, _source=['题干', '标签'], size=2000):
+                counts.update(suggest_phrases(hit['_source']))
+        except Exception as e:
+            logger.error(f"生成输入提示词典失败：{e}")
+            return
+        entries = [{'text': text, 'weight': weight} for text, weight in counts.most_common()]
+        os.makedirs(os.path.dirname(self.suggest_path), exist_ok=True)
+        tmp_path = self.suggest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'index': index, 'entries': entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.suggest_path)
+        logger.info(f"输入提示词典已更新，共 {len(entries)} 个短语")
+
+    def write_generation(self, index):
+        """发布新的数据版本号，网站的查询缓存据此整体失效"""
+        os.makedirs(os.path.dirname(self.generation_path), exist_ok=True)
+        generation = {'index': index, 'generation': time.time_ns(), 'published_at': time.strftime('%Y-%m-%d %H:%M:%S')}
+        tmp_path = self.generation_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(generation, f, ensure_ascii=False)
+        os.replace(tmp_path, self.generation_path)
+
+    def delete_docs_by_file_hash(self, index, file_hash):
+        """删除某个文件版本（file_hash）导入的全部文档"""
+        try:
+            result = self.es.delete_by_query(
+                index=index,
+                query={"term": {"file_hash": file_hash}},
+                conflicts='proceed',
+                refresh=False
+            )
+            return result.get('deleted', 0)
+        except Exception as e:
+            logger.error(f"删除 file_hash={file_hash} 的文档失败：{e}")
+            return None
+
     def generate_unique_id(self, row_data, file_hash):
         """生成基于行数据和文件 hash 的唯一 ID"""
         data_str = ''.join([f"{k}:{v}" for k, v in sorted(row_data.items()) if k not in ['file_hash', 'unique_id']])
@@ -111,111 +559,678 @@ class CSVToElasticsearchImporter:
 
 
 
-    def process_csv_to_bulk(self, file_path):
+    def row_to_doc(self, row, file_hash):
+        """把一行原始数据（{字段: 单元格的值}）转换为 ES 文档，转换规则与 dataframe_to_docs 相同（见 field_value）"""
+        doc = {col: field_value(col, value) for col, value in row.items()}
+        doc['file_hash'] = file_hash
+        doc['unique_id'] = self.generate_unique_id(doc, file_hash)
+        return doc
+
+    def dataframe_to_docs(self, df, file_hash):
+        """
+        按列批量把 DataFrame 转换为 ES 文档列表
+        逐列完成空值判断、“序号”转换和文本清洗，再按行拼装文档并批量计算 unique_id；
+        生成的文档（字段顺序、取值）和 _id 与逐行 iterrows 的旧实现完全一致
+        """
+        columns = list(df.columns)
+        # 与 iterrows 一样基于 df.values 取值，保证全数值表格的类型提升行为一致
+        matrix = df.values
+        row_count = len(df)
+
+        column_values = {}
+        for position, col in enumerate(columns):
+            values = matrix[:, position]
+            null_mask = pd.isna(values)
+            converted = [None] * row_count
+            present = np.flatnonzero(~null_mask)
+            if len(present):
+                if col == "序号":
+                    cleaned = coerce_serial_column(values[present])
+                else:
+                    cleaned = clean_text_column(values[present])
+                for row_position, value in zip(present.tolist(), cleaned):
+                    converted[row_position] = value
+            # 重名列与逐行赋值一样：保留首次出现的位置，取最后一列的值
+            column_values[col] = converted
+        return self.columns_to_docs(column_values, row_count, file_hash)
+
+    def table_to_docs(self, table, file_hash):
+        """
+        把 Arrow 中间文件的表转换为 ES 文档列表，规则与 dataframe_to_docs 相同
+        序号 已经是整数、空值已经是 None，只需清洗文本列
+        """
+        column_values = {}
+        for name, column in zip(table.column_names, table.columns):
+            values = column.to_pylist()
+            if name != "序号":
+                present = [position for position, value in enumerate(values) if value is not None]
+                for position, value in zip(present, clean_text_column([values[p] for p in present])):
+                    values[position] = value
+            column_values[name] = values
+        return self.columns_to_docs(column_values, table.num_rows, file_hash)
+
+    def columns_to_docs(self, column_values, row_count, file_hash):
+        """按列转换好的字段值（{字段: 每行的值}）拼装为文档，并批量计算 unique_id"""
+        names = list(column_values)
+        rows = list(zip(*column_values.values())) if names else [()] * row_count
+
+        # generate_unique_id 的批量版本：按字段名排序后逐列拼出 "k:v"，再逐行拼接求 md5
+        id_names = sorted(name for name in names if name not in ['file_hash', 'unique_id'])
+        id_parts = [[f"{name}:{value}" for value in column_values[name]] for name in id_names]
+        prefix = f"{file_hash}_"
+        unique_ids = [hashlib.md5((prefix + ''.join(parts)).encode('utf-8')).hexdigest()
+                      for parts in (zip(*id_parts) if id_parts else [()] * row_count)]
+
+        docs = []
+        for values, unique_id in zip(rows, unique_ids):
+            doc = dict(zip(names, values))
+            doc['file_hash'] = file_hash
+            doc['unique_id'] = unique_id
+            docs.append(doc)
+        return docs
+
+    def staged_to_docs(self, source, file_name, file_hash):
+        """
+        把中间文件转换为文档列表，格式由文件名的扩展名决定
+        source 为文件路径，或流式导入时内存中的文件内容（bytes）
+        """
+        if file_name.endswith('.arrow'):
+            # Arrow 中间文件：内存映射读取，列名和类型固定（见 staging.py），不经过 DataFrame
+            table = read_arrow(source) if isinstance(source, str) else read_arrow_bytes(source)
+            return self.table_to_docs(table, file_hash)
+
+        # 使用 pandas 读取 CSV
+        # 如果速度仍不够，可考虑添加 usecols 只读取需要的列
+        df = pd.read_csv(source if isinstance(source, str) else io.BytesIO(source), encoding='utf-8')
+
+        # 预处理列名，去除空格（与之前逻辑保持一致）
+        df.columns = [col.replace(' ', '') for col in df.columns]
+
+        # 按列批量转换，代替逐行 iterrows + 逐个单元格 clean_text
+        return self.dataframe_to_docs(df, file_hash)
+
+    def process_csv_to_bulk(self, file_path, file_hash=None, index=None, raise_errors=False):
         """
         【优化版】将 CSV 文件处理成 bulk 操作格式
         核心优化：移除了每行查询 ES 的逻辑，直接生成动作列表。
-        因为上层逻辑已经删除了旧索引，所以所有数据都是新的，直接写入即可。
+        全量导入时索引是新建的；增量导入时 file_hash 随文件内容变化，_id 也随之变化，
+        旧版本的文档由上层按旧 file_hash 删除，所以这里直接写入即可。
+        空文件返回空列表；读取出错时记录日志并返回空列表，raise_errors 为 True 时改为抛出异常
         """
         actions = []
-        file_hash = hashlib.md5(file_path.encode('utf-8')).hexdigest()[:10]
+        index = index or self.index_name
+        if file_hash is None:
+            file_hash = self.compute_file_hash(file_path)
 
         try:
-            # 使用 pandas 读取 CSV
-            # 如果速度仍不够，可考虑添加 usecols 只读取需要的列
-            df = pd.read_csv(file_path, encoding='utf-8')
-
-            # 预处理列名，去除空格（与之前逻辑保持一致）
-            df.columns = [col.replace(' ', '') for col in df.columns]
-
-            for index, row in df.iterrows():
-                doc = {}
-                for col in df.columns:
-                    value = row[col]
-                    if pd.isna(value):
-                        doc[col] = None
-                    else:
-                        if col == "序号":
-                            try:
-                                doc[col] = int(value)
-                            except:
-                                doc[col] = str(value)
-                        else:
-                            # doc[col] = str(value)
-                            # 新增：清洗文本数据，移除 Emoji 等特殊字符
-                            doc[col] = clean_text(str(value))
-
-                doc['file_hash'] = file_hash
-                unique_id = self.generate_unique_id(doc, file_hash)
-                doc['unique_id'] = unique_id
+            docs = self.staged_to_docs(file_path, os.path.basename(file_path), file_hash)
 
+            for doc in docs:
                 # 构建 bulk action
                 # 直接使用 unique_id 作为 _id，ES 会自动覆盖（虽然这里索引是新的，不会冲突）
-                action = {
-                    "_index": self.index_name,
-                    "_id": unique_id,
+                actions.append({
+                    "_index": index,
+                    "_id": doc['unique_id'],
                     "_source": doc
-                }
-                actions.append(action)
+                })
 
+        except pd.errors.EmptyDataError:
+            # 0 字节的文件（连表头都没有），没有数据
+            pass
         except Exception as e:
             logger.error(f"处理文件 {file_path} 时出错：{e}")
+            if raise_errors:
+                raise
 
         logger.info(f"文件 {os.path.basename(file_path)} 准备完成，共 {len(actions)} 条记录")
         return actions
 
     def import_all_csv(self):
-        """导入所有 CSV 文件到 Elasticsearch"""
-        if not self.delete_index_if_exists():
-            logger.error("无法删除旧索引，程序退出")
+        """
+        全量导入所有 CSV 文件到 Elasticsearch
+        数据写入新的版本索引，校验通过后再原子地切换别名，导入期间线上查询不受影响
+        """
+        csv_files = self.read_csv_files()
+        if not csv_files:
+            logger.warning("没有找到 CSV 文件")
             return False
 
-        if not self.create_index_if_not_exists():
+        new_index = self.next_version_index()
+        if not self.create_index_if_not_exists(new_index, bulk_load=True):
             logger.error("无法创建索引，程序退出")
             return False
 
-        csv_files = self.read_csv_files()
-        if not csv_files:
-            logger.warning("没有找到 CSV 文件")
+        local_writer = LocalSearchWriter.create(new_index, self.local_search_path)
+        try:
+            if self.dedup:
+                result = self.bulk_import_deduplicated(csv_files, new_index, local_writer)
+            else:
+                result = self.bulk_import_files(csv_files, new_index, local_writer)
+        except Exception:
+            # 未发布的新索引不能留下（仍是全量重建期间的设置，也会被当作最新版本）
+            self.discard_new_version(new_index, local_writer)
+            raise
+        self.record_run('full', new_index, result)
+        if not self.publish_new_version(new_index, result['files'], local_writer, dedup=self.dedup):
             return False
 
-        total_imported = 0
-        total_failed = 0
+        logger.info(f"=== 导入全部完成 ===\n总共成功：{result['imported']} 条\n总共失败：{result['failed']} 条")
+        return True
 
-        # 优化：逐个文件处理，但每个文件内部使用高效的 bulk
-        for file_path in csv_files:
-            logger.info(f"正在处理文件：{os.path.basename(file_path)}")
+    def record_run(self, mode, index, result):
+        """记录本次导入的统计，供 run_all_tool 的流程编排读取"""
+        self.last_run = {
+            'mode': mode,
+            'index': index,
+            'imported': result['imported'],
+            'retried': result.get('retried', 0),
+            'failed': result['failed'],
+            'seconds': result.get('seconds'),
+            'docs_per_second': result.get('docs_per_second'),
+            'file_stats': result['file_stats']
+        }
+        if result.get('dedup'):
+            dedup = result['dedup']
+            self.last_run['dedup'] = dedup
+            reduced = dedup['docs_before'] - dedup['docs']
+            # 没有任何文档（源文件都为空）时不计算减少的比例
+            ratio = f"（{reduced / dedup['docs_before']:.1%}）" if dedup['docs_before'] else ''
+            logger.info(f"跨文件去重：{dedup['docs_before']} 条 -> {dedup['docs']} 条，减少 {reduced} 条{ratio}，"
+                        f"{dedup['merged_docs']} 条文档由多个文件合并，{dedup['conflicts']} 处答案或解析不一致")
+        if result.get('docs_per_second') is not None:
+            logger.info(f"写入 {result['imported']} 条，耗时 {result['seconds']:.1f} 秒，"
+                        f"{result['docs_per_second']:.0f} 条/秒")
+        for stat in result['file_stats']:
+            if stat.get('retried') or stat['failed']:
+                logger.warning(f"文件 {stat['file']}：成功 {stat['success']} 条，重试 {stat.get('retried', 0)} 次，"
+                               f"失败 {stat['failed']} 条")
+        if result['failed']:
+            logger.warning(f"共 {result['failed']} 条文档写入失败，已记录到 {self.dead_letter_path}，"
+                           f"可用 --replay-dead-letter 重新写入")
 
-            actions = self.process_csv_to_bulk(file_path)
-            if not actions:
-                continue
+    def publish_new_version(self, new_index, files, local_writer, dedup=False):
+        """校验新建的版本索引，通过后切换别名、替换本地全文库、保存清单并清理旧版本"""
+        self.finish_bulk_load(new_index)
+        expected_docs = sum(entry['docs'] for entry in files.values())
+        if not self.verify_index(new_index, expected_docs):
+            logger.error(f"新索引 {new_index} 校验失败，保持线上版本不变")
+            self.discard_new_version(new_index, local_writer)
+            return False
 
-            try:
-                # 使用 bulk helpers 进行批量导入
-                # 移除了 request_timeout，因为它已在 ES 客户端初始化时设置
-                success, failed = bulk(
-                    self.es,
-                    actions,
-                    chunk_size=2000,
-                    raise_on_error=False
-                )
-                total_imported += success
-                total_failed += len(failed) if failed else 0
-
-                logger.info(f"文件 {os.path.basename(file_path)} 导入完成：成功 {success} 条")
-                if failed:
-                    logger.warning(f"文件 {os.path.basename(file_path)} 失败 {len(failed)} 条")
+        self.publish_index(new_index)
+        local_writer.publish()
+        self.save_manifest(new_index, files, dedup)
+        self.write_artifacts(new_index)
+        self.prune_versions()
+        return True
+
+    def discard_new_version(self, new_index, local_writer):
+        """删除未发布的新版本索引，并放弃本地全文库的临时文件，线上版本保持不变"""
+        try:
+            self.es.indices.delete(index=new_index, ignore_unavailable=True)
+            logger.info(f"已删除未发布的索引 {new_index}")
+        except Exception as e:
+            logger.error(f"删除索引 {new_index} 失败：{e}")
+        local_writer.discard()
+
+    def iter_xlsx_rows(self, xlsx_path):
+        """
+        以生成器方式逐行读取 xlsx 第一个工作表（与转换工具读取的工作表一致）
+        openpyxl 只读模式按需解析，内存占用与文件大小无关；整行为空的行跳过
+        """
+        workbook = load_workbook(xlsx_path, read_only=True, data_only=True)
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            # 列名处理与 read_xlsx 一致：去除空格，空表头按 pandas 的规则命名
+            columns = [str(col).replace(' ', '') if col is not None else f"Unnamed: {i}"
+                       for i, col in enumerate(header)]
+            for values in rows:
+                row = dict(zip(columns, values))
+                if all(value is None or value == '' for value in row.values()):
+                    continue
+                # 只读模式下行尾的空单元格可能不返回，补齐为 None
+                for col in columns[len(values):]:
+                    row[col] = None
+                yield row
+        finally:
+            workbook.close()
 
+    def iter_xlsx_actions(self, xlsx_files, index, stats, local_writer):
+        """
+        逐个 xlsx 文件、逐行生成 bulk 动作，同时分批写入本地全文库
+        内存中只有当前一批文档和当前文件的 _id 集合（用于统计去重后的文档数）；
+        写入结果按文档的 file_hash 汇总，再对应回 stats 中的文件。
+        file_hash 按 xlsx 文件计算（不生成中间文件），清单中的文件名仍与中间文件一致
+        """
+        for xlsx_path in xlsx_files:
+            file_name = csv_name_for(xlsx_path)
+            start_time = time.perf_counter()
+            file_stats = {'file_hash': self.compute_file_hash(xlsx_path), 'docs': 0, 'rows': 0,
+                          'success': 0, 'retried': 0, 'failed': 0, 'error': False, 'seconds': 0.0}
+            stats[file_name] = file_stats
+            ids = set()
+            batch = []
+            try:
+                for row in self.iter_xlsx_rows(xlsx_path):
+                    doc = self.row_to_doc(row, file_stats['file_hash'])
+                    file_stats['rows'] += 1
+                    ids.add(doc['unique_id'])
+                    batch.append(doc)
+                    if len(batch) >= LOCAL_BATCH_SIZE:
+                        local_writer.add_docs(batch)
+                        batch = []
+                    yield {
+                        "_index": index,
+                        "_id": doc['unique_id'],
+                        "_source": doc
+                    }
             except Exception as e:
-                logger.error(f"导入文件 {os.path.basename(file_path)} 时出错：{e}")
+                file_stats['error'] = True
+                logger.error(f"读取文件 {xlsx_path} 时出错：{e}")
+            local_writer.add_docs(batch)
+            file_stats['docs'] = len(ids)
+            # 读取与转换耗时（包含等待 bulk 分块发送的时间）
+            file_stats['seconds'] = time.perf_counter() - start_time
+            logger.info(f"文件 {file_name} 读取完成，共 {file_stats['docs']} 条记录")
+
+    def import_xlsx_streaming(self, source_dirs=SOURCE_DIRECTORIES):
+        """
+        流式全量导入：直接从 xlsx 逐行读取，经 BulkSender 并发写入新的版本索引，
+        不再经过 data/csv 的落盘和回读；内存中只有当前一批文档和有限个 bulk 分块。
+        清单按中间文件的文件名记录，file_hash 则是 xlsx 文件的 hash，
+        所以之后第一次增量导入会把每个文件都当作变化，按中间文件重新写入并删除流式导入的文档
+        """
+        # 两个源目录有同名文件时以后面目录中的为准（与转换工具一致）
+        xlsx_files = list({csv_name_for(path): path for path in collect_xlsx_files(source_dirs)}.values())
+        if not xlsx_files:
+            logger.warning("没有找到 xlsx 文件")
+            return False
+        if self.dedup:
+            logger.warning("流式导入逐个文件写入，不做跨文件去重")
+
+        new_index = self.next_version_index()
+        if not self.create_index_if_not_exists(new_index, bulk_load=True):
+            logger.error("无法创建索引，程序退出")
+            return False
+
+        stats = {}
+        local_writer = LocalSearchWriter.create(new_index, self.local_search_path)
+        start_time = time.perf_counter()
+        try:
+            results = self.create_bulk_sender().send(
+                self.iter_xlsx_actions(xlsx_files, new_index, stats, local_writer),
+                key=lambda action: action['_source']['file_hash'])
+        except Exception:
+            self.discard_new_version(new_index, local_writer)
+            raise
+        for file_stats in stats.values():
+            file_stats.update(results.get(file_stats['file_hash'], {}))
+        # 读到一半出错的文件已经写入了部分文档，删除后该文件不计入清单，下次增量导入时重新处理
+        partial = [file_stats['file_hash'] for file_stats in stats.values()
+                   if file_stats['error'] and file_stats['rows']]
+        if partial:
+            self.es.indices.refresh(index=new_index)
+            for file_hash in partial:
+                self.delete_docs_by_file_hash(new_index, file_hash)
+                local_writer.delete_file_hash(file_hash)
+        total_imported = sum(file_stats['success'] for file_stats in stats.values())
+        total_failed = sum(file_stats['failed'] for file_stats in stats.values())
+
+        files = {}
+        seconds = time.perf_counter() - start_time
+        self.record_run('stream', new_index, {
+            'imported': total_imported,
+            'retried': sum(file_stats['retried'] for file_stats in stats.values()),
+            'failed': total_failed,
+            'seconds': seconds,
+            'docs_per_second': total_imported / seconds if seconds else None,
+            'file_stats': [{'file': file_name, 'rows': file_stats['rows'], 'success': file_stats['success'],
+                            'retried': file_stats['retried'], 'failed': file_stats['failed'],
+                            'seconds': file_stats['seconds']}
+                           for file_name, file_stats in stats.items()]
+        })
+        for file_name, file_stats in stats.items():
+            if not file_stats['failed'] and not file_stats['error'] and file_stats['docs']:
+                files[file_name] = {'file_hash': file_stats['file_hash'], 'docs': file_stats['docs']}
+
+        if not self.publish_new_version(new_index, files, local_writer):
+            return False
+
+        logger.info(f"=== 流式导入全部完成 ===\n总共成功：{total_imported} 条\n总共失败：{total_failed} 条")
+        return True
+
+    def bulk_import_files(self, csv_files, index, local_writer=None):
+        """
+        导入多个文件，返回导入统计以及每个文件的清单记录
+        bulk_threads 个文件同时写入；只有全部写入成功的文件才会记入清单，失败的文件下次增量导入时会被重新处理；
+        传入 local_writer 时，这些文件的文档同时写入本地全文库（在各文件的工作线程中加锁写入）。
+        每个文件的文档在它的工作线程结束时即可释放，内存中只有正在处理的 bulk_threads 个文件
+        """
+        files = {}
+        file_stats = {}
+        sender = self.create_bulk_sender()
+        local_lock = threading.Lock()
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.bulk_threads) as executor:
+            futures = {executor.submit(self.bulk_import_file, file_path, index, sender, local_writer, local_lock):
+                       file_path for file_path in csv_files}
+            for future in as_completed(futures):
+                file_name = os.path.basename(futures.pop(future))
+                stat, entry = future.result()
+                if stat is None:
+                    continue
+                file_stats[file_name] = stat
+                if entry is not None:
+                    files[file_name] = entry
+        seconds = time.perf_counter() - start_time
+
+        # 统计按文件原来的顺序排列
+        ordered = [file_stats[name] for name in map(os.path.basename, csv_files) if name in file_stats]
+        imported = sum(stat['success'] for stat in ordered)
+        return {'imported': imported, 'retried': sum(stat['retried'] for stat in ordered),
+                'failed': sum(stat['failed'] for stat in ordered), 'files': files, 'file_stats': ordered,
+                'seconds': seconds, 'docs_per_second': imported / seconds if seconds else None}
+
+    def bulk_import_deduplicated(self, csv_files, index, local_writer=None):
+        """
+        跨文件去重后导入：先转换全部文件，用 merge_duplicate_docs 合并重复的题目，再统一写入
+        文件按文件名排序处理，合并后的文档归属于第一个来源文件：写入统计按归属文件汇总，
+        清单中各文件的文档数之和等于索引中的文档数（完全重复、没有归属文档的文件记为 0 条）
+        """
+        start_time = time.perf_counter()
+        file_hashes = {}
+        file_rows = {}
+        file_docs = []
+        for file_path in sorted(csv_files, key=os.path.basename):
+            file_name = os.path.basename(file_path)
+            file_hashes[file_name] = self.compute_file_hash(file_path)
+            actions = self.process_csv_to_bulk(file_path, file_hashes[file_name], index)
+            file_rows[file_name] = len(actions)
+            file_docs.append((file_name, [action['_source'] for action in actions]))
+        docs, dedup = merge_duplicate_docs(file_docs)
+        transform_seconds = time.perf_counter() - start_time
+
+        results = self.create_bulk_sender().send(
+            ({"_index": index, "_id": doc['unique_id'], "_source": doc} for doc in docs),
+            key=lambda action: action['_source']['source_files'][0])
+        owned = Counter(doc['source_files'][0] for doc in docs)
+
+        files = {}
+        file_stats = []
+        for file_name, rows in file_rows.items():
+            counts = results.get(file_name, {})
+            stat = {'file': file_name, 'rows': rows, 'docs': owned[file_name], 'success': counts.get('success', 0),
+                    'retried': counts.get('retried', 0), 'failed': counts.get('failed', 0)}
+            file_stats.append(stat)
+            if not stat['failed']:
+                files[file_name] = {'file_hash': file_hashes[file_name], 'docs': owned[file_name]}
+        if local_writer is not None:
+            local_writer.add_docs(doc for doc in docs if doc['source_files'][0] in files)
+        seconds = time.perf_counter() - start_time
+        logger.info(f"转换与去重耗时 {transform_seconds:.1f} 秒")
 
-        logger.info(f"=== 导入全部完成 ===\n总共成功：{total_imported} 条\n总共失败：{total_failed} 条")
+        imported = sum(stat['success'] for stat in file_stats)
+        return {'imported': imported, 'retried': sum(stat['retried'] for stat in file_stats),
+                'failed': sum(stat['failed'] for stat in file_stats), 'files': files, 'file_stats': file_stats,
+                'seconds': seconds, 'docs_per_second': imported / seconds if seconds else None, 'dedup': dedup}
+
+    def create_bulk_sender(self):
+        """本次导入使用的 BulkSender：多个文件共用，在途请求数统一按 AIMD 调整"""
+        return BulkSender(self.es, self.dead_letter_path, max_chunk_bytes=self.bulk_chunk_bytes,
+                          max_concurrency=self.bulk_threads, max_retries=self.max_retries)
+
+    def bulk_import_file(self, file_path, index, sender, local_writer=None, local_lock=None):
+        """
+        把一个 CSV 文件写入 ES，返回 (统计, 清单记录)
+        文件读取出错时统计为 None；重试后仍有写入失败时清单记录为 None；
+        文件没有数据（源文件已清空）时清单记为 0 条，增量导入据此删除该文件的旧文档。
+        全部写入成功且传入 local_writer 时，文档同时写入本地全文库（多个线程共用，由 local_lock 串行化）
+        """
+        file_name = os.path.basename(file_path)
+        logger.info(f"正在处理文件：{file_name}")
+
+        start_time = time.perf_counter()
+        file_hash = self.compute_file_hash(file_path)
+        try:
+            actions = self.process_csv_to_bulk(file_path, file_hash, index, raise_errors=True)
+        except Exception:
+            return None, None
+        transform_seconds = time.perf_counter() - start_time
+
+        stat = {'file': file_name, 'rows': len(actions), 'success': 0, 'retried': 0, 'failed': 0,
+                'transform_seconds': transform_seconds, 'bulk_seconds': 0.0}
+        entry = None
+        start_time = time.perf_counter()
+        try:
+            stat.update(sender.send(actions, key=lambda action: file_name).get(file_name, {}))
+            logger.info(f"文件 {file_name} 导入完成：成功 {stat['success']} 条")
+            if not stat['failed']:
+                # 同一文件中完全相同的行会生成相同的 _id，这里记录去重后的文档数
+                entry = {'file_hash': file_hash, 'docs': len({action['_id'] for action in actions})}
+        except Exception as e:
+            stat['failed'] = len(actions) - stat['success']
+            logger.error(f"导入文件 {file_name} 时出错：{e}")
+        stat['bulk_seconds'] = time.perf_counter() - start_time
+        if entry is not None and local_writer is not None:
+            with local_lock:
+                local_writer.add_docs(action['_source'] for action in actions)
+        return stat, entry
+
+    def replay_dead_letter(self):
+        """
+        把死信文件中的文档重新写入线上索引（别名当前指向的版本），仍然失败的文档写入新的死信文件
+        重放中途退出时，下次从上次未完成的文件继续
+        """
+        replay_path = self.dead_letter_path + '.replaying'
+        if not os.path.exists(replay_path):
+            if not os.path.exists(self.dead_letter_path):
+                logger.info("没有死信文件，无需重放")
+                return True
+            os.replace(self.dead_letter_path, replay_path)
+
+        index = self.get_live_index() or self.index_name
+        entries = read_dead_letters(replay_path)
+        file_names = {action['_id']: file_name for file_name, action in entries}
+        results = self.create_bulk_sender().send(
+            (dict(action, _index=index) for _, action in entries),
+            key=lambda action: file_names[action['_id']])
+        self.es.indices.refresh(index=index)
+        os.remove(replay_path)
+
+        failed = 0
+        for file_name, counts in results.items():
+            failed += counts['failed']
+            logger.info(f"重放 {file_name}：成功 {counts['success']} 条，重试 {counts['retried']} 次，"
+                        f"失败 {counts['failed']} 条")
+        logger.info(f"死信重放完成：共 {len(entries)} 条，仍失败 {failed} 条")
+        return failed == 0
+
+    def import_incremental(self, csv_names=None):
+        """
+        增量导入：根据清单中记录的内容 hash，只重新导入新增或修改过的 CSV 文件，
+        并删除已修改或已移除文件的旧文档。索引或清单不存在、或线上索引的映射版本不是当前版本时退回到全量导入。
+        csv_names 为监控程序给出的变化文件名，传入时只检查这些文件，不再扫描整个目录；
+        线上索引经过跨文件去重时，文件有变化就重建去重的新版本
+        """
+        manifest = self.load_manifest()
+        live_index = self.get_live_index()
+        if manifest is not None and manifest.get('dedup'):
+            # 线上索引经过跨文件去重，需要重建时同样去重（不去重可用 --full 重建）
+            self.dedup = True
+        if manifest is None or live_index is None or manifest.get('index') != live_index:
+            logger.info("没有可用的导入清单或清单与线上索引不一致，执行全量导入")
+            return self.import_all_csv()
+        if manifest.get('mapping_version') != MAPPING_VERSION:
+            logger.info(f"线上索引的映射版本 {manifest.get('mapping_version')} 与当前版本 {MAPPING_VERSION} 不同，"
+                        f"执行全量重建")
+            return self.import_all_csv()
+
+        old_files = manifest.get('files', {})
+        if csv_names is None:
+            csv_files = self.read_csv_files()
+            current = {os.path.basename(path): path for path in csv_files}
+            removed = [name for name in old_files if name not in current]
+        else:
+            # 清单中未涉及的文件视为未变化，原样保留
+            current = {name: os.path.join(self.csv_directory, name) for name in old_files}
+            removed = []
+            for name in csv_names:
+                path = os.path.join(self.csv_directory, name)
+                if os.path.exists(path):
+                    current[name] = path
+                elif name in old_files:
+                    current.pop(name)
+                    removed.append(name)
+            changed_names = set(csv_names)
+
+        changed = []
+        for file_name, file_path in current.items():
+            if csv_names is not None and file_name not in changed_names:
+                continue
+            entry = old_files.get(file_name)
+            if entry is None or entry.get('file_hash') != self.compute_file_hash(file_path):
+                changed.append(file_path)
+
+        if not changed and not removed:
+            logger.info("所有 CSV 文件均未变化，无需导入")
+            self.record_run('incremental', live_index, {'imported': 0, 'failed': 0, 'file_stats': []})
+            return True
+
+        if self.dedup:
+            # 合并后的文档来自多个文件，无法按 file_hash 删除某个文件的旧数据，改为重建去重的新版本
+            logger.info("线上索引为跨文件去重的索引，文件变化后执行全量重建")
+            return self.import_all_csv()
+
+        logger.info(f"增量导入：变化 {len(changed)} 个文件，删除 {len(removed)} 个文件")
+
+        # 本地全文库不存在或与线上索引不对应时（如刚回滚），导入完成后从 ES 重建
+        local_writer = LocalSearchWriter.open(live_index, self.local_search_path)
+
+        # 先写入新版本的文档，再删除旧版本，尽量缩短数据缺失的时间窗口
+        result = self.bulk_import_files(changed, live_index, local_writer)
+        self.record_run('incremental', live_index, result)
+        self.last_run['removed'] = removed
+        files = {name: entry for name, entry in old_files.items() if name in current}
+
+        for file_path in changed:
+            file_name = os.path.basename(file_path)
+            new_entry = result['files'].get(file_name)
+            old_entry = old_files.get(file_name)
+            if new_entry is None:
+                # 导入失败：清单保留旧记录和旧文档，下次增量导入时重新处理
+                continue
+            if old_entry and old_entry['file_hash'] != new_entry['file_hash']:
+                deleted = self.delete_docs_by_file_hash(live_index, old_entry['file_hash'])
+                if deleted is None:
+                    # 删除失败时保留旧记录：下次增量导入时文件仍被视为变化，重新写入（_id 相同，直接覆盖）
+                    # 并再次删除旧文档，不会遗留无主的旧文档
+                    continue
+                logger.info(f"文件 {file_name} 已更新，删除旧文档 {deleted} 条")
+                if local_writer is not None:
+                    local_writer.delete_file_hash(old_entry['file_hash'])
+            files[file_name] = new_entry
+
+        for file_name in removed:
+            deleted = self.delete_docs_by_file_hash(live_index, old_files[file_name]['file_hash'])
+            if deleted is None:
+                # 删除失败时保留清单记录，下次继续尝试删除
+                files[file_name] = old_files[file_name]
+                continue
+            logger.info(f"文件 {file_name} 已移除，删除文档 {deleted} 条")
+            if local_writer is not None:
+                local_writer.delete_file_hash(old_files[file_name]['file_hash'])
+
+        self.es.indices.refresh(index=live_index)
+        if local_writer is not None:
+            local_writer.publish()
+        else:
+            self.rebuild_local_search(live_index)
+        self.save_manifest(live_index, files)
+        self.write_artifacts(live_index)
+
+        logger.info(f"=== 增量导入完成 ===\n总共成功：{result['imported']} 条\n总共失败：{result['failed']} 条")
+        return True
+
+    def rebuild_local_search(self, index):
+        """从 ES 索引读出全部文档，重建本地全文库（回滚后，或本地库与线上索引不对应时）"""
+        local_writer = LocalSearchWriter.create(index, self.local_search_path)
+        try:
+            batch = []
+            for hit in scan(self.es, index=index, query={"match_all": {}}, size=2000):
+                batch.append(hit['_source'])
+                if len(batch) >= 2000:
+                    local_writer.add_docs(batch)
+                    batch = []
+            local_writer.add_docs(batch)
+        except Exception as e:
+            local_writer.discard()
+            logger.error(f"重建本地全文库失败：{e}")
+            return False
+        local_writer.publish()
+        logger.info(f"本地全文库已从 {index} 重建")
+        return True
+
+    def build_local_search_only(self):
+        """
+        只根据 CSV 生成本地全文库，不访问 ES；用于 ES 不可用时单独提供搜索，或在没有 ES 的环境中测试网站
+        库中记录的索引名取自导入清单，之后的增量导入可以直接在这个库上继续
+        """
+        csv_files = self.read_csv_files()
+        if not csv_files:
+            logger.warning("没有找到 CSV 文件")
+            return False
+        manifest = self.load_manifest() or {}
+        local_writer = LocalSearchWriter.create(manifest.get('index', self.index_name), self.local_search_path)
+        if manifest.get('dedup') or self.dedup:
+            # 与线上索引一致，同样跨文件去重
+            docs, _ = merge_duplicate_docs(
+                (os.path.basename(file_path), [action['_source'] for action in self.process_csv_to_bulk(file_path)])
+                for file_path in sorted(csv_files, key=os.path.basename))
+            local_writer.add_docs(docs)
+        else:
+            for file_path in csv_files:
+                local_writer.add_docs(action['_source'] for action in self.process_csv_to_bulk(file_path))
+        local_writer.publish()
+        logger.info(f"本地全文库已生成：{self.local_search_path}")
         return True
 
 
 def main():
+    parser = argparse.ArgumentParser(description='将 CSV 文件导入 Elasticsearch')
+    parser.add_argument('--full', action='store_true', help='重建新版本索引并切换别名（默认增量导入）')
+    parser.add_argument('--stream', action='store_true', help='直接从 xlsx 流式全量导入，不经过 CSV')
+    parser.add_argument('--rollback', action='store_true', help='把别名切回上一个版本索引')
+    parser.add_argument('--changes', help='监控程序写出的变化清单（JSON），增量导入时只检查其中的文件')
+    parser.add_argument('--bulk-threads', type=int, default=4, help='同时写入 ES 的文件数（默认 4）')
+    parser.add_argument('--force-merge', action='store_true', help='全量重建后、切换别名前把新索引合并为一个分段')
+    parser.add_argument('--replay-dead-letter', action='store_true', help='把死信文件中写入失败的文档重新写入线上索引')
+    parser.add_argument('--local-only', action='store_true', help='只根据 CSV 生成本地全文库，不访问 ES')
+    parser.add_argument('--dedup', action='store_true', help='全量重建时跨文件合并重复的题目（标签合并为列表）')
+    args = parser.parse_args()
+
     importer = CSVToElasticsearchImporter()
-    success = importer.import_all_csv()
+    importer.bulk_threads = max(1, args.bulk_threads)
+    importer.force_merge = args.force_merge
+    importer.dedup = args.dedup
+    if args.rollback:
+        success = importer.rollback()
+    elif args.replay_dead_letter:
+        success = importer.replay_dead_letter()
+    elif args.local_only:
+        success = importer.build_local_search_only()
+    elif args.stream:
+        success = importer.import_xlsx_streaming()
+    elif args.full:
+        success = importer.import_all_csv()
+    elif args.changes:
+        changes = load_changes(args.changes)
+        csv_names = sorted({csv_name_for(path) for paths in changes.values() for path in paths})
+        success = importer.import_incremental(csv_names)
+    else:
+        success = importer.import_incremental()
     if success:
         logger.info("所有 CSV 文件导入完成")
     else:
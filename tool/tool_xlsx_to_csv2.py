@@ -1,11 +1,121 @@
 import os
+import json
+import time
+import hashlib
+import argparse
 import pandas as pd
 from concurrent.futures import ProcessPoolExecutor, as_completed
+from staging import STAGING_EXTENSION, STAGING_EXTENSIONS, STAGING_FORMAT, arrow_bytes, check_staging_format
+
+# 定义源目录列表
+SOURCE_DIRECTORIES = [
+    r"E:\BaiduSyncdisk\7-花牛大叔\6-卷王-题材细分\1-0-100",
+    r"E:\BaiduSyncdisk\7-花牛大叔\6-卷王-题材细分"
+]
+TARGET_DIRECTORY = r"D:\03-code\pycharm\stock\flaskJuanwang_es\data\csv"
+
+# 转换缓存文件（放在目标目录中）：记录每个 xlsx 上次转换时的大小、修改时间、内容 hash 和行数
+CACHE_FILE_NAME = '.conversion_cache.json'
+
+
+def csv_name_for(xlsx_path):
+    """
+    xlsx 文件对应的中间文件名（所有源目录的文件都平铺到同一个目标目录）
+    扩展名由 staging.STAGING_FORMAT 决定，默认为 .csv
+    """
+    return os.path.basename(xlsx_path).replace('.xlsx', STAGING_EXTENSION)
+
+
+def load_changes(changes_path):
+    """读取监控程序写出的变化清单：{"added": [...], "modified": [...], "deleted": [...]}"""
+    with open(changes_path, 'r', encoding='utf-8') as f:
+        changes = json.load(f)
+    return {kind: changes.get(kind, []) for kind in ('added', 'modified', 'deleted')}
+
+
+class ConversionCache:
+    """
+    xlsx 转换缓存：大小和修改时间都没变、对应的 CSV 仍在时直接跳过；
+    修改时间变了（如同步工具重写了文件）再比较内容 hash，内容相同也跳过
+    """
+
+    def __init__(self, target_dir):
+        self.path = os.path.join(target_dir, CACHE_FILE_NAME)
+        self.entries = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f).get('files', {})
+        except (OSError, ValueError, AttributeError):
+            pass
+
+    @staticmethod
+    def content_hash(xlsx_path):
+        md5 = hashlib.md5()
+        with open(xlsx_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                md5.update(block)
+        return md5.hexdigest()
+
+    def fingerprint(self, xlsx_path):
+        stat = os.stat(xlsx_path)
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def lookup(self, xlsx_path, csv_path):
+        """
+        返回 (缓存记录, 当前指纹)：文件未变化时缓存记录不为 None
+        当前指纹在需要比较内容时才带有 hash
+        """
+        fingerprint = self.fingerprint(xlsx_path)
+        entry = self.entries.get(os.path.abspath(xlsx_path))
+        if entry is None or not os.path.exists(csv_path) or entry['size'] != fingerprint['size']:
+            return None, fingerprint
+        if entry['mtime_ns'] == fingerprint['mtime_ns']:
+            return entry, fingerprint
+        fingerprint['hash'] = self.content_hash(xlsx_path)
+        if fingerprint['hash'] != entry['hash']:
+            return None, fingerprint
+        # 内容未变，只更新修改时间，下次不必再算 hash
+        entry['mtime_ns'] = fingerprint['mtime_ns']
+        return entry, fingerprint
+
+    def record(self, xlsx_path, fingerprint, rows):
+        if 'hash' not in fingerprint:
+            fingerprint = dict(fingerprint, hash=self.content_hash(xlsx_path))
+        self.entries[os.path.abspath(xlsx_path)] = dict(fingerprint, rows=rows, csv=csv_name_for(xlsx_path))
+
+    def forget(self, xlsx_path):
+        self.entries.pop(os.path.abspath(xlsx_path), None)
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'files': self.entries}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+def read_xlsx(xlsx_path):
+    """读取 xlsx 的第一个工作表并去除表头中的空格"""
+    # engine='openpyxl' 通常对 .xlsx 更高效
+    df = pd.read_excel(xlsx_path, engine='openpyxl')
+    df.columns = [col.replace(' ', '') for col in df.columns]
+    return df
+
+
+def staged_content(df):
+    """
+    DataFrame 转为中间文件的内容（bytes），格式由 STAGING_FORMAT 决定
+    """
+    if STAGING_FORMAT == 'arrow':
+        # 按固定的列和类型写成 Arrow IPC 文件
+        return arrow_bytes(df)
+    # index=False 避免写入行索引，encoding='utf-8' 保证兼容性
+    return df.to_csv(index=False).encode('utf-8')
 
 
 def convert_single_file(args):
     """
     单个文件的转换逻辑，用于多进程调用
+    返回转换结果：{'file', 'ok', 'rows', 'seconds', 'message'}
     """
     xlsx_path, target_dir = args
     filename = os.path.basename(xlsx_path)
@@ -14,37 +124,33 @@ def convert_single_file(args):
     if filename.startswith('~$'):
         return None
 
+    start_time = time.perf_counter()
+    result = {'file': filename, 'ok': False, 'rows': 0, 'seconds': 0.0}
     try:
-        # 读取第一个工作表
-        # engine='openpyxl' 通常对 .xlsx 更高效
-        df = pd.read_excel(xlsx_path, engine='openpyxl')
-
-        # 去除表头中的空格
-        df.columns = [col.replace(' ', '') for col in df.columns]
+        df = read_xlsx(xlsx_path)
 
         # 生成目标 csv 文件名
-        csv_filename = filename.replace('.xlsx', '.csv')
+        csv_filename = csv_name_for(xlsx_path)
         csv_path = os.path.join(target_dir, csv_filename)
 
-        # 保存为 csv 文件
-        # index=False 避免写入行索引，encoding='utf-8' 保证兼容性
-        df.to_csv(csv_path, index=False, encoding='utf-8')
+        # 先写临时文件再替换，避免中途中断留下半个文件
+        tmp_path = csv_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(staged_content(df))
+        os.replace(tmp_path, csv_path)
 
-        return f"已转换：{filename} -> {csv_filename}"
+        result.update(ok=True, rows=len(df), message=f"已转换：{filename} -> {csv_filename}")
     except Exception as e:
-        return f"转换 {filename} 时出错：{str(e)}"
+        result['message'] = f"转换 {filename} 时出错：{str(e)}"
+    result['seconds'] = time.perf_counter() - start_time
+    return result
 
 
-def convert_xlsx_to_csv_parallel(source_dirs, target_dir):
+def collect_xlsx_files(source_dirs):
     """
-    并行转换多个目录下的 xlsx 文件
+    收集多个目录下的 xlsx 文件（不含子目录，跳过 ~$ 开头的临时文件）
     """
-    # 创建目标目录
-    if not os.path.exists(target_dir):
-        os.makedirs(target_dir)
-
-    # 收集所有需要处理的任务
-    tasks = []
+    xlsx_files = []
     for source_dir in source_dirs:
         if not os.path.exists(source_dir):
             print(f"警告：源目录不存在 - {source_dir}")
@@ -52,39 +158,149 @@ def convert_xlsx_to_csv_parallel(source_dirs, target_dir):
 
         for filename in os.listdir(source_dir):
             if filename.endswith('.xlsx') and not filename.startswith('~$'):
-                xlsx_path = os.path.join(source_dir, filename)
-                tasks.append((xlsx_path, target_dir))
+                xlsx_files.append(os.path.join(source_dir, filename))
+    return xlsx_files
 
-    print(f"共发现 {len(tasks)} 个文件待转换，开始并行处理...")
+
+def convert_xlsx_to_csv_parallel(source_dirs, target_dir, executor=None, force=False):
+    """
+    并行转换多个目录下的 xlsx 文件，未变化的文件跳过，并删除源文件已不存在的 CSV
+    两个源目录有同名文件时以后面目录中的为准（与 apply_xlsx_changes 一致）
+    """
+    xlsx_files = list({csv_name_for(path): path for path in collect_xlsx_files(source_dirs)}.values())
+    results = convert_files(xlsx_files, target_dir, executor, force)
+    if all(os.path.exists(source_dir) for source_dir in source_dirs):
+        # 源目录缺失（如网盘未挂载）时不清理，避免误删全部 CSV
+        prune_stale_csvs(xlsx_files, target_dir)
+    return results
+
+
+def prune_stale_csvs(xlsx_files, target_dir):
+    """删除目标目录中没有对应 xlsx 的中间文件（包括切换格式后旧格式的文件），返回删除的文件名"""
+    expected = {csv_name_for(path) for path in xlsx_files}
+    removed = sorted(name for name in os.listdir(target_dir)
+                     if os.path.splitext(name)[1] in STAGING_EXTENSIONS.values() and name not in expected)
+    for name in removed:
+        os.remove(os.path.join(target_dir, name))
+        print(f"已删除（源文件不存在）：{name}")
+
+    cache = ConversionCache(target_dir)
+    current = {os.path.abspath(path) for path in xlsx_files}
+    stale = [path for path in cache.entries if path not in current]
+    if stale:
+        for path in stale:
+            cache.forget(path)
+        cache.save()
+    return removed
+
+
+def convert_files(xlsx_files, target_dir, executor=None, force=False):
+    """
+    并行转换指定的 xlsx 文件，返回每个文件的转换结果（未变化而跳过的文件 cached 为 True）
+    executor 为调用方持有的进程池（常驻流程复用，避免每次重新启动子进程）；不传时临时创建
+    force 为 True 时忽略转换缓存，全部重新转换
+    """
+    check_staging_format()
+
+    # 创建目标目录
+    if not os.path.exists(target_dir):
+        os.makedirs(target_dir)
+
+    # 未变化的文件直接跳过，只把需要转换的文件交给进程池
+    cache = ConversionCache(target_dir)
+    results = []
+    tasks = []
+    fingerprints = {}
+    for xlsx_path in xlsx_files:
+        if os.path.basename(xlsx_path).startswith('~$'):
+            continue
+        entry, fingerprint = cache.lookup(xlsx_path, os.path.join(target_dir, csv_name_for(xlsx_path)))
+        if entry is not None and not force:
+            results.append({'file': os.path.basename(xlsx_path), 'ok': True, 'rows': entry['rows'],
+                            'seconds': 0.0, 'cached': True})
+            continue
+        fingerprints[xlsx_path] = fingerprint
+        tasks.append((xlsx_path, target_dir))
+
+    if not tasks:
+        if results:
+            cache.save()
+            print(f"共 {len(results)} 个文件，均未变化，无需转换")
+        return results
+
+    print(f"共发现 {len(tasks)} 个文件待转换（{len(results)} 个未变化已跳过），开始并行处理...")
 
     success_count = 0
     error_count = 0
 
     # 使用进程池并行执行
     # max_workers 默认为 CPU 核心数，可根据实际情况调整
-    with ProcessPoolExecutor() as executor:
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor()
+    try:
         # 提交所有任务
         future_to_file = {executor.submit(convert_single_file, task): task[0] for task in tasks}
 
         for future in as_completed(future_to_file):
             result = future.result()
             if result:
-                if result.startswith("已转换"):
-                    print(result)
+                print(result['message'])
+                results.append(result)
+                xlsx_path = future_to_file[future]
+                if result['ok']:
                     success_count += 1
+                    cache.record(xlsx_path, fingerprints[xlsx_path], result['rows'])
                 else:
-                    print(result)
                     error_count += 1
+                    cache.forget(xlsx_path)
+    finally:
+        if own_executor:
+            executor.shutdown()
+        cache.save()
 
     print(f"\n处理完成：成功 {success_count} 个，失败 {error_count} 个")
+    return results
+
+
+def apply_xlsx_changes(changes, source_dirs, target_dir, executor=None):
+    """
+    只处理监控程序传来的变化文件：新增/修改的 xlsx 重新转换，已删除的 xlsx 删除对应的 CSV
+    返回受影响的 CSV 文件名列表（交给导入工具做增量导入）和每个文件的转换结果
+    """
+    affected = set()
+    to_convert = [path for path in changes['added'] + changes['modified'] if os.path.exists(path)]
+
+    for xlsx_path in changes['deleted']:
+        csv_name = csv_name_for(xlsx_path)
+        affected.add(csv_name)
+        # 两个源目录可能有同名文件，另一个目录里的文件还在时改为转换它
+        survivors = [os.path.join(source_dir, os.path.basename(xlsx_path)) for source_dir in source_dirs]
+        survivors = [path for path in survivors if os.path.exists(path)]
+        if survivors:
+            to_convert.append(survivors[-1])
+            continue
+
+        csv_path = os.path.join(target_dir, csv_name)
+        if os.path.exists(csv_path):
+            os.remove(csv_path)
+            print(f"已删除：{csv_name}")
+        cache = ConversionCache(target_dir)
+        cache.forget(xlsx_path)
+        cache.save()
+
+    affected.update(csv_name_for(path) for path in to_convert)
+    results = convert_files(to_convert, target_dir, executor)
+    return sorted(affected), results
 
 
 if __name__ == "__main__":
-    # 定义源目录列表
-    source_directories = [
-        r"E:\BaiduSyncdisk\7-花牛大叔\6-卷王-题材细分\1-0-100",
-        r"E:\BaiduSyncdisk\7-花牛大叔\6-卷王-题材细分"
-    ]
-    target_directory = r"D:\03-code\pycharm\stock\flaskJuanwang_es\data\csv"
-
-    convert_xlsx_to_csv_parallel(source_directories, target_directory)
+    parser = argparse.ArgumentParser(description='将 xlsx 文件转换为 csv 文件')
+    parser.add_argument('--changes', help='监控程序写出的变化清单（JSON），只转换其中的文件')
+    parser.add_argument('--force', action='store_true', help='忽略转换缓存，全部重新转换')
+    args = parser.parse_args()
+
+    if args.changes:
+        apply_xlsx_changes(load_changes(args.changes), SOURCE_DIRECTORIES, TARGET_DIRECTORY)
+    else:
+        convert_xlsx_to_csv_parallel(SOURCE_DIRECTORIES, TARGET_DIRECTORY, force=args.force)